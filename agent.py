@@ -180,6 +180,12 @@ _todo_list: list[dict] = []
 DEFAULT_CONFIG = {
     "model": "gpt-4.1-mini",
     "embedding_model": "text-embedding-3-small",
+    "embedding_dimensions": None,  # None = モデルの既定次元数 (text-embedding-3 系は 256 等に短縮可)
+    "pdf_max_in_flight_pages": 16,  # PDF 分析で描画〜Vision 応答待ちに保持するページ数の上限
+    "pdf_render_workers": None,  # PDF の描画・PNG エンコードのワーカープロセス数 (None = min(4, CPU 数))
+    "pdf_text_layer": True,  # テキストレイヤーの使えるページは Vision API を使わずローカルで Markdown 化する
+    "pdf_image_encoding": "adaptive",  # Vision に送る画像: "adaptive" (ページごとに形式・解像度を選ぶ) | "png"
+    "pdf_image_token_budget": None,  # "adaptive" の 1 ページあたりの画像トークンの目安 (None = 1800)
     "timeout": 120,
     "permission_mode": "ask",  # "ask" | "auto_read" | "auto_all"
     "max_context_messages": 200,
@@ -805,6 +811,86 @@ TOOLS = [
             },
         },
     },
+    {
+        "type": "function",
+        "function": {
+            "name": "rag_search",
+            "description": "database/ などの RAG 対象フォルダを横断検索し、関連ページを JSON で返す。"
+            "mode は hybrid（セマンティック + キーワード、第一選択）、semantic（抽象的な質問向け）、"
+            "keyword（キーワードの AND 検索）、passages（質問に答える段落の本文を返す。"
+            "ページ全文を読まずに答えられることが多い）。結果の file と page を rag_get_page に渡すと全文を取得できる。"
+            "複数フォルダは directories に並べると 1 回の呼び出しで並列に横断検索する。"
+            "page_type・section・doc を指定すると、該当するページだけに絞り込んでから検索する。"
+            "複数のクエリを同時に呼び出してよい。",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "query": {
+                        "type": "string",
+                        "description": "検索クエリ（keyword モードではスペース区切りのキーワード）",
+                    },
+                    "mode": {
+                        "type": "string",
+                        "enum": ["hybrid", "semantic", "keyword", "passages"],
+                        "description": "検索方式（省略時は hybrid）",
+                    },
+                    "top_k": {
+                        "type": "integer",
+                        "description": "返す結果の最大数（省略時は5）",
+                    },
+                    "directory": {
+                        "type": "string",
+                        "description": "検索対象フォルダ（省略時は database）",
+                    },
+                    "directories": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "横断検索する複数の検索対象フォルダ（指定時は directory より優先）。"
+                        "結果の directory を rag_get_page に渡す",
+                    },
+                    "page_type": {
+                        "type": "string",
+                        "description": "ページ種別で絞り込む（cover, toc, instruction, specification, troubleshooting, "
+                        "maintenance, safety, other。カンマ区切りで複数可）",
+                    },
+                    "section": {
+                        "type": "string",
+                        "description": "セクション見出しに部分一致するページに絞り込む",
+                    },
+                    "doc": {
+                        "type": "string",
+                        "description": "ドキュメント（ファイル名・相対パス・フォルダ）で絞り込む",
+                    },
+                },
+                "required": ["query"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "rag_get_page",
+            "description": "rag_search の結果のファイルの指定ページについて、要約・メタデータ・全文を JSON で返す。",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "file": {
+                        "type": "string",
+                        "description": "JSON ファイル名またはパス（rag_search の結果の file）",
+                    },
+                    "page": {
+                        "type": "integer",
+                        "description": "ページ番号",
+                    },
+                    "directory": {
+                        "type": "string",
+                        "description": "検索対象フォルダ（省略時は database）",
+                    },
+                },
+                "required": ["file", "page"],
+            },
+        },
+    },
     {
         "type": "function",
         "function": {
@@ -1267,6 +1353,138 @@ def tool_run_skill(name: str, arguments: str = "") -> str:
     return result
 
 
+_rag_module = None
+_rag_module_lock = threading.Lock()
+
+# rag スキルを無効化している間は rag_search / rag_get_page も提供・実行しない
+RAG_SKILL_NAME = "rag"
+RAG_TOOL_NAMES = {"rag_search", "rag_get_page"}
+
+
+def _rag_disabled(config: Optional[dict] = None) -> bool:
+    """rag スキルが無効化されているか。"""
+    config = _get_active_config() if config is None else config
+    return RAG_SKILL_NAME in config.get("_disabled_skills", set())
+
+
+def _available_tools(config: dict) -> list:
+    """モデルに渡すツール定義（無効化されたスキルのツールを除く）。"""
+    if not _rag_disabled(config):
+        return TOOLS
+    return [t for t in TOOLS if t["function"]["name"] not in RAG_TOOL_NAMES]
+
+
+def _load_rag_module():
+    """skills/rag/scripts/search_json.py を遅延ロードする。
+
+    読み込んだ JSON・embedding・コーパスインデックスはモジュール内のキャッシュに保持され、
+    プロセス内の全ての rag_search / rag_get_page 呼び出しで共有される。
+    """
+    global _rag_module
+    with _rag_module_lock:
+        if _rag_module is None:
+            import importlib.util
+            script = _PROJECT_DIR / "skills" / "rag" / "scripts" / "search_json.py"
+            spec = importlib.util.spec_from_file_location("search_json", script)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            _rag_module = module
+    return _rag_module
+
+
+def _rag_directory(directory: Optional[str]) -> str:
+    return _resolve_path(directory) if directory else os.path.join(os.getcwd(), "database")
+
+
+def _rag_rel(path: str, base: str) -> str:
+    try:
+        return Path(path).relative_to(base).as_posix()
+    except ValueError:
+        return path
+
+
+def tool_rag_search(query: str, mode: str = "hybrid", top_k: int = 5,
+                    directory: Optional[str] = None,
+                    directories: Optional[list] = None,
+                    page_type: Optional[str] = None,
+                    section: Optional[str] = None,
+                    doc: Optional[str] = None) -> str:
+    """RAG 対象フォルダ（複数可）を検索し、結果を JSON で返す。"""
+    if _rag_disabled():
+        return f"[error] スキル '{RAG_SKILL_NAME}' は現在無効化されています。"
+    bases = [_rag_directory(d) for d in directories] if directories else [_rag_directory(directory)]
+    missing = [b for b in bases if not os.path.isdir(b)]
+    if missing:
+        return f"[error] ディレクトリが見つかりません: {', '.join(missing)}"
+    rag = _load_rag_module()
+    target = bases if len(bases) > 1 else bases[0]
+    from pdf.facets import parse_filters
+    filters = parse_filters(page_type, section, doc)
+    if mode == "semantic":
+        found = rag.semantic_search(query, target, top_k, filters=filters)
+    elif mode == "keyword":
+        found = rag.keyword_search(query, target, filters)[:top_k]
+    elif mode == "passages":
+        found = rag.passage_search(query, target, top_k, filters=filters)
+    else:
+        found = rag.hybrid_search(query, target, top_k, filters=filters)
+
+    results = []
+    for r in found:
+        # 結果のファイルを含むフォルダ（rag_get_page の directory に渡す）
+        base = next((b for b in bases if _rag_rel(r["file"], b) != r["file"]), bases[0])
+        item = {
+            "file": _rag_rel(r["file"], base),
+            "page": r["page"],
+            "score": r["score"],
+        }
+        if "text" in r:
+            item["passage"] = r["passage"]
+            item["text"] = r["text"]
+        else:
+            item["summary"] = (r.get("summary") or "")[:200]
+        if len(bases) > 1:
+            item["directory"] = base
+        if "semantic_score" in r:
+            item["semantic"] = r["semantic_score"]
+            item["keyword"] = r["keyword_score"]
+        results.append(item)
+    body = {"query": query, "mode": mode, "results": results}
+    if filters:
+        body["filters"] = filters
+    if len(bases) > 1:
+        body["directories"] = bases
+    else:
+        body["directory"] = bases[0]
+    return json.dumps(body, ensure_ascii=False)
+
+
+def tool_rag_get_page(file: str, page: int, directory: Optional[str] = None) -> str:
+    """JSON ファイルの指定ページを JSON で返す。"""
+    if _rag_disabled():
+        return f"[error] スキル '{RAG_SKILL_NAME}' は現在無効化されています。"
+    base = _rag_directory(directory)
+    rag = _load_rag_module()
+    target = rag.resolve_json_file(file, base)
+    if target is None:
+        return f"[error] ファイル '{file}' が見つかりません（検索先: {base}）"
+    loaded = rag.load_page(target, page, base)
+    if loaded is None:
+        return f"[error] 不正な JSON 形式です: {target}"
+    entry, pages = loaded
+    if entry is None:
+        return f"[error] Page {page} が '{target.name}' に見つかりません。利用可能なページ: {pages}"
+    metadata = entry.get("metadata", {})
+    return json.dumps({
+        "file": _rag_rel(str(target), base),
+        "page": page,
+        "summary": entry.get("summary", ""),
+        "topics": metadata.get("topics", []),
+        "keywords": metadata.get("keywords", []),
+        "content": entry.get("content", ""),
+    }, ensure_ascii=False)
+
+
 def tool_think(thought: str) -> str:
     """ReAct の Thought ステップ。推論内容を表示し、進行状況をユーザーに伝える。"""
     if _is_output_mode():
@@ -1309,10 +1527,13 @@ TOOL_FUNCTIONS = {
     "grep": tool_grep,
     "get_file_info": tool_get_file_info,
     "run_skill": tool_run_skill,
+    "rag_search": tool_rag_search,
+    "rag_get_page": tool_rag_get_page,
     "think": tool_think,
     "todo_write": tool_todo_write,
 }
 
+# ここに含まれないツール（read_file, grep, rag_search など）は確認なしで並列実行される
 DESTRUCTIVE_TOOLS = {"run_command", "write_file", "edit_file"}
 
 # スキルスクリプトなど確認不要な run_command パターン
@@ -1389,6 +1610,12 @@ def _run_pdf_analysis_background(client: OpenAI, config: dict):
             vision_model=model,
             summary_model=model,
             embedding_model=emb_model,
+            embedding_dimensions=config.get("embedding_dimensions"),
+            max_in_flight_pages=config.get("pdf_max_in_flight_pages", 16),
+            render_workers=config.get("pdf_render_workers"),
+            use_text_layer=config.get("pdf_text_layer", True),
+            image_encoding=config.get("pdf_image_encoding", "adaptive"),
+            image_token_budget=config.get("pdf_image_token_budget"),
             progress_callback=_pdf_progress if _is_output_mode() else None,
         )
     except Exception as e:
@@ -1888,7 +2115,7 @@ def chat(
             client,
             model=model,
             messages=messages,
-            tools=TOOLS,
+            tools=_available_tools(config),
             tool_choice="auto",
             stream=True,
         )
@@ -2700,8 +2927,9 @@ def gui_main():
                 content += (
                     f"\n\n[RAG追加フォルダ指定]\n"
                     f"以下のフォルダもRAG検索対象に含めてください。"
-                    f"search_json.py の --dir オプションでこれらのフォルダも検索すること"
-                    f"（database と同様に各フォルダに対して実行）:\n{folder_list}"
+                    f"rag_search の directories に database とこれらのフォルダをまとめて指定し、"
+                    f"1 回の呼び出しで横断検索すること"
+                    f"（search_json.py の場合は --dir を複数指定）:\n{folder_list}"
                 )
 
             messages_ref = messages  # 参照を保持
@@ -0,0 +1,4 @@
+"""検索・インデックスまわりのマイクロベンチマーク。
+
+    uv run python -m benchmarks.<module> --help
+"""
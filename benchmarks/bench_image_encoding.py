@@ -0,0 +1,125 @@
+"""Vision に送るページ画像のエンコード (adaptive) を PNG の基準と比べる品質チェック。
+
+PDF から均等にページを抜き出し、描画解像度の PNG（従来の送り方）と
+pdf.image_encoding の adaptive エンコードで、送信バイト数・見積もり画像トークン数と、
+Vision モデルが書き起こした Markdown の文字数（空白を除く）を比べる。
+文字数の比 (adaptive / PNG) が --min-ratio を下回るページがあれば終了コード 1 を返す。
+
+--dry-run は API を呼ばずにバイト数・トークン数・選ばれた方針だけを出す。
+
+Usage:
+    uv run python -m benchmarks.bench_image_encoding --dir database [--samples 8] [--model gpt-4.1-mini]
+    uv run python -m benchmarks.bench_image_encoding --pdf manual.pdf --budget 1200 --dry-run
+"""
+
+import sys
+import json
+import argparse
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+# プロジェクトルートを sys.path に追加
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from pdf.converter import pdf_page_count, iter_pdf_images
+from pdf.document_processor import _bytes_to_data_url, _image_to_markdown
+from pdf.image_encoding import DEFAULT_TOKEN_BUDGET, encode_adaptive, encode_png_page
+
+
+def sample_pages(pdfs: List[Path], samples: int) -> List[Tuple[Path, int]]:
+    """全 PDF の全ページから samples ページを均等な間隔で選ぶ。"""
+    pages = [(pdf, n) for pdf in pdfs for n in range(1, pdf_page_count(pdf) + 1)]
+    if len(pages) <= samples:
+        return pages
+    step = len(pages) / samples
+    return [pages[int(i * step + step / 2)] for i in range(samples)]
+
+
+def _text_length(markdown: str) -> int:
+    return len("".join(markdown.split()))
+
+
+def _transcribe(client, model: str, encoded: Dict[str, Any], page: int) -> str:
+    urls = [_bytes_to_data_url(data, encoded["mime"]) for data in encoded["images"]]
+    return _image_to_markdown(client, model, urls, page, detail=encoded["detail"])
+
+
+def evaluate(pdfs: List[Path], samples: int, model: str, budget: int, client=None) -> List[Dict[str, Any]]:
+    rows = []
+    for pdf, page in sample_pages(pdfs, samples):
+        image = next(iter_pdf_images(pdf, pages=[page]), None)
+        if image is None:
+            continue
+        encodings = {"png": encode_png_page(image, model), "adaptive": encode_adaptive(image, model, budget)}
+        row: Dict[str, Any] = {"pdf": pdf.name, "page": page,
+                               "policy": dict(encodings["adaptive"]["policy"])}
+        for name, encoded in encodings.items():
+            row[name] = {"bytes": sum(len(data) for data in encoded["images"]), "tokens": encoded["tokens"]}
+            if client is not None:
+                try:
+                    row[name]["chars"] = _text_length(_transcribe(client, model, encoded, page))
+                except Exception as e:
+                    sys.stderr.write(f"Error transcribing {pdf.name} p.{page} ({name}): {e}\n")
+        if "chars" in row["png"] and "chars" in row["adaptive"]:
+            row["ratio"] = row["adaptive"]["chars"] / row["png"]["chars"] if row["png"]["chars"] else 1.0
+        rows.append(row)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="adaptive 画像エンコードと PNG の比較 (バイト数・トークン・書き起こし文字数)")
+    parser.add_argument("--dir", default="database", help="PDF を探すディレクトリ (default: database)")
+    parser.add_argument("--pdf", nargs="*", help="比較する PDF (指定時は --dir を使わない)")
+    parser.add_argument("--samples", type=int, default=8, help="比較するページ数 (default: 8)")
+    parser.add_argument("--model", default="gpt-4.1-mini", help="Vision モデル (default: gpt-4.1-mini)")
+    parser.add_argument("--budget", type=int, default=DEFAULT_TOKEN_BUDGET,
+                        help=f"1 ページあたりの画像トークンの目安 (default: {DEFAULT_TOKEN_BUDGET})")
+    parser.add_argument("--min-ratio", type=float, default=0.9,
+                        help="書き起こし文字数の比 (adaptive / PNG) の下限 (default: 0.9)")
+    parser.add_argument("--dry-run", action="store_true", help="API を呼ばずにバイト数・トークン数だけ比べる")
+    parser.add_argument("--out", help="結果を JSON で保存するパス")
+    args = parser.parse_args()
+
+    pdfs = [Path(p) for p in args.pdf] if args.pdf else sorted(Path(args.dir).rglob("*.pdf"))
+    if not pdfs:
+        print(f"PDF が見つかりません: {args.dir}")
+        sys.exit(1)
+    client = None
+    if not args.dry_run:
+        from openai import OpenAI
+        client = OpenAI()
+
+    rows = evaluate(pdfs, args.samples, args.model, args.budget, client)
+    print(f"{'page':<28} {'policy':<30} {'PNG KB':>7} {'new KB':>7} {'PNG tok':>8} {'new tok':>8} {'chars':>6}")
+    for row in rows:
+        policy = row["policy"]
+        desc = (f"{policy['density']} {policy['format']} x{policy['scale']:.2f}"
+                f"{' gray' if policy['grayscale'] else ''} {policy['tiles']}t {policy['detail']}")
+        ratio = f"{row['ratio']:.2f}" if "ratio" in row else "-"
+        print(f"{row['pdf'][:22] + ' p.' + str(row['page']):<28} {desc:<30} "
+              f"{row['png']['bytes'] / 1024:>7.0f} {row['adaptive']['bytes'] / 1024:>7.0f} "
+              f"{row['png']['tokens']:>8} {row['adaptive']['tokens']:>8} {ratio:>6}")
+
+    if not rows:
+        sys.exit(1)
+    totals = {name: {key: sum(row[name][key] for row in rows) for key in ("bytes", "tokens")}
+              for name in ("png", "adaptive")}
+    print(f"\nbytes: {totals['png']['bytes'] / 1024:.0f} KB -> {totals['adaptive']['bytes'] / 1024:.0f} KB "
+          f"({1 - totals['adaptive']['bytes'] / max(1, totals['png']['bytes']):.0%} smaller), "
+          f"image tokens: {totals['png']['tokens']} -> {totals['adaptive']['tokens']} "
+          f"({1 - totals['adaptive']['tokens'] / max(1, totals['png']['tokens']):.0%} fewer)")
+    failed = [row for row in rows if row.get("ratio", 1.0) < args.min_ratio]
+    ratios = [row["ratio"] for row in rows if "ratio" in row]
+    if ratios:
+        print(f"text length ratio: min {min(ratios):.2f}, mean {sum(ratios) / len(ratios):.2f} "
+              f"({len(failed)} page(s) below {args.min_ratio})")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"model": args.model, "budget": args.budget, "pages": rows, "totals": totals},
+                      f, ensure_ascii=False, indent=2)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
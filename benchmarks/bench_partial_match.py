@@ -0,0 +1,121 @@
+"""search_json.py の部分一致スコア (_partial_match_score) の速度を新旧で比較する。
+
+同梱マニュアルの各ページの summary / content / metadata テキストに対し、
+そのテキストに含まれない検索語の部分一致スコアを計算する（実際の検索と同じ条件）。
+旧実装（部分文字列を長い順に全探索）と現行実装（bigram 集合 + 長さの二分探索）の
+結果が一致することを確認し、所要時間を表示する。
+
+Usage:
+    uv run python -m benchmarks.bench_partial_match [--dir database] [--terms 80] [--repeat 3]
+"""
+
+import sys
+import json
+import time
+import random
+import argparse
+from pathlib import Path
+
+# プロジェクトルートと RAG スクリプトを sys.path に追加
+_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(_ROOT))
+sys.path.insert(0, str(_ROOT / "skills" / "rag" / "scripts"))
+
+import search_json
+from pdf.file_manager import find_page_json_files
+from pdf.keyword_index import page_fields
+from pdf.keyword_catalog import extract_keywords
+
+
+def legacy_partial_match_score(text: str, term: str) -> float:
+    """旧実装: term の部分文字列を長い順にすべて text から探す。"""
+    if len(term) < 2:
+        return 0.0
+
+    best = 0.0
+    for n in range(len(term), 1, -1):
+        for start in range(len(term) - n + 1):
+            sub = term[start:start + n]
+            if sub in text:
+                ratio = n / len(term)
+                best = max(best, ratio)
+                break
+        if best > 0:
+            break
+    return best
+
+
+def load_fields(directory: Path) -> list[str]:
+    """全ページの summary / content / metadata テキスト（小文字化済み）。"""
+    texts = []
+    for json_path in find_page_json_files(directory):
+        with open(json_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        for entry in data if isinstance(data, list) else []:
+            texts.extend(t.lower() for t in page_fields(entry) if t)
+    return texts
+
+
+def sample_terms(texts: list[str], count: int, seed: int) -> list[str]:
+    """コーパスから抽出したキーワードと、その一部を崩した語を検索語にする。"""
+    keywords = set()
+    for text in texts:
+        keywords.update(extract_keywords(text))
+    rng = random.Random(seed)
+    terms = rng.sample(sorted(keywords), min(count, len(keywords)))
+    # 部分的にしか一致しない語（先頭を入れ替え、末尾を付け足す）も混ぜる
+    terms += ["冷" + t[1:] + "方法" for t in terms[: count // 4] if len(t) > 2]
+    return terms
+
+
+def time_it(fn, pairs, repeat: int) -> tuple[float, list]:
+    best = float("inf")
+    results = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results = [fn(text, term) for text, term in pairs]
+        best = min(best, time.perf_counter() - start)
+    return best, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="部分一致スコアの新旧比較ベンチマーク")
+    parser.add_argument("--dir", default="database", help="対象ディレクトリ (default: database)")
+    parser.add_argument("--terms", type=int, default=80, help="検索語の数 (default: 80)")
+    parser.add_argument("--repeat", type=int, default=3, help="計測の繰り返し回数 (default: 3)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    texts = load_fields(Path(args.dir))
+    if not texts:
+        print("Error: ページ JSON が見つかりません", file=sys.stderr)
+        sys.exit(1)
+    terms = sample_terms(texts, args.terms, args.seed)
+    pairs = [(text, term) for text in texts for term in terms if term not in text]
+    print(f"fields: {len(texts)}, terms: {len(terms)}, scored pairs: {len(pairs)}")
+
+    legacy_sec, expected = time_it(legacy_partial_match_score, pairs, args.repeat)
+
+    # 1 回目は bigram 集合の構築込み（CLI の 1 回の検索に相当）、2 回目以降はキャッシュ済み
+    search_json._BIGRAM_CACHE.clear()
+    start = time.perf_counter()
+    cold = [search_json._partial_match_score(text, term) for text, term in pairs]
+    cold_sec = time.perf_counter() - start
+    warm_sec, warm = time_it(search_json._partial_match_score, pairs, args.repeat)
+
+    if cold != expected or warm != expected:
+        mismatches = sum(a != b for a, b in zip(warm, expected))
+        print(f"Error: 旧実装と結果が一致しません ({mismatches} 件)", file=sys.stderr)
+        sys.exit(1)
+
+    print(f"{'implementation':<28} {'total ms':>10} {'us/pair':>9} {'speedup':>8}")
+    for label, sec in (
+        ("legacy (substring scan)", legacy_sec),
+        ("bigram + bisect (cold)", cold_sec),
+        ("bigram + bisect (cached)", warm_sec),
+    ):
+        print(f"{label:<28} {sec * 1000:>10.1f} {sec / len(pairs) * 1e6:>9.2f} {legacy_sec / sec:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
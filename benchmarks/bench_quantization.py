@@ -0,0 +1,166 @@
+"""embedding 量子化 (int8 / 直積量子化) のメモリと recall のトレードオフを測る。
+
+コーパスの全ページ embedding を読み込み、各ページ自身をクエリにして
+（自分自身は除外）float32 の厳密検索と量子化スコアの上位 k 件を比較する。
+
+Usage:
+    uv run python -m benchmarks.bench_quantization --dir database [--top-k 10] [--queries 200]
+    uv run python -m benchmarks.bench_quantization --dir database --pq-subspaces 48 --rerank 0 50
+    uv run python -m benchmarks.bench_quantization --check-update
+
+--check-update は合成コーパスで量子化インデックスを作り、embedding の次元数を
+切り詰めた後の QuantizedIndex.update() が作り直しに成功するかを確かめる（失敗で終了コード 1）。
+"""
+
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+# プロジェクトルートを sys.path に追加
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from pdf.file_manager import find_page_json_files
+from pdf.corpus_index import CorpusIndex
+from pdf.embedding_store import load_embedding_matrix, truncate_embeddings
+from pdf.quantization import QUANTIZE_METHODS, QuantizedIndex, make_quantizer
+from pdf.similarity import top_k_indices
+
+
+def load_corpus_vectors(directory: Path) -> np.ndarray:
+    """ディレクトリ配下の全ページ embedding を 1 つの正規化済み行列にまとめる。"""
+    blocks = []
+    for json_path in find_page_json_files(directory):
+        matrix = load_embedding_matrix(json_path)
+        if matrix is not None and len(matrix) > 0:
+            blocks.append(np.asarray(matrix.vectors, dtype=np.float32))
+    if not blocks:
+        return np.zeros((0, 0), dtype=np.float32)
+    dims = {b.shape[1] for b in blocks}
+    if len(dims) > 1:
+        raise ValueError(f"次元数の異なる embedding が混在しています: {sorted(dims)}")
+    return np.vstack(blocks)
+
+
+def _top_k_excluding(scores: np.ndarray, k: int, exclude: int) -> set:
+    scores = scores.copy()
+    scores[exclude] = -np.inf
+    return set(top_k_indices(scores, k).tolist())
+
+
+def evaluate(vectors: np.ndarray, quantizer, codes: np.ndarray, query_rows: np.ndarray,
+             top_k: int, rerank: int) -> dict:
+    """量子化スコア（+ float32 再スコアリング）の recall@k と平均クエリ時間を返す。"""
+    recalls = []
+    elapsed = 0.0
+    for row in query_rows:
+        query = vectors[row]
+        truth = _top_k_excluding(vectors @ query, top_k, row)
+
+        start = time.perf_counter()
+        approx = quantizer.scores(codes, query)
+        approx[row] = -np.inf
+        if rerank > 0:
+            candidates = top_k_indices(approx, max(rerank, top_k))
+            exact = vectors[candidates] @ query
+            found = set(candidates[top_k_indices(exact, top_k)].tolist())
+        else:
+            found = set(top_k_indices(approx, top_k).tolist())
+        elapsed += time.perf_counter() - start
+
+        recalls.append(len(truth & found) / max(1, len(truth)))
+    return {
+        "recall": float(np.mean(recalls)) if recalls else 1.0,
+        "query_ms": elapsed / max(1, len(query_rows)) * 1000,
+    }
+
+
+def exact_query_ms(vectors: np.ndarray, query_rows: np.ndarray, top_k: int) -> float:
+    start = time.perf_counter()
+    for row in query_rows:
+        _top_k_excluding(vectors @ vectors[row], top_k, row)
+    return (time.perf_counter() - start) / max(1, len(query_rows)) * 1000
+
+
+def check_update_across_dimensions(pages: int = 600, dims: int = 1536, truncate_to: int = 256) -> bool:
+    """量子化インデックスを作った後に次元数を変え、update() で作り直せるかを確かめる。"""
+    from benchmarks.synthetic_corpus import generate_corpus
+
+    ok = True
+    for method in QUANTIZE_METHODS:
+        root = Path(tempfile.mkdtemp(prefix="bench_quant_"))
+        try:
+            generate_corpus(root, pages, dims=dims, pages_per_doc=100)
+            json_files = find_page_json_files(str(root))
+            CorpusIndex(root).sync(json_files)
+            QuantizedIndex(CorpusIndex(root)).build(method)
+            for jf in json_files:
+                truncate_embeddings(Path(jf), truncate_to)
+            corpus = CorpusIndex(root)
+            corpus.sync(json_files, rebuild=True)
+            index = QuantizedIndex(corpus)
+            status = index.update()
+            passed = (status == "rebuilt" and index.is_compatible()
+                      and index.meta["dimensions"] == truncate_to
+                      and index.search(list(corpus.matrix()[0]), top_k=1)[0]["score"] > 0)
+            detail = f"status={status}, dims={index.meta['dimensions']}, subspaces={index.meta['subspaces']}"
+        except Exception as e:
+            passed, detail = False, f"{type(e).__name__}: {e}"
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+        print(f"update {method} {dims} -> {truncate_to} dims: {'ok' if passed else 'FAILED'} ({detail})")
+        ok = ok and passed
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="embedding 量子化のメモリ/recall ベンチマーク")
+    parser.add_argument("--dir", default="database", help="対象ディレクトリ (default: database)")
+    parser.add_argument("--top-k", type=int, default=10, help="recall@k の k (default: 10)")
+    parser.add_argument("--queries", type=int, default=200, help="クエリに使うページ数 (default: 200)")
+    parser.add_argument("--pq-subspaces", type=int, default=None,
+                        help="直積量子化の部分空間数 (default: 次元数/16)")
+    parser.add_argument("--rerank", type=int, nargs="+", default=[0, 50],
+                        help="float32 再スコアリングする候補数（複数指定可, default: 0 50）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--check-update", action="store_true",
+                        help="次元数を変えた後の量子化インデックスの更新を確かめて終了する")
+    args = parser.parse_args()
+
+    if args.check_update:
+        sys.exit(0 if check_update_across_dimensions() else 1)
+
+    vectors = load_corpus_vectors(Path(args.dir))
+    n = vectors.shape[0]
+    if n < 2:
+        print("Error: embedding が 2 ページ以上必要です", file=sys.stderr)
+        sys.exit(1)
+
+    rng = np.random.default_rng(args.seed)
+    query_rows = np.sort(rng.choice(n, min(args.queries, n), replace=False))
+    top_k = min(args.top_k, n - 1)
+
+    print(f"corpus: {n} pages x {vectors.shape[1]} dims, queries: {len(query_rows)}, k={top_k}")
+    print(f"{'method':<8} {'bytes':>12} {'ratio':>7} {'rerank':>7} {'recall@k':>9} {'ms/query':>9}")
+    print(f"{'float32':<8} {vectors.nbytes:>12,} {1.0:>6.1f}x {'-':>7} {1.0:>9.3f} "
+          f"{exact_query_ms(vectors, query_rows, top_k):>9.3f}")
+
+    for method in ("int8", "pq"):
+        start = time.perf_counter()
+        quantizer = make_quantizer(method, args.pq_subspaces).fit(vectors)
+        codes = quantizer.encode(vectors)
+        fit_sec = time.perf_counter() - start
+        ratio = vectors.nbytes / max(1, codes.nbytes)
+        for rerank in args.rerank:
+            result = evaluate(vectors, quantizer, codes, query_rows, top_k, rerank)
+            print(f"{method:<8} {codes.nbytes:>12,} {ratio:>6.1f}x {rerank:>7} "
+                  f"{result['recall']:>9.3f} {result['query_ms']:>9.3f}")
+        print(f"  ({method} fit+encode: {fit_sec:.2f}s)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+"""search_json.py のコーパス規模に対するスケーリングを測る。
+
+benchmarks.synthetic_corpus で指定ページ数の合成コーパス（日本語・英語のページ JSON と
+ランダムな embedding）を作り、索引を構築した上で各コマンドの所要時間とピーク RSS を測定する。
+
+    cold  コマンドごとに新しいプロセスで `search_json.py --no-daemon` を実行する
+          （インタプリタ起動・import・索引の読み込みを含む。OS のページキャッシュは温まった状態）
+    warm  1 プロセス内で search_json.run() を繰り返す（1 回目は計測しない）。
+          検索結果キャッシュは無効にし、読み込み済みコーパスとインデックスの再利用だけを測る
+          (--result-cache で有効化)
+
+クエリ embedding はランダムなベクトルを専用のクエリキャッシュに登録しておくため API は呼ばない。
+結果は JSON（コミット・環境・コーパス規模ごとの中央値/最小値/p95 [ms]・ピーク RSS [MB]）で保存し、
+--compare で別のコミットの結果と比較できる。
+
+Usage:
+    uv run python -m benchmarks.bench_search [--sizes 1000 10000 100000] [--ops semantic hybrid]
+    uv run python -m benchmarks.bench_search --compare old.json [new.json]
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import subprocess
+import contextlib
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(_ROOT))
+
+from benchmarks.synthetic_corpus import generate_corpus, MANIFEST_NAME
+
+SEARCH_JSON = _ROOT / "skills" / "rag" / "scripts" / "search_json.py"
+DEFAULT_WORK_DIR = _ROOT / ".ucf_desktop" / "cache" / "bench_corpus"
+DEFAULT_RESULTS_DIR = _ROOT / ".ucf_desktop" / "cache" / "benchmarks"
+OPERATIONS = ("list", "search", "keywords", "semantic", "hybrid", "get_page")
+RESULTS_FORMAT = "ucf-bench-search"
+
+
+def _log(msg: str):
+    sys.stderr.write(msg + "\n")
+    sys.stderr.flush()
+
+
+def _queries(manifest: Dict[str, Any]) -> List[str]:
+    """日本語と英語のクエリを交互に並べる。"""
+    ja, en = manifest["queries"]["ja"], manifest["queries"]["en"]
+    return [q for pair in zip(ja, en) for q in pair]
+
+
+def operation_args(op: str, manifest: Dict[str, Any], i: int) -> List[str]:
+    """i 回目の実行で使う search_json.py の引数（--dir を除く）。"""
+    query = _queries(manifest)[i % len(_queries(manifest))]
+    if op in ("search", "semantic", "hybrid"):
+        return [op, query]
+    if op == "get_page":
+        name, page = manifest["get_page"]
+        return [op, name, str(page)]
+    return [op]
+
+
+def _embedding_config() -> Tuple[str, Optional[int]]:
+    """search_json.py と同じ config.json の embedding_model / embedding_dimensions。"""
+    sys.path.insert(0, str(SEARCH_JSON.parent))
+    import search_json
+    return search_json._load_embedding_model(), search_json._load_embedding_dimensions()
+
+
+def seed_query_cache(path: Path, manifest: Dict[str, Any], configured_dims: Optional[int], seed: int = 0):
+    """ベンチマークのクエリにランダムな embedding を登録する（search_json.py が API を呼ばないように）。"""
+    from pdf.query_cache import QueryEmbeddingCache
+    from pdf.local_embeddings import is_local_model
+
+    if is_local_model(manifest["model"]):
+        return
+    cache = QueryEmbeddingCache(path)
+    cache_model = f"{manifest['model']}@{configured_dims}" if configured_dims else manifest["model"]
+    rng = np.random.default_rng(seed)
+    try:
+        for query in _queries(manifest):
+            vector = rng.standard_normal(manifest["dims"]).astype(np.float32)
+            cache.put(cache_model, query, (vector / np.linalg.norm(vector)).tolist())
+    finally:
+        cache.close()
+
+
+def bench_env(work_dir: Path, result_cache: bool) -> Dict[str, str]:
+    env = dict(os.environ)
+    env["UCF_QUERY_CACHE_PATH"] = str(work_dir / "query_embeddings.sqlite")
+    env.setdefault("OPENAI_API_KEY", "bench-offline")
+    if not result_cache:
+        env["UCF_RESULT_CACHE"] = "0"
+    return env
+
+
+def run_child(cmd: List[str], env: Dict[str, str], capture: bool = False) -> Tuple[float, float, str]:
+    """子プロセスを実行し (経過秒, ピーク RSS [MB], stdout) を返す。"""
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd, env=env, cwd=str(_ROOT), stdin=subprocess.DEVNULL,
+                            stdout=subprocess.PIPE if capture else subprocess.DEVNULL,
+                            stderr=subprocess.PIPE)
+    stdout = proc.stdout.read().decode("utf-8") if capture else ""
+    stderr = proc.stderr.read().decode("utf-8", "replace")
+    _, status, usage = os.wait4(proc.pid, 0)
+    elapsed = time.perf_counter() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if proc.returncode != 0:
+        raise RuntimeError(f"{' '.join(cmd)} failed ({proc.returncode}):\n{stderr[-2000:]}")
+    # ru_maxrss は Linux では KB、macOS ではバイト
+    rss = usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    return elapsed, rss, stdout
+
+
+def _summary(seconds: List[float]) -> Dict[str, Any]:
+    ms = np.array(seconds) * 1000
+    return {
+        "runs": len(ms),
+        "median_ms": round(float(np.median(ms)), 3),
+        "min_ms": round(float(ms.min()), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+    }
+
+
+def warm_worker(corpus: Path, ops: List[str], repeat: int) -> Dict[str, Any]:
+    """1 プロセス内で各コマンドを繰り返し実行した時間（--warm-worker で子プロセスとして呼ばれる）。"""
+    sys.path.insert(0, str(SEARCH_JSON.parent))
+    import search_json
+
+    with open(corpus / MANIFEST_NAME, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    results = {}
+    sink = io.StringIO()
+    for op in ops:
+        times = []
+        for i in range(repeat + 1):
+            argv = operation_args(op, manifest, i) + ["--dir", str(corpus), "--no-daemon"]
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(sink):
+                search_json.run(argv)
+            if i > 0:
+                times.append(time.perf_counter() - start)
+            sink.seek(0)
+            sink.truncate()
+        results[op] = _summary(times)
+    return results
+
+
+def _disk_bytes(path: Path) -> int:
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+
+
+def bench_size(pages: int, args, model: str, configured_dims: Optional[int]) -> Dict[str, Any]:
+    """1 つのコーパス規模について生成・索引構築・cold/warm の計測を行う。"""
+    dims = configured_dims or args.dims
+    corpus = Path(args.work_dir) / f"pages_{pages}_d{dims}"
+    start = time.perf_counter()
+    manifest = generate_corpus(corpus, pages, dims=dims, model=model, seed=args.seed)
+    generate_sec = time.perf_counter() - start
+    _log(f"[{pages} pages] corpus ready: {corpus} ({generate_sec:.1f}s)")
+
+    env = bench_env(Path(args.work_dir), args.result_cache)
+    seed_query_cache(Path(env["UCF_QUERY_CACHE_PATH"]), manifest, configured_dims, args.seed)
+
+    # 索引は毎回作り直す（構築時間も計測対象）
+    shutil.rmtree(corpus / ".index", ignore_errors=True)
+    build_sec, build_rss, _ = run_child(
+        [sys.executable, "-m", "pdf.migration", "--dir", str(corpus), "--build-index"], env)
+    _log(f"[{pages} pages] index built ({build_sec:.1f}s, {build_rss:.0f} MB)")
+
+    cold = {}
+    for op in args.ops:
+        times, peak = [], 0.0
+        for i in range(args.cold_runs):
+            argv = operation_args(op, manifest, i) + ["--dir", str(corpus), "--no-daemon"]
+            elapsed, rss, _ = run_child([sys.executable, str(SEARCH_JSON)] + argv, env)
+            times.append(elapsed)
+            peak = max(peak, rss)
+        cold[op] = dict(_summary(times), peak_rss_mb=round(peak, 1))
+        _log(f"[{pages} pages] cold {op}: {cold[op]['median_ms']:.1f} ms")
+
+    _, warm_rss, out = run_child(
+        [sys.executable, "-m", "benchmarks.bench_search", "--warm-worker", str(corpus),
+         "--repeat", str(args.repeat), "--ops", *args.ops], env, capture=True)
+    warm = json.loads(out)
+    _log(f"[{pages} pages] warm: " + ", ".join(f"{op} {r['median_ms']:.2f} ms" for op, r in warm.items()))
+
+    return {
+        "pages": pages,
+        "documents": manifest["documents"],
+        "dims": dims,
+        "generate_s": round(generate_sec, 3),
+        "build_index_s": round(build_sec, 3),
+        "build_index_peak_rss_mb": round(build_rss, 1),
+        "disk_mb": round(_disk_bytes(corpus) / (1 << 20), 1),
+        "cold": cold,
+        "warm": warm,
+        "warm_peak_rss_mb": round(warm_rss, 1),
+    }
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=str(_ROOT),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_table(results: Dict[str, Any]):
+    print(f"commit {results['commit']} ({results['timestamp']})")
+    print(f"{'pages':>8} {'op':<10} {'cold ms':>10} {'cold MB':>8} {'warm ms':>10} {'warm p95':>10}")
+    for size in results["sizes"]:
+        for op, cold in size["cold"].items():
+            warm = size["warm"].get(op, {})
+            print(f"{size['pages']:>8} {op:<10} {cold['median_ms']:>10.1f} {cold['peak_rss_mb']:>8.0f} "
+                  f"{warm.get('median_ms', float('nan')):>10.2f} {warm.get('p95_ms', float('nan')):>10.2f}")
+        print(f"{size['pages']:>8} {'(index)':<10} {size['build_index_s'] * 1000:>10.1f} "
+              f"{size['build_index_peak_rss_mb']:>8.0f}   warm RSS {size['warm_peak_rss_mb']:.0f} MB, "
+              f"disk {size['disk_mb']:.0f} MB")
+
+
+def compare(base: Dict[str, Any], new: Dict[str, Any]):
+    """2 つの結果の中央値を比較する（ratio > 1 は new の方が遅い）。"""
+    print(f"base {base['commit']} -> new {new['commit']}")
+    print(f"{'pages':>8} {'op':<10} {'mode':<5} {'base ms':>10} {'new ms':>10} {'ratio':>7}")
+    base_sizes = {s["pages"]: s for s in base["sizes"]}
+    for size in new["sizes"]:
+        old = base_sizes.get(size["pages"])
+        if old is None:
+            continue
+        for mode in ("cold", "warm"):
+            for op, result in size[mode].items():
+                before = old[mode].get(op)
+                if before is None:
+                    continue
+                ratio = result["median_ms"] / max(before["median_ms"], 1e-9)
+                flag = "  !" if ratio > 1.2 else ""
+                print(f"{size['pages']:>8} {op:<10} {mode:<5} {before['median_ms']:>10.2f} "
+                      f"{result['median_ms']:>10.2f} {ratio:>6.2f}x{flag}")
+
+
+def _load_results(path: str) -> Dict[str, Any]:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="search_json.py のスケーリングベンチマーク")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000],
+                        help="コーパスのページ数（複数指定可, default: 1000 10000）")
+    parser.add_argument("--ops", nargs="+", choices=OPERATIONS, default=list(OPERATIONS),
+                        help="計測するコマンド (default: すべて)")
+    parser.add_argument("--cold-runs", type=int, default=3, help="cold の実行回数 (default: 3)")
+    parser.add_argument("--repeat", type=int, default=10, help="warm の実行回数 (default: 10)")
+    parser.add_argument("--dims", type=int, default=1536,
+                        help="embedding の次元数 (default: config.json の embedding_dimensions、なければ 1536)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--work-dir", default=str(DEFAULT_WORK_DIR),
+                        help="合成コーパスの置き場所（同じ規模なら再利用する）")
+    parser.add_argument("--output", default=None,
+                        help="結果 JSON の保存先 (default: .ucf_desktop/cache/benchmarks/search-<commit>.json)")
+    parser.add_argument("--result-cache", action="store_true", help="warm で検索結果キャッシュを有効にする")
+    parser.add_argument("--compare", nargs="+", metavar="JSON", default=None,
+                        help="BASE [NEW]: NEW（省略時は今回の結果）を BASE と比較する")
+    parser.add_argument("--warm-worker", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.warm_worker:
+        print(json.dumps(warm_worker(Path(args.warm_worker), args.ops, args.repeat)))
+        return
+    if args.compare and len(args.compare) > 2:
+        parser.error("--compare には BASE [NEW] を指定してください")
+    if args.compare and len(args.compare) == 2:
+        compare(_load_results(args.compare[0]), _load_results(args.compare[1]))
+        return
+
+    model, configured_dims = _embedding_config()
+    results = {
+        "format": RESULTS_FORMAT,
+        "commit": _git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "config": {"model": model, "ops": args.ops, "cold_runs": args.cold_runs, "repeat": args.repeat,
+                   "seed": args.seed, "result_cache": args.result_cache},
+        "sizes": [bench_size(pages, args, model, configured_dims) for pages in args.sizes],
+    }
+
+    output = Path(args.output) if args.output else DEFAULT_RESULTS_DIR / f"search-{results['commit']}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print_table(results)
+    print(f"\nresults: {output}")
+    if args.compare:
+        print()
+        compare(_load_results(args.compare[0]), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""検索ベンチマーク用の合成コーパスを生成する。
+
+日本語・英語の家電マニュアル風のページ JSON（summary / content / metadata）と、
+ランダムな正規化済み embedding のバイナリストアを database/ と同じ配置で書き出す。
+
+    <out>/ja/<stem>/<stem>.json, <stem>_embeddings.npy, <stem>_embeddings.meta.json
+    <out>/en/<stem>/...
+    <out>/.bench_corpus.json    生成パラメータ（同じパラメータなら再生成しない）
+
+語彙と乱数は seed で決まるため、同じ引数なら同じコーパスになる。
+
+Usage:
+    uv run python -m benchmarks.synthetic_corpus --out /tmp/bench_corpus --pages 10000 [--dims 1536]
+"""
+
+import sys
+import json
+import random
+import shutil
+import argparse
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+
+# プロジェクトルートを sys.path に追加
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from pdf.embeddings import _build_embedding_text
+from pdf.embedding_store import _write_binary_store
+from pdf.similarity import normalize_rows
+
+MANIFEST_NAME = ".bench_corpus.json"
+CORPUS_VERSION = 1
+
+_JA_WORDS = (
+    "冷蔵庫 冷凍室 冷蔵室 野菜室 製氷 製氷皿 給水タンク 浄水フィルター 自動製氷 急速製氷 "
+    "温度設定 温度調節 節電 省エネ ドアパッキン 棚 引き出し 操作パネル 表示ランプ 電源プラグ "
+    "アース 設置 据え付け 霜取り 結露 異音 におい 脱臭 掃除 お手入れ 点検 故障 修理 保証 "
+    "洗濯機 脱水 すすぎ 乾燥 洗剤 柔軟剤 排水 給水 糸くずフィルター 槽洗浄 エアコン 冷房 暖房 "
+    "除湿 送風 リモコン タイマー 室外機 フィルター掃除 運転停止 エラー表示 安全上の注意 仕様"
+).split()
+_JA_VERBS = ("を確認してください", "を外して洗ってください", "を設定します", "が点灯します",
+             "を押してください", "に注意してください", "を交換します", "が停止します")
+_EN_WORDS = (
+    "refrigerator freezer compartment crisper ice maker ice tray water tank filter "
+    "temperature setting energy saving door gasket shelf drawer control panel indicator "
+    "power plug grounding installation defrost condensation noise odor deodorizer cleaning "
+    "maintenance inspection malfunction repair warranty washer spin rinse dryer detergent "
+    "softener drain supply lint filter drum cleaning air conditioner cooling heating "
+    "dehumidify fan remote timer outdoor unit error code safety precautions specifications"
+).split()
+_EN_VERBS = ("check the", "remove and wash the", "set the", "the indicator shows the",
+             "press the", "be careful with the", "replace the", "stop the")
+PAGE_TYPES = ("safety", "setup", "operation", "maintenance", "troubleshooting", "specifications")
+
+
+def _ja_sentence(rng: random.Random) -> str:
+    a, b = rng.sample(_JA_WORDS, 2)
+    return f"{a}の{b}{rng.choice(_JA_VERBS)}。"
+
+
+def _en_sentence(rng: random.Random) -> str:
+    a, b = rng.sample(_EN_WORDS, 2)
+    return f"{rng.choice(_EN_VERBS).capitalize()} {a} {b}."
+
+
+def make_page(rng: random.Random, lang: str, page: int) -> Dict[str, Any]:
+    """1 ページ分のエントリ（Vision 分析結果と同じ形）を作る。"""
+    words, sentence = (_JA_WORDS, _ja_sentence) if lang == "ja" else (_EN_WORDS, _en_sentence)
+    sep = "" if lang == "ja" else " "
+    section = rng.choice(words)
+    keywords = rng.sample(words, 8)
+    paragraphs = [sep.join(sentence(rng) for _ in range(rng.randint(3, 6)))
+                  for _ in range(rng.randint(3, 6))]
+    table = "\n".join(f"| {rng.choice(words)} | {sentence(rng)} |" for _ in range(rng.randint(2, 5)))
+    content = f"# {section}\n\n" + "\n\n".join(paragraphs) + f"\n\n| | |\n| --- | --- |\n{table}\n"
+    return {
+        "page": page,
+        "summary": sep.join(sentence(rng) for _ in range(3)),
+        "content": content,
+        "metadata": {
+            "topics": rng.sample(words, 4),
+            "keywords": keywords,
+            "section_header": section,
+            "page_type": rng.choice(PAGE_TYPES),
+        },
+    }
+
+
+def _manifest(pages: int, pages_per_doc: int, dims: int, model: str, seed: int) -> Dict[str, Any]:
+    return {"version": CORPUS_VERSION, "pages": pages, "pages_per_doc": pages_per_doc,
+            "dims": dims, "model": model, "seed": seed}
+
+
+def generate_corpus(out: Path, pages: int, dims: int = 1536, model: str = "text-embedding-3-small",
+                    pages_per_doc: int = 50, seed: int = 0, force: bool = False) -> Dict[str, Any]:
+    """合成コーパスを out に生成し、マニフェスト（生成パラメータ + 検索クエリ例）を返す。
+
+    out に同じパラメータのコーパスがあれば再生成しない。
+    """
+    out = Path(out)
+    manifest = _manifest(pages, pages_per_doc, dims, model, seed)
+    manifest_path = out / MANIFEST_NAME
+    if not force and manifest_path.exists():
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            existing = json.load(f)
+        if {k: existing.get(k) for k in manifest} == manifest:
+            return existing
+    if out.exists():
+        shutil.rmtree(out)
+
+    rng = random.Random(seed)
+    np_rng = np.random.default_rng(seed)
+    documents: List[str] = []
+    for doc_id, start in enumerate(range(0, pages, pages_per_doc)):
+        lang = "ja" if doc_id % 2 == 0 else "en"
+        stem = f"{lang}_manual_{doc_id:05d}"
+        doc_dir = out / lang / stem
+        doc_dir.mkdir(parents=True, exist_ok=True)
+        entries = [make_page(rng, lang, page) for page in range(1, min(pages_per_doc, pages - start) + 1)]
+        json_path = doc_dir / f"{stem}.json"
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(entries, f, ensure_ascii=False, indent=2)
+        vectors = normalize_rows(np_rng.standard_normal((len(entries), dims)).astype(np.float32))
+        _write_binary_store(doc_dir / f"{stem}_embeddings.npy", vectors, model,
+                            [e["page"] for e in entries], [_build_embedding_text(e) for e in entries])
+        documents.append(json_path.name)
+
+    manifest["documents"] = len(documents)
+    manifest["queries"] = {
+        "ja": [f"{a} {b}" for a, b in (rng.sample(_JA_WORDS, 2) for _ in range(8))],
+        "en": [f"{a} {b}" for a, b in (rng.sample(_EN_WORDS, 2) for _ in range(8))],
+    }
+    manifest["get_page"] = [documents[len(documents) // 2], min(pages_per_doc, pages) // 2 or 1]
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="検索ベンチマーク用の合成コーパスを生成する")
+    parser.add_argument("--out", required=True, help="出力ディレクトリ")
+    parser.add_argument("--pages", type=int, default=1000, help="総ページ数 (default: 1000)")
+    parser.add_argument("--pages-per-doc", type=int, default=50, help="1 ドキュメントのページ数 (default: 50)")
+    parser.add_argument("--dims", type=int, default=1536, help="embedding の次元数 (default: 1536)")
+    parser.add_argument("--model", default="text-embedding-3-small", help="サイドカーに記録するモデル名")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--force", action="store_true", help="既存のコーパスがあっても作り直す")
+    args = parser.parse_args()
+
+    manifest = generate_corpus(Path(args.out), args.pages, args.dims, args.model,
+                               args.pages_per_doc, args.seed, args.force)
+    print(f"{args.out}: {manifest['pages']} pages / {manifest['documents']} documents "
+          f"x {manifest['dims']} dims")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,24 @@
 import sys
+import time
+import functools
 from pathlib import Path
 from openai import OpenAI
 
 from pdf.file_manager import find_unanalyzed_pdfs, save_json, save_embeddings, move_processed_pdf, create_output_directory
-from pdf.converter import convert_pdf_to_images
-from pdf.document_processor import process_pages_batch
-from pdf.embeddings import generate_embeddings
+from pdf.converter import pdf_page_count, iter_pdf_images, iter_encoded_pages, default_render_workers
+from pdf.document_processor import process_pages_batch, DEFAULT_MAX_IN_FLIGHT_PAGES
+from pdf.image_encoding import vision_encoder
+from pdf.embeddings import generate_embeddings, embed_texts, _build_embedding_text, EMBEDDING_DIMENSIONS
+from pdf.corpus_index import update_corpus_index
+from pdf.ann_index import update_ann_index
+from pdf.quantization import update_quantized_index
+from pdf.keyword_index import update_keyword_index
+from pdf.page_index import update_page_index
+from pdf.keyword_catalog import update_keyword_catalog
+from pdf.passages import (generate_passage_embeddings, save_passage_embeddings, update_passage_index,
+                          page_passages)
+from pdf.local_embeddings import is_local_model, ensure_local_model, local_model_path, model_fingerprint
+from pdf.result_cache import bump_corpus_generation
 
 from typing import Dict, Any, Optional, Callable
 
@@ -16,6 +29,59 @@ def _log(msg: str):
     sys.stderr.flush()
 
 
+def _log_throughput(stage: str, pages: int, seconds: float, detail: str = ""):
+    """ステージごとの処理ページ数と pages/sec をログに出す。"""
+    rate = pages / seconds if seconds > 0 else 0.0
+    _log(f"  [{stage}] {pages} pages in {seconds:.1f}s ({rate:.1f} pages/s){detail}")
+
+
+def _log_text_layer(stats: dict):
+    """テキストレイヤーでローカル変換したページ数と、省いた Vision API 呼び出し数をログに出す。
+
+    stats は converter の描画統計（"local" / "pages" / "reasons"）。
+    """
+    local = stats.get("local", 0)
+    reasons = ", ".join(f"{reason} {count}" for reason, count in sorted(stats.get("reasons", {}).items())
+                        if reason != "text")
+    _log(f"  [text-layer] {local}/{local + stats.get('pages', 0)} pages converted locally "
+         f"({local} vision API calls avoided" + (f"; sent to vision: {reasons})" if reasons else ")"))
+
+
+def _embed_entries(client: OpenAI, entries: list, model: str, dimensions: Optional[int]) -> list:
+    """パイプラインの embedding 段: ページとそのパッセージの embedding を 1 回の呼び出しでまとめて生成する。
+
+    entries の各ページについて {"text", "vector", "passages": [(本文, ベクトル)]} を返す。
+    """
+    texts, counts = [], []
+    for entry in entries:
+        passages = [text for _, _, text in page_passages([entry])]
+        texts.append(_build_embedding_text(entry))
+        texts.extend(passages)
+        counts.append(len(passages))
+    vectors = embed_texts(client, texts, model=model, dimensions=dimensions)
+    results, i = [], 0
+    for count in counts:
+        results.append({"text": texts[i], "vector": vectors[i],
+                        "passages": list(zip(texts[i + 1:i + 1 + count], vectors[i + 1:i + 1 + count]))})
+        i += 1 + count
+    return results
+
+
+def _pipelined_embeddings(page_data: dict, model: str, dimensions: Optional[int]):
+    """パイプラインで生成したページごとの embedding を generate_embeddings() /
+    generate_passage_embeddings() と同じ形の dict 2 つにまとめる。"""
+    pages, passages = [], []
+    for page_num in sorted(page_data):
+        embedded = page_data[page_num]["embedding"]
+        pages.append({"page": page_num, "text_embedded": embedded["text"], "embedding": embedded["vector"]})
+        passages.extend({"page": page_num, "text_embedded": text, "embedding": vector}
+                        for text, vector in embedded["passages"])
+    dims = len(pages[0]["embedding"]) if pages else (dimensions or EMBEDDING_DIMENSIONS)
+    fingerprint = model_fingerprint(model)
+    return ({"model": model, "fingerprint": fingerprint, "dimensions": dims, "pages": pages},
+            {"model": model, "fingerprint": fingerprint, "dimensions": dims, "pages": passages})
+
+
 def analyze_new_pdfs(
     database_dir: str,
     client: OpenAI,
@@ -23,12 +89,26 @@ def analyze_new_pdfs(
     summary_model: str = "gpt-4.1-mini",
     embedding_model: str = "text-embedding-3-small",
     progress_callback: Optional[Callable] = None,
+    embedding_dimensions: Optional[int] = None,
+    max_in_flight_pages: int = DEFAULT_MAX_IN_FLIGHT_PAGES,
+    render_workers: Optional[int] = None,
+    use_text_layer: bool = True,
+    image_encoding: str = "adaptive",
+    image_token_budget: Optional[int] = None,
 ):
     """
     Main entry point. Finds unanalyzed PDFs in the database directory
     and processes them into JSON files.
 
     progress_callback(event_data: dict): called with progress updates.
+    max_in_flight_pages: pages held in memory between rendering and the vision response.
+    render_workers: processes that render and PNG-encode pages (None = min(4, CPU count),
+      1 = render in this process).
+    use_text_layer: convert pages with a usable text layer locally (pdf.text_layer)
+      and send only scanned / figure-heavy pages to the vision model.
+    image_encoding: "adaptive" picks format, quality, grayscale, resolution and tiling per page
+      (pdf.image_encoding); "png" sends lossless PNG at the render resolution.
+    image_token_budget: estimated image tokens per page for "adaptive" (None = default).
     """
     _log(f"Checking for unanalyzed PDFs in {database_dir}...")
     pdf_files = find_unanalyzed_pdfs(database_dir)
@@ -44,9 +124,16 @@ def analyze_new_pdfs(
         _process_single_pdf(
             pdf_path, client, vision_model, summary_model,
             embedding_model=embedding_model,
+            embedding_dimensions=embedding_dimensions,
+            max_in_flight_pages=max_in_flight_pages,
+            render_workers=render_workers,
+            use_text_layer=use_text_layer,
+            image_encoding=image_encoding,
+            image_token_budget=image_token_budget,
             progress_callback=progress_callback,
             file_index=file_idx,
             total_files=total_files,
+            database_dir=database_dir,
         )
 
     # Signal completion
@@ -60,9 +147,16 @@ def _process_single_pdf(
     vision_model: str,
     summary_model: str,
     embedding_model: str = "text-embedding-3-small",
+    embedding_dimensions: Optional[int] = None,
+    max_in_flight_pages: int = DEFAULT_MAX_IN_FLIGHT_PAGES,
+    render_workers: Optional[int] = None,
+    use_text_layer: bool = True,
+    image_encoding: str = "adaptive",
+    image_token_budget: Optional[int] = None,
     progress_callback: Optional[Callable] = None,
     file_index: int = 0,
     total_files: int = 1,
+    database_dir: Optional[str] = None,
 ):
     pdf_name = pdf_path.name
     _log(f"Processing {pdf_name}...")
@@ -79,33 +173,78 @@ def _process_single_pdf(
                 "percent": pct,
             })
 
-    # 1. Convert to images
+    # 1. Open the PDF (pages are rendered lazily while the vision calls run)
     _notify("converting", "画像に変換中...", 0)
-    images = convert_pdf_to_images(pdf_path)
-    if not images:
+    total_pages = pdf_page_count(pdf_path)
+    if not total_pages:
         _log(f"  Failed to convert {pdf_name} to images. Skipping.")
         return
 
-    total_pages = len(images)
-
     # 2. Process all pages in batch (image -> markdown -> summary)
+    # ページごとに段が重なって進むため、進捗は全段の完了数の合計で出す
+    progress = {"converting": 0, "summarizing": 0, "embedding": 0}
+    phase_labels = {"converting": "Markdown変換中", "summarizing": "要約生成中", "embedding": "埋め込み生成中"}
+
     def _page_progress(phase: str, completed: int, total: int):
-        if phase == "converting":
-            pct = int(completed / total * 50)  # 0-50%
-            _notify("converting", f"Markdown変換中 ({completed}/{total})", pct)
-        else:
-            pct = 50 + int(completed / total * 45)  # 50-95%
-            _notify("summarizing", f"要約生成中 ({completed}/{total})", pct)
+        progress[phase] = completed
+        stages = 3 if embedder is not None else 2
+        pct = int(sum(progress.values()) / (total * stages) * 95)  # 0-95%
+        _notify(phase, f"{phase_labels[phase]} ({completed}/{total})", pct)
 
     _notify("converting", f"{total_pages}ページを処理中...", 0)
+    # 描画と PNG エンコードは CPU を使うため、複数コアがあればワーカープロセスで行う
+    if render_workers is None:
+        render_workers = default_render_workers()
+    render_stats: dict = {}
+    stage_stats: dict = {}
+    # Vision に送る画像の形式・解像度はページごとに決める（ワーカーがあればエンコードもワーカーで行う）
+    encoder = vision_encoder(image_encoding, vision_model, image_token_budget)
+    # embedding はパイプラインの最後の段でページごとに生成する（ローカルモデルが未学習なら保存後にまとめて）
+    embedder = None
+    if not is_local_model(embedding_model) or local_model_path(embedding_model).exists():
+        embedder = functools.partial(_embed_entries, client, model=embedding_model, dimensions=embedding_dimensions)
+    # テキストレイヤーの使えるページは描画せずローカルで Markdown にし、Vision API を呼ばない
+    # （分類は描画と同じく 1 ページずつ、ワーカーがあればワーカーで行う）
+    if render_workers > 1:
+        pages = iter_encoded_pages(pdf_path, workers=render_workers, stats=render_stats,
+                                   encoder=encoder, text_layer=use_text_layer)
+    else:
+        pages = iter_pdf_images(pdf_path, stats=render_stats, text_layer=use_text_layer)
     page_data = process_pages_batch(
-        images,
+        pages,
         client=client,
         vision_model=vision_model,
         summary_model=summary_model,
         max_concurrency=100,
         progress_callback=_page_progress,
+        total=total_pages,
+        max_in_flight=max_in_flight_pages,
+        stage_stats=stage_stats,
+        encoder=encoder,
+        embedder=embedder,
     )
+    if not page_data:
+        _log(f"  Failed to convert {pdf_name} to images. Skipping.")
+        return
+    if use_text_layer:
+        _log_text_layer(render_stats)
+    read_pages = render_stats.get("pages", 0) + render_stats.get("local", 0)
+    if read_pages:
+        busy = render_stats["busy"] / render_stats["workers"]
+        _log_throughput("render", read_pages, busy,
+                        f" ({render_stats['pages']} rendered), {render_stats['workers']} worker(s), "
+                        f"{render_stats['seconds']:.1f}s wall")
+    upload = stage_stats.get("upload")
+    if upload and upload["pages"]:
+        _log(f"  [upload] {upload['pages']} pages, {upload['bytes'] / 1024:.0f} KB "
+             f"({upload['bytes'] / 1024 / upload['pages']:.0f} KB/page), "
+             f"~{upload['tokens']} image tokens ({image_encoding})")
+    for stage in ("vision", "metadata", "embedding"):
+        if stage in stage_stats:
+            _log_throughput(stage, stage_stats[stage]["pages"], stage_stats[stage]["seconds"])
+    if "pipeline" in stage_stats:
+        _log_throughput("pipeline", stage_stats["pipeline"]["pages"], stage_stats["pipeline"]["seconds"],
+                        " (stages overlap)")
 
     # 3. Build JSON array: [{page, summary, content, metadata}, ...]
     _notify("saving", "保存中...", 95)
@@ -129,15 +268,89 @@ def _process_single_pdf(
     save_json(pages_json, json_output_path)
     _log(f"  Saved {len(pages_json)} pages to {json_output_path}")
 
+    # キーワード検索用の転置インデックスに登録
+    if database_dir:
+        try:
+            update_keyword_index(Path(database_dir), json_output_path)
+        except Exception as e:
+            _log(f"  Failed to update keyword index: {e}")
+        # get_page / summaries 用のページオフセット索引とファイル名対応表に登録
+        try:
+            update_page_index(Path(database_dir), json_output_path)
+        except Exception as e:
+            _log(f"  Failed to update page index: {e}")
+        # keywords 用のキーワードカタログ（ページごとのキーワードと出現ページ数）に登録
+        try:
+            update_keyword_catalog(Path(database_dir), json_output_path)
+        except Exception as e:
+            _log(f"  Failed to update keyword catalog: {e}")
+        # パッセージ（ページ本文の重なりのあるチャンク）の転置インデックスに登録
+        try:
+            update_passage_index(Path(database_dir), json_output_path)
+        except Exception as e:
+            _log(f"  Failed to update passage index: {e}")
+
     # 5. Generate and save embeddings
     _notify("embedding", "埋め込み生成中...", 96)
+    # ローカルモデルが未作成なら、保存済みのページ JSON から学習する
+    if is_local_model(embedding_model):
+        try:
+            if ensure_local_model(embedding_model, Path(database_dir or output_dir), embedding_dimensions):
+                _log(f"  Built local embedding model {embedding_model}")
+        except Exception as e:
+            _log(f"  Failed to build local embedding model: {e}")
+    # パイプラインで全ページの embedding ができていればそれを使い、欠けていればまとめて生成し直す
+    pipelined = embedder is not None and all("embedding" in data for data in page_data.values())
+    passage_data = None
     try:
-        embeddings_data = generate_embeddings(client, pages_json, model=embedding_model)
-        embeddings_path = output_dir / f"{pdf_path.stem}_embeddings.json"
+        if pipelined:
+            embeddings_data, passage_data = _pipelined_embeddings(page_data, embedding_model, embedding_dimensions)
+        else:
+            start = time.perf_counter()
+            embeddings_data = generate_embeddings(client, pages_json, model=embedding_model,
+                                                  dimensions=embedding_dimensions)
+            _log_throughput("embedding", len(pages_json), time.perf_counter() - start)
+        embeddings_path = output_dir / f"{pdf_path.stem}_embeddings.npy"
         save_embeddings(embeddings_data, embeddings_path)
         _log(f"  Saved embeddings to {embeddings_path}")
     except Exception as e:
         _log(f"  Failed to generate embeddings: {e}")
+    else:
+        # コーパスインデックスに追記（既存行は書き換えない）
+        if database_dir:
+            try:
+                rows = update_corpus_index(Path(database_dir), json_output_path)
+                _log(f"  Appended {rows} rows to corpus index")
+            except Exception as e:
+                _log(f"  Failed to update corpus index: {e}")
+            # ANN・量子化インデックスは任意なので、片方が失敗してももう片方は更新する
+            try:
+                if update_ann_index(Path(database_dir)):
+                    _log("  Updated ANN index")
+            except Exception as e:
+                _log(f"  Failed to update ANN index: {e}")
+            try:
+                if update_quantized_index(Path(database_dir)):
+                    _log("  Updated quantized index")
+            except Exception as e:
+                _log(f"  Failed to update quantized index: {e}")
+
+    # パッセージごとの embedding（search_json.py passages 用）
+    try:
+        if passage_data is None:
+            passage_data = generate_passage_embeddings(client, pages_json, embedding_model,
+                                                       dimensions=embedding_dimensions)
+        passages_path = save_passage_embeddings(passage_data, json_output_path)
+        _log(f"  Saved {len(passage_data['pages'])} passage embeddings to {passages_path}")
+    except Exception as e:
+        _log(f"  Failed to generate passage embeddings: {e}")
+
+    # 検索結果キャッシュを無効化する（JSON と embedding の両方を反映した後に 1 回）
+    if database_dir:
+        try:
+            bump_corpus_generation(Path(database_dir))
+        except OSError as e:
+            _log(f"  Failed to update corpus generation: {e}")
 
     # 6. Move original PDF into output directory and rename
     try:
@@ -0,0 +1,323 @@
+"""コーパスインデックス上の近似最近傍 (ANN) インデックス。
+
+Pure NumPy の IVF (Inverted File) 方式:
+球面 k-means でベクトルを nlist 個のクラスタに分け、検索時はクエリに近い
+nprobe 個のクラスタに属する行だけを厳密スコアリングする。
+
+    <root>/.index/ann/
+        ann.json          {nlist, dimensions, corpus_generation, indexed_rows, ...}
+        centroids.npy     正規化済みクラスタ中心 (nlist x dimensions)
+        assignments.npy   コーパス行ごとのクラスタ ID
+        lists.npy         クラスタ順に並べたコーパス行番号
+        offsets.npy       クラスタ c の行は lists[offsets[c]:offsets[c+1]]
+
+コーパスに行が追記された場合は、既存の中心に割り当てるだけで増分更新する。
+コーパスが compact された（行番号が変わった）場合や、学習時から行数が
+大きく増えた場合は中心を再学習する。
+"""
+
+import os
+import json
+import math
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
+from pdf.corpus_index import CorpusIndex, Include
+from pdf.file_manager import corpus_index_dir
+from pdf.similarity import normalize_rows, query_vector, top_k_indices
+
+ANN_FORMAT = "ucf-ivf-index"
+ANN_VERSION = 1
+
+DEFAULT_NPROBE = 8
+# 学習時の行数からこの倍率を超えて増えたら中心を再学習する
+RETRAIN_GROWTH = 2.0
+# k-means の学習に使う最大サンプル数
+MAX_TRAIN_SAMPLES = 50000
+# 割り当て計算のバッチサイズ（メモリ使用量の上限）
+_ASSIGN_BATCH = 8192
+
+
+def default_nlist(rows: int) -> int:
+    """行数からクラスタ数を決める（おおよそ √N）。"""
+    if rows <= 0:
+        return 1
+    return max(1, min(rows, int(round(math.sqrt(rows)))))
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """各行を最も近い（内積が最大の）クラスタに割り当てる。"""
+    assignments = np.empty(vectors.shape[0], dtype=np.int32)
+    for lo in range(0, vectors.shape[0], _ASSIGN_BATCH):
+        block = np.asarray(vectors[lo:lo + _ASSIGN_BATCH], dtype=np.float32)
+        assignments[lo:lo + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+def train_centroids(
+    vectors: np.ndarray, nlist: int, iterations: int = 20, seed: int = 0
+) -> np.ndarray:
+    """球面 k-means でクラスタ中心を学習する。"""
+    rng = np.random.default_rng(seed)
+    n = vectors.shape[0]
+    if n > MAX_TRAIN_SAMPLES:
+        sample = np.asarray(vectors[np.sort(rng.choice(n, MAX_TRAIN_SAMPLES, replace=False))])
+    else:
+        sample = np.asarray(vectors)
+    sample = np.asarray(sample, dtype=np.float32)
+    nlist = max(1, min(nlist, sample.shape[0]))
+
+    centroids = sample[rng.choice(sample.shape[0], nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = _assign(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        counts = np.bincount(assignments, minlength=nlist)
+        empty = counts == 0
+        if empty.any():
+            # 空クラスタはランダムな点で再初期化する
+            sums[empty] = sample[rng.choice(sample.shape[0], int(empty.sum()), replace=False)]
+        new_centroids = normalize_rows(sums)
+        if np.allclose(new_centroids, centroids, atol=1e-6):
+            centroids = new_centroids
+            break
+        centroids = new_centroids
+    return centroids
+
+
+class IVFIndex:
+    """<root>/.index/ann/ の IVF インデックス。"""
+
+    def __init__(self, corpus: CorpusIndex):
+        self.corpus = corpus
+        self.index_dir = corpus_index_dir(corpus.root, "ann")
+        self.meta_path = self.index_dir / "ann.json"
+        self.meta = self._load_meta()
+        self._centroids = None
+        self._lists = None
+        self._offsets = None
+
+    def _load_meta(self) -> Optional[Dict[str, Any]]:
+        if not self.meta_path.exists():
+            return None
+        try:
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except Exception:
+            return None
+        if meta.get("format") != ANN_FORMAT:
+            return None
+        return meta
+
+    def exists(self) -> bool:
+        return self.meta is not None
+
+    @property
+    def nlist(self) -> int:
+        return int(self.meta["nlist"]) if self.meta else 0
+
+    def is_compatible(self) -> bool:
+        """コーパスの行番号体系（世代・次元数）と一致しているか。"""
+        return (
+            self.meta is not None
+            and self.meta.get("corpus_generation") == self.corpus.manifest.get("generation")
+            and self.meta.get("dimensions") == self.corpus.dimensions
+            and self.meta.get("indexed_rows", 0) <= self.corpus.rows
+        )
+
+    # ── 構築・更新 ───────────────────────────────
+
+    def _save(self, centroids: np.ndarray, assignments: np.ndarray, meta: Dict[str, Any]):
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        order = np.argsort(assignments, kind="stable").astype(np.int32)
+        offsets = np.searchsorted(
+            assignments[order], np.arange(centroids.shape[0] + 1)
+        ).astype(np.int64)
+        for name, arr in (
+            ("centroids", centroids.astype(np.float32)),
+            ("assignments", assignments.astype(np.int32)),
+            ("lists", order),
+            ("offsets", offsets),
+        ):
+            tmp_path = self.index_dir / f"{name}.npy.tmp"
+            with open(tmp_path, "wb") as f:
+                np.save(f, arr, allow_pickle=False)
+            os.replace(tmp_path, self.index_dir / f"{name}.npy")
+        # メタデータを最後に置き換える
+        tmp_path = self.meta_path.with_name(self.meta_path.name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_path, self.meta_path)
+        self.meta = meta
+        self._centroids = self._lists = self._offsets = None
+
+    def build(self, nlist: Optional[int] = None, iterations: int = 20, seed: int = 0) -> Dict[str, Any]:
+        """コーパス全行からクラスタ中心を学習し、インデックスを作り直す。"""
+        vectors = self.corpus.matrix()
+        rows = self.corpus.rows
+        if rows == 0:
+            raise ValueError("コーパスインデックスが空です")
+        centroids = train_centroids(vectors, nlist or default_nlist(rows), iterations=iterations, seed=seed)
+        assignments = _assign(vectors, centroids)
+        meta = {
+            "format": ANN_FORMAT,
+            "version": ANN_VERSION,
+            "nlist": int(centroids.shape[0]),
+            "dimensions": self.corpus.dimensions,
+            "model": self.corpus.manifest.get("model", ""),
+            "corpus_generation": self.corpus.manifest.get("generation"),
+            "trained_rows": rows,
+            "indexed_rows": rows,
+            # 明示指定した nlist（None なら再学習時も行数から自動決定）
+            "requested_nlist": nlist,
+        }
+        self._save(centroids, assignments, meta)
+        return meta
+
+    def update(self) -> str:
+        """コーパスの変化に合わせてインデックスを更新する。
+
+        Returns:
+            "unchanged" / "appended" / "rebuilt"
+        """
+        if not self.is_compatible() or self.corpus.rows > self.meta.get("trained_rows", 0) * RETRAIN_GROWTH:
+            self.build(nlist=self.meta.get("requested_nlist") if self.meta else None)
+            return "rebuilt"
+
+        indexed = self.meta.get("indexed_rows", 0)
+        if indexed == self.corpus.rows:
+            return "unchanged"
+
+        centroids = np.load(self.index_dir / "centroids.npy", allow_pickle=False)
+        old_assignments = np.load(self.index_dir / "assignments.npy", allow_pickle=False)
+        new_assignments = _assign(self.corpus.matrix()[indexed:], centroids)
+        assignments = np.concatenate([old_assignments[:indexed], new_assignments])
+        self._centroids = self._lists = self._offsets = None
+        self._save(centroids, assignments, dict(self.meta, indexed_rows=self.corpus.rows))
+        return "appended"
+
+    # ── 検索 ──────────────────────────────────────
+
+    def _load_arrays(self):
+        if self._centroids is not None:
+            return
+        self._centroids = np.load(self.index_dir / "centroids.npy", mmap_mode="r", allow_pickle=False)
+        self._lists = np.load(self.index_dir / "lists.npy", mmap_mode="r", allow_pickle=False)
+        self._offsets = np.load(self.index_dir / "offsets.npy", allow_pickle=False)
+
+    def candidate_rows(self, query: np.ndarray, nprobe: int = DEFAULT_NPROBE) -> np.ndarray:
+        """クエリに近い nprobe クラスタの行 + 未インデックスの末尾行を返す。"""
+        self._load_arrays()
+        probes = top_k_indices(self._centroids @ query, max(1, nprobe))
+        parts = [np.asarray(self._lists[self._offsets[c]:self._offsets[c + 1]]) for c in probes]
+        indexed = self.meta.get("indexed_rows", 0)
+        if indexed < self.corpus.rows:
+            parts.append(np.arange(indexed, self.corpus.rows, dtype=np.int32))
+        if not parts:
+            return np.empty(0, dtype=np.int32)
+        return np.sort(np.concatenate(parts))
+
+    def _score_candidates(
+        self, query_embedding: List[float], nprobe: int, include: Optional[Include]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        query = query_vector(query_embedding, self.corpus.dimensions,
+                             self.corpus.model, self.corpus.fingerprint)
+        rows = self.candidate_rows(query, nprobe)
+        if rows.shape[0] == 0:
+            return rows, np.zeros(0, dtype=np.float32)
+        rows = rows[self.corpus.row_mask(include)[rows]]
+        scores = np.asarray(self.corpus.matrix()[rows]) @ query
+        return rows, scores
+
+    def search(
+        self,
+        query_embedding: List[float],
+        top_k: int = 5,
+        nprobe: int = DEFAULT_NPROBE,
+        include: Optional[Include] = None,
+    ) -> List[Dict[str, Any]]:
+        """近似 top_k 検索。戻り値の形式は CorpusIndex.search と同じ。"""
+        rows, scores = self._score_candidates(query_embedding, nprobe, include)
+        results = []
+        for i in top_k_indices(scores, top_k):
+            path, page = self.corpus.row_location(rows[i])
+            results.append({"path": path, "page": page, "score": float(scores[i])})
+        return results
+
+    def all_scores(
+        self,
+        query_embedding: List[float],
+        nprobe: int = DEFAULT_NPROBE,
+        include: Optional[Include] = None,
+    ) -> List[Tuple[str, int, float]]:
+        """探索したクラスタ内の行だけの (相対パス, ページ番号, スコア) を返す。"""
+        rows, scores = self._score_candidates(query_embedding, nprobe, include)
+        return [
+            (path, page, score)
+            for (path, page), score in zip(self.corpus.row_locations(rows), scores.tolist())
+        ]
+
+    def candidate_count(self, query_embedding: List[float], nprobe: int = DEFAULT_NPROBE) -> int:
+        """探索対象になる行数（スキャン量の目安）。"""
+        query = query_vector(query_embedding, self.corpus.dimensions,
+                             self.corpus.model, self.corpus.fingerprint)
+        return int(self.candidate_rows(query, nprobe).shape[0])
+
+
+def recall_at_k(approx: List[Dict[str, Any]], exact: List[Dict[str, Any]]) -> float:
+    """厳密検索の上位 k 件のうち、近似検索で見つかった割合。"""
+    if not exact:
+        return 1.0
+    truth = {(r["path"], r["page"]) for r in exact}
+    found = {(r["path"], r["page"]) for r in approx}
+    return len(truth & found) / len(truth)
+
+
+def evaluate_recall(
+    ann: IVFIndex,
+    top_k: int = 10,
+    nprobe: int = DEFAULT_NPROBE,
+    sample_queries: int = 100,
+    seed: int = 0,
+) -> Dict[str, float]:
+    """コーパス内のページをクエリとして recall@k と平均スキャン率を推定する。"""
+    corpus = ann.corpus
+    live_rows = np.nonzero(corpus.row_mask(None))[0]
+    if live_rows.shape[0] == 0:
+        return {"recall": 1.0, "scan_ratio": 0.0, "queries": 0}
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(live_rows, min(sample_queries, live_rows.shape[0]), replace=False)
+    vectors = corpus.matrix()
+    recalls, scanned = [], []
+    for row in picks:
+        query = np.asarray(vectors[row])
+        exact = corpus.search(query, top_k)
+        approx = ann.search(query, top_k, nprobe=nprobe)
+        recalls.append(recall_at_k(approx, exact))
+        scanned.append(ann.candidate_count(query, nprobe) / corpus.rows)
+    return {
+        "recall": float(np.mean(recalls)),
+        "scan_ratio": float(np.mean(scanned)),
+        "queries": len(picks),
+    }
+
+
+def open_ann_index(root: Path) -> Optional[IVFIndex]:
+    """既存の ANN インデックスを開く。存在しなければ None。"""
+    corpus = CorpusIndex(root)
+    if not corpus.exists():
+        return None
+    ann = IVFIndex(corpus)
+    if not ann.exists():
+        return None
+    return ann
+
+
+def update_ann_index(root: Path) -> Optional[str]:
+    """ANN インデックスが存在すればコーパスに合わせて増分更新する。"""
+    ann = open_ann_index(root)
+    if ann is None or ann.corpus.rows == 0:
+        return None
+    return ann.update()
@@ -1,22 +1,205 @@
+import io
+import os
 import sys
+import time
 import pdfplumber
+import multiprocessing
+import concurrent.futures
+from collections import deque
 from PIL import Image
-from typing import List
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
 from pathlib import Path
 
-def convert_pdf_to_images(pdf_path: Path) -> List[Image.Image]:
+from pdf.text_layer import read_text_layer
+
+DEFAULT_RESOLUTION = 150
+
+# 描画ワーカー数の既定の上限（Vision API の待ち時間の方が支配的なため、コア数を使い切らない）
+DEFAULT_RENDER_WORKERS = 4
+# 描画ワーカーの起動方式。PDF 分析は API スレッドの動いているプロセスから呼ばれるため fork は使わない
+_MP_CONTEXT = "spawn"
+
+# 描画ワーカープロセス内で開いている PDF (パス, pdfplumber.PDF)
+_worker_pdf: Optional[Tuple[str, Any]] = None
+
+
+def default_render_workers() -> int:
+    return max(1, min(DEFAULT_RENDER_WORKERS, os.cpu_count() or 1))
+
+
+def encode_png(image: Image.Image) -> bytes:
+    """PIL Image を PNG のバイト列にする。"""
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def pdf_page_count(pdf_path: Path) -> int:
+    """PDF のページ数を返す（開けなければ 0）。ページは描画しない。"""
+    try:
+        with pdfplumber.open(pdf_path) as pdf:
+            return len(pdf.pages)
+    except Exception as e:
+        sys.stderr.write(f"Error opening PDF: {e}\n")
+        return 0
+
+
+def _render_page(page, resolution: int) -> Image.Image:
+    try:
+        return page.to_image(resolution=resolution).original
+    finally:
+        # pdfplumber はページのオブジェクトをキャッシュするため描画後に解放する
+        page.close()
+
+
+def _read_page(page, resolution: int, text_layer: bool) -> Tuple[Union[str, Image.Image], Optional[str]]:
+    """text_layer なら先にテキストレイヤーを読み、使えれば Markdown を、使えなければ描画した画像を返す。
+
+    2 つ目の値は pdf.text_layer の分類理由（text_layer でなければ None）。
     """
-    Converts each page of a PDF file into a PIL Image.
-    Returns a list of PIL Images.
+    reason = None
+    if text_layer:
+        markdown, reason = read_text_layer(page)
+        if markdown is not None:
+            page.close()
+            return markdown, reason
+    return _render_page(page, resolution), reason
+
+
+def _count_page(stats: Dict[str, Any], data: Any, reason: Optional[str], busy: float):
+    if isinstance(data, str):
+        stats["local"] += 1
+    else:
+        stats["pages"] += 1
+    if reason is not None:
+        stats["reasons"][reason] = stats["reasons"].get(reason, 0) + 1
+    stats["busy"] += busy
+
+
+def iter_pdf_images(pdf_path: Path, resolution: int = DEFAULT_RESOLUTION,
+                    stats: Optional[Dict[str, Any]] = None,
+                    pages: Optional[Sequence[int]] = None,
+                    text_layer: bool = False) -> Iterator[Union[str, Image.Image]]:
     """
-    images = []
+    Renders the pages of a PDF file one at a time and yields them as PIL Images.
+    Each page's parsed objects are released as soon as its image has been yielded,
+    so memory stays bounded by the pages the caller keeps alive.
+    Stops early (after logging) if a page cannot be rendered.
+
+    With text_layer, each page is first classified by pdf.text_layer; pages with a usable
+    text layer are yielded as Markdown strings instead of being rendered.
+    stats (optional dict) receives {"pages", "local", "reasons", "seconds", "busy", "workers"}:
+    pages rendered, pages read from the text layer, classification reasons,
+    wall time of the stage and time spent reading and rendering.
+    pages (optional) limits rendering to these 1-based page numbers, in the given order.
+    """
+    if stats is not None:
+        stats.update(pages=0, local=0, reasons={}, seconds=0.0, busy=0.0, workers=1)
+    start = time.perf_counter()
     try:
         with pdfplumber.open(pdf_path) as pdf:
-            for page in pdf.pages:
-                p_image = page.to_image(resolution=150)
-                images.append(p_image.original)
+            numbers = range(1, len(pdf.pages) + 1) if pages is None else pages
+            for number in numbers:
+                t = time.perf_counter()
+                data, reason = _read_page(pdf.pages[number - 1], resolution, text_layer)
+                if stats is not None:
+                    _count_page(stats, data, reason, time.perf_counter() - t)
+                    stats["seconds"] = time.perf_counter() - start
+                yield data
     except Exception as e:
         sys.stderr.write(f"Error converting PDF to images: {e}\n")
-        # Return whatever we managed to collect or empty list
 
-    return images
+
+def convert_pdf_to_images(pdf_path: Path) -> List[Image.Image]:
+    """
+    Converts each page of a PDF file into a PIL Image.
+    Returns a list of PIL Images (whatever could be rendered on error).
+    Holds every page in memory; prefer iter_pdf_images() for large PDFs.
+    """
+    return list(iter_pdf_images(pdf_path))
+
+
+def _render_range(pdf_path: str, numbers: List[int], resolution: int,
+                  encoder: Optional[Callable[[Image.Image], Any]] = None,
+                  text_layer: bool = False) -> List[Tuple[int, Any, Optional[str], float]]:
+    """描画ワーカー: ページ numbers（1 始まり）を描画してエンコードし、
+    [(ページ番号, データ, 分類理由, 所要秒)] を返す。
+
+    encoder を省略すると PNG のバイト列にする。text_layer ならテキストレイヤーの使えるページは
+    描画せず Markdown の文字列を返す。
+
+    PDF はワーカーごとに 1 回だけ開き、同じ PDF の次の範囲で使い回す。
+    """
+    global _worker_pdf
+    if _worker_pdf is None or _worker_pdf[0] != pdf_path:
+        if _worker_pdf is not None:
+            _worker_pdf[1].close()
+        _worker_pdf = (pdf_path, pdfplumber.open(pdf_path))
+    pages = _worker_pdf[1].pages
+    rendered = []
+    for number in numbers:
+        t = time.perf_counter()
+        data, reason = _read_page(pages[number - 1], resolution, text_layer)
+        if not isinstance(data, str):
+            data = (encoder or encode_png)(data)
+        rendered.append((number, data, reason, time.perf_counter() - t))
+    return rendered
+
+
+def iter_encoded_pages(pdf_path: Path, workers: Optional[int] = None, resolution: int = DEFAULT_RESOLUTION,
+                       chunk_pages: Optional[int] = None,
+                       stats: Optional[Dict[str, Any]] = None,
+                       pages: Optional[Sequence[int]] = None,
+                       encoder: Optional[Callable[[Image.Image], Any]] = None,
+                       text_layer: bool = False) -> Iterator[Any]:
+    """
+    Renders and encodes PDF pages in a pool of worker processes and yields the
+    encoded pages in page order.
+
+    The page range is split into chunks of consecutive pages spread across the workers.
+    At most two chunks per worker are outstanding, so memory stays bounded when the
+    consumer is slower than rendering. workers <= 1 renders in this process.
+    stats receives the same keys as iter_pdf_images() ("busy" is summed over workers).
+    pages (optional) limits rendering to these 1-based page numbers, in the given order.
+    encoder (optional) turns each rendered PIL Image into what is yielded (default: PNG bytes).
+    It runs in the workers, so it must be picklable (a module-level function or a partial of one).
+    text_layer: as in iter_pdf_images(); the classification also runs in the workers and
+    pages with a usable text layer are yielded as Markdown strings.
+    """
+    workers = default_render_workers() if workers is None else max(1, workers)
+    encoder = encoder or encode_png
+    if workers == 1:
+        for data in iter_pdf_images(pdf_path, resolution, stats, pages, text_layer):
+            yield data if isinstance(data, str) else encoder(data)
+        return
+
+    numbers = list(range(1, pdf_page_count(pdf_path) + 1) if pages is None else pages)
+    total = len(numbers)
+    if stats is not None:
+        stats.update(pages=0, local=0, reasons={}, seconds=0.0, busy=0.0, workers=workers)
+    if not total:
+        return
+    chunk_pages = chunk_pages or max(1, min(8, -(-total // (workers * 4))))
+    ranges = deque(numbers[first:first + chunk_pages] for first in range(0, total, chunk_pages))
+    start = time.perf_counter()
+    context = multiprocessing.get_context(_MP_CONTEXT)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        pending: deque = deque()
+        try:
+            while ranges or pending:
+                while ranges and len(pending) < workers * 2:
+                    pending.append(executor.submit(_render_range, str(pdf_path), ranges.popleft(), resolution,
+                                                   encoder, text_layer))
+                try:
+                    rendered = pending.popleft().result()
+                except Exception as e:
+                    sys.stderr.write(f"Error converting PDF to images: {e}\n")
+                    return
+                for _, data, reason, busy in rendered:
+                    if stats is not None:
+                        _count_page(stats, data, reason, busy)
+                        stats["seconds"] = time.perf_counter() - start
+                    yield data
+        finally:
+            for future in pending:
+                future.cancel()
@@ -0,0 +1,525 @@
+"""コーパス全体のベクトルインデックス。
+
+database/ 配下の全ドキュメントの embedding を 1 つの連続した float32 行列にまとめ、
+クエリを N 個のファイルを開く代わりに 1 回の行列スキャンで処理する。
+
+    <root>/.index/vectors/
+        manifest.json          {model, fingerprint, dimensions, rows, generation, documents: [...]}
+        vectors-<gen>.f32      正規化済み float32 行列 (rows x dimensions, 追記のみ)
+        row_docs-<gen>.i32     行ごとのドキュメント ID
+        row_pages-<gen>.i32    行ごとのページ番号
+
+ドキュメントの追加はデータファイル末尾への追記 + manifest の置き換えで行い、
+既存の行は書き換えない。manifest が確定済みの行数を持つため、追記途中で
+中断しても読み込み側は壊れない。再分析・削除されたドキュメントは tombstone として
+manifest 上で無効化し、compact() で新しい世代のデータファイルに詰め直す。
+古い manifest を読んだ検索が続けられるよう、1 つ前の世代のデータファイルは次の
+compact() / reset() まで残す。
+モデル・次元数の異なるドキュメントは登録せずにスキップし、インデックスを作り直すのは
+sync(rebuild=True)（--build-index）の時だけにする。
+書き込みは .lock ファイルのロックでプロセス間でも直列化し、manifest を読み直してから行う。
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+import contextlib
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Iterable, Set, Tuple, Union
+
+import numpy as np
+
+from pdf.file_manager import corpus_index_dir, find_page_json_files
+from pdf.similarity import EmbeddingMatrix, query_vector, top_k_indices
+
+INDEX_FORMAT = "ucf-corpus-index"
+INDEX_VERSION = 1
+
+# tombstone 行がこの割合を超えたら自動で compact する
+COMPACT_RATIO = 0.25
+
+_VECTOR_DTYPE = np.dtype("<f4")
+_ID_DTYPE = np.dtype("<i4")
+
+# 検索対象: ドキュメントの相対パスの集合、または {相対パス: {ページ番号, ...}}
+Include = Union[Set[str], Dict[str, Set[Any]]]
+
+# 同一プロセス内の書き込みを直列化する（PDF 分析スレッドとマイグレーション等）
+_write_lock = threading.Lock()
+
+if os.name == "nt":
+    import msvcrt
+
+    def _lock_file(f):
+        f.seek(0)
+        while True:
+            try:
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                return
+            except OSError:
+                time.sleep(0.05)
+
+    def _unlock_file(f):
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+else:
+    import fcntl
+
+    def _lock_file(f):
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+
+    def _unlock_file(f):
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _log(msg: str):
+    sys.stderr.write(msg + "\n")
+    sys.stderr.flush()
+
+
+def _model_label(model: str, dimensions: int, fingerprint: str = "") -> str:
+    return f"{model}/{dimensions}" + (f"@{fingerprint}" if fingerprint else "")
+
+
+class CorpusIndex:
+    """<root>/.index/vectors/ の読み書きを行う。"""
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.index_dir = corpus_index_dir(self.root, "vectors")
+        self.manifest_path = self.index_dir / "manifest.json"
+        self.manifest = self._load_manifest()
+        self._vectors = None
+        self._row_docs = None
+        self._row_pages = None
+
+    # ── manifest ─────────────────────────────────
+
+    @staticmethod
+    def _empty_manifest() -> Dict[str, Any]:
+        return {
+            "format": INDEX_FORMAT,
+            "version": INDEX_VERSION,
+            "model": "",
+            "fingerprint": "",
+            "dimensions": 0,
+            "rows": 0,
+            "generation": 0,
+            "documents": [],
+        }
+
+    def _load_manifest(self) -> Dict[str, Any]:
+        if not self.manifest_path.exists():
+            return self._empty_manifest()
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except Exception:
+            return self._empty_manifest()
+        if manifest.get("format") != INDEX_FORMAT:
+            return self._empty_manifest()
+        return manifest
+
+    def _save_manifest(self):
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.manifest_path.with_name(self.manifest_path.name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, ensure_ascii=False)
+        os.replace(tmp_path, self.manifest_path)
+        self._vectors = self._row_docs = self._row_pages = None
+
+    def exists(self) -> bool:
+        return self.manifest_path.exists()
+
+    @property
+    def rows(self) -> int:
+        return int(self.manifest.get("rows", 0))
+
+    @property
+    def dimensions(self) -> int:
+        return int(self.manifest.get("dimensions", 0))
+
+    @property
+    def model(self) -> str:
+        return self.manifest.get("model", "")
+
+    @property
+    def fingerprint(self) -> str:
+        """ローカルモデルの fingerprint（API のモデルは空文字）。"""
+        return self.manifest.get("fingerprint", "")
+
+    def _data_path(self, kind: str, generation: Optional[int] = None) -> Path:
+        gen = self.manifest.get("generation", 0) if generation is None else generation
+        suffix = "f32" if kind == "vectors" else "i32"
+        return self.index_dir / f"{kind}-{gen}.{suffix}"
+
+    def live_documents(self) -> Dict[str, Dict[str, Any]]:
+        """tombstone されていないドキュメントを {rel_path: entry} で返す。"""
+        return {
+            doc["path"]: doc
+            for doc in self.manifest.get("documents", [])
+            if not doc.get("deleted")
+        }
+
+    def tombstoned_rows(self) -> int:
+        return sum(doc["count"] for doc in self.manifest.get("documents", []) if doc.get("deleted"))
+
+    def _rel_path(self, json_path: Path) -> str:
+        return Path(json_path).relative_to(self.root).as_posix()
+
+    # ── 書き込み ─────────────────────────────────
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """書き込み区間。別プロセス（分析とマイグレーション等）の書き込みとも直列化し、
+        そのプロセスが書いた manifest を読み直してから変更させる。"""
+        with _write_lock:
+            self.index_dir.mkdir(parents=True, exist_ok=True)
+            with open(self.index_dir / ".lock", "a+b") as f:
+                _lock_file(f)
+                try:
+                    self.manifest = self._load_manifest()
+                    self._vectors = self._row_docs = self._row_pages = None
+                    yield
+                finally:
+                    _unlock_file(f)
+
+    def _truncate_to_committed(self):
+        """manifest に記録されていない（中断した追記の）末尾を切り詰める。"""
+        rows = self.rows
+        for kind, itemsize in (
+            ("vectors", _VECTOR_DTYPE.itemsize * self.dimensions),
+            ("row_docs", _ID_DTYPE.itemsize),
+            ("row_pages", _ID_DTYPE.itemsize),
+        ):
+            path = self._data_path(kind)
+            if path.exists() and path.stat().st_size > rows * itemsize:
+                with open(path, "r+b") as f:
+                    f.truncate(rows * itemsize)
+
+    def reset(self, model: str = "", dimensions: int = 0, fingerprint: str = ""):
+        """インデックスを空にする（モデル・次元数が変わった場合など）。"""
+        old_gen = self.manifest.get("generation", 0)
+        self.manifest = self._empty_manifest()
+        self.manifest["generation"] = old_gen + 1
+        self.manifest["model"] = model
+        self.manifest["fingerprint"] = fingerprint
+        self.manifest["dimensions"] = dimensions
+        self._save_manifest()
+        self._remove_generations_before(old_gen)
+
+    def _remove_generations_before(self, generation: int):
+        """generation より古い世代のデータファイルを削除する（直前の世代は読み込み中の検索のために残す）。"""
+        for kind in ("vectors", "row_docs", "row_pages"):
+            suffix = self._data_path(kind).suffix
+            for path in self.index_dir.glob(f"{kind}-*{suffix}"):
+                gen = path.stem[len(kind) + 1:]
+                if gen.isdigit() and int(gen) < generation:
+                    try:
+                        path.unlink()
+                    except OSError:
+                        pass
+
+    def _tombstone(self, rel_path: str) -> bool:
+        changed = False
+        for doc in self.manifest.get("documents", []):
+            if doc["path"] == rel_path and not doc.get("deleted"):
+                doc["deleted"] = True
+                changed = True
+        return changed
+
+    def add_document(
+        self,
+        json_path: Path,
+        matrix: Optional[EmbeddingMatrix] = None,
+        source_mtime: Optional[float] = None,
+    ) -> int:
+        """ドキュメントの embedding を末尾に追記する。追記した行数を返す。
+
+        同じドキュメントの旧バージョンは tombstone される（既存行は書き換えない）。
+        インデックスとモデル・次元数が異なるドキュメントは追記せずに 0 を返す。
+        """
+        from pdf.embedding_store import load_embedding_matrix, embeddings_mtime
+
+        json_path = Path(json_path)
+        if matrix is None:
+            matrix = load_embedding_matrix(json_path)
+            if matrix is None:
+                return 0
+        if source_mtime is None:
+            source_mtime = embeddings_mtime(json_path)
+
+        rel = self._rel_path(json_path)
+        with self._locked():
+            if self.rows == 0 and not self.live_documents():
+                self.manifest["dimensions"] = matrix.dimensions
+                self.manifest["model"] = matrix.model
+                self.manifest["fingerprint"] = matrix.fingerprint
+            elif matrix.dimensions != self.dimensions or (
+                matrix.model and self.model and matrix.model != self.model
+            ) or (
+                matrix.fingerprint and self.fingerprint and matrix.fingerprint != self.fingerprint
+            ):
+                _log(f"  Corpus index model mismatch ({_model_label(self.model, self.dimensions, self.fingerprint)}"
+                     f" != {_model_label(matrix.model, matrix.dimensions, matrix.fingerprint)}); skipping {rel}."
+                     f" Run `uv run python -m pdf.migration --dir {self.root} --build-index` to rebuild.")
+                return 0
+
+            self._truncate_to_committed()
+            self._tombstone(rel)
+
+            documents = self.manifest.setdefault("documents", [])
+            doc_id = len(documents)
+            count = len(matrix)
+            vectors = np.ascontiguousarray(matrix.vectors, dtype=_VECTOR_DTYPE)
+            with open(self._data_path("vectors"), "ab") as f:
+                f.write(vectors.tobytes())
+            with open(self._data_path("row_docs"), "ab") as f:
+                f.write(np.full(count, doc_id, dtype=_ID_DTYPE).tobytes())
+            with open(self._data_path("row_pages"), "ab") as f:
+                f.write(np.asarray(matrix.page_numbers, dtype=_ID_DTYPE).tobytes())
+
+            documents.append({
+                "id": doc_id,
+                "path": rel,
+                "start": self.rows,
+                "count": count,
+                "source_mtime": source_mtime,
+                "deleted": False,
+            })
+            self.manifest["rows"] = self.rows + count
+            self._save_manifest()
+        return count
+
+    def remove_document(self, json_path: Path) -> bool:
+        """ドキュメントを tombstone する。"""
+        with self._locked():
+            if not self._tombstone(self._rel_path(json_path)):
+                return False
+            self._save_manifest()
+        return True
+
+    def compact(self):
+        """tombstone 行を取り除き、新しい世代のデータファイルに詰め直す。"""
+        with self._locked():
+            self._load_arrays()
+            old_gen = self.manifest.get("generation", 0)
+            new_gen = old_gen + 1
+            live_docs = [d for d in self.manifest.get("documents", []) if not d.get("deleted")]
+
+            new_docs = []
+            start = 0
+            with open(self._data_path("vectors", new_gen), "wb") as fv, \
+                    open(self._data_path("row_docs", new_gen), "wb") as fd, \
+                    open(self._data_path("row_pages", new_gen), "wb") as fp:
+                for new_id, doc in enumerate(live_docs):
+                    lo, hi = doc["start"], doc["start"] + doc["count"]
+                    fv.write(np.ascontiguousarray(self._vectors[lo:hi]).tobytes())
+                    fd.write(np.full(doc["count"], new_id, dtype=_ID_DTYPE).tobytes())
+                    fp.write(np.ascontiguousarray(self._row_pages[lo:hi]).tobytes())
+                    new_docs.append({**doc, "id": new_id, "start": start})
+                    start += doc["count"]
+
+            self.manifest["documents"] = new_docs
+            self.manifest["rows"] = start
+            self.manifest["generation"] = new_gen
+            self._save_manifest()
+            self._remove_generations_before(old_gen)
+
+    def sync(self, json_files: Optional[Iterable[Path]] = None, rebuild: bool = False) -> Dict[str, int]:
+        """ディスク上の embedding とインデックスを同期する。
+
+        新規・更新されたドキュメントを追記し、消えたドキュメントを tombstone する。
+        rebuild=True なら空にしてから全件を登録し直す（embedding のモデル・次元数を変えた後）。
+        """
+        from pdf.embedding_store import embeddings_mtime
+
+        if json_files is None:
+            json_files = find_page_json_files(str(self.root))
+        if rebuild:
+            with self._locked():
+                self.reset()
+
+        stats = {"added": 0, "removed": 0, "rows": 0}
+        seen = set()
+        for jf in json_files:
+            mtime = embeddings_mtime(jf)
+            if mtime is None:
+                continue
+            rel = self._rel_path(jf)
+            seen.add(rel)
+            doc = self.live_documents().get(rel)
+            if doc is not None and doc.get("source_mtime") == mtime:
+                continue
+            rows = self.add_document(jf, source_mtime=mtime)
+            if rows:
+                stats["added"] += 1
+                stats["rows"] += rows
+
+        for rel in set(self.live_documents()) - seen:
+            with self._locked():
+                self._tombstone(rel)
+                self._save_manifest()
+            stats["removed"] += 1
+
+        if self.rows and self.tombstoned_rows() / self.rows > COMPACT_RATIO:
+            self.compact()
+        return stats
+
+    # ── 読み込み・検索 ────────────────────────────
+
+    def _load_arrays(self):
+        if self._vectors is not None:
+            return
+        try:
+            self._map_arrays()
+        except FileNotFoundError:
+            # 読み込んだ manifest の世代が、その後の compact() 2 回分で削除された
+            self.manifest = self._load_manifest()
+            self._map_arrays()
+
+    def _map_arrays(self):
+        rows, dims = self.rows, self.dimensions
+        if rows == 0 or dims == 0:
+            self._vectors = np.zeros((0, dims), dtype=_VECTOR_DTYPE)
+            self._row_docs = np.zeros(0, dtype=_ID_DTYPE)
+            self._row_pages = np.zeros(0, dtype=_ID_DTYPE)
+            return
+        self._vectors = np.memmap(self._data_path("vectors"), dtype=_VECTOR_DTYPE, mode="r", shape=(rows, dims))
+        self._row_docs = np.memmap(self._data_path("row_docs"), dtype=_ID_DTYPE, mode="r", shape=(rows,))
+        self._row_pages = np.memmap(self._data_path("row_pages"), dtype=_ID_DTYPE, mode="r", shape=(rows,))
+
+    def matrix(self) -> np.ndarray:
+        """コーパス全体の正規化済み行列（メモリマップ）を返す。"""
+        self._load_arrays()
+        return self._vectors
+
+    def partition(self, json_files: Iterable[Path]) -> Tuple[Set[str], List[Path]]:
+        """ファイル群を (インデックスが最新のドキュメント, 個別に読む必要があるファイル) に分ける。"""
+        from pdf.embedding_store import embeddings_mtime
+
+        live = self.live_documents()
+        fresh, stale = set(), []
+        for jf in json_files:
+            mtime = embeddings_mtime(jf)
+            if mtime is None:
+                continue
+            rel = self._rel_path(jf)
+            doc = live.get(rel)
+            if doc is not None and doc.get("source_mtime") == mtime:
+                fresh.add(rel)
+            else:
+                stale.append(jf)
+        return fresh, stale
+
+    def row_mask(self, include: Optional[Include]) -> np.ndarray:
+        """tombstone されておらず include に含まれるドキュメントの行を True にしたマスク。
+
+        include に {相対パス: {ページ番号, ...}} を渡すと、そのページの行だけを True にする
+        （pdf.facets のフィルタによる絞り込み）。
+        """
+        self._load_arrays()
+        docs = self.manifest.get("documents", [])
+        live = np.zeros(len(docs), dtype=bool)
+        for doc in docs:
+            if not doc.get("deleted") and (include is None or doc["path"] in include):
+                live[doc["id"]] = True
+        mask = live[self._row_docs]
+        if isinstance(include, dict):
+            # (doc id, ページ番号) を 1 つの整数にして許可リストと照合する
+            allowed = [
+                (doc["id"] << 32) | int(page)
+                for doc in docs if live[doc["id"]]
+                for page in include[doc["path"]] if isinstance(page, int)
+            ]
+            codes = (self._row_docs.astype(np.int64) << 32) | self._row_pages.astype(np.int64)
+            mask &= np.isin(codes, np.array(allowed, dtype=np.int64))
+        return mask
+
+    def scores(
+        self, query_embedding: List[float], include: Optional[Include] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """コサイン類似度を計算し、(scores, 有効行マスク) を返す。
+
+        有効行が全体の半分未満なら有効行だけを計算する（それ以外の行のスコアは -inf）。
+        """
+        self._load_arrays()
+        query = query_vector(query_embedding, self.dimensions, self.model, self.fingerprint)
+        if self.rows == 0:
+            return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=bool)
+        mask = self.row_mask(include)
+        rows = np.nonzero(mask)[0]
+        if len(rows) * 2 >= self.rows:
+            return self._vectors @ query, mask
+        scores = np.full(self.rows, -np.inf, dtype=np.float32)
+        scores[rows] = self._vectors[rows] @ query
+        return scores, mask
+
+    def row_location(self, row: int) -> Tuple[str, int]:
+        """行番号から (ドキュメントの相対パス, ページ番号) を返す。"""
+        doc = self.manifest["documents"][int(self._row_docs[row])]
+        return doc["path"], int(self._row_pages[row])
+
+    def row_locations(self, rows: np.ndarray) -> List[Tuple[str, int]]:
+        """行番号の配列から [(ドキュメントの相対パス, ページ番号), ...] を返す。"""
+        self._load_arrays()
+        docs = self.manifest["documents"]
+        return [
+            (docs[d]["path"], p)
+            for d, p in zip(self._row_docs[rows].tolist(), self._row_pages[rows].tolist())
+        ]
+
+    def search(
+        self,
+        query_embedding: List[float],
+        top_k: int = 5,
+        include: Optional[Include] = None,
+    ) -> List[Dict[str, Any]]:
+        """コーパス全体から上位 top_k ページを返す。
+
+        Returns:
+            スコア降順の [{path, page, score}, ...]（path は root からの相対パス）
+        """
+        scores, mask = self.scores(query_embedding, include)
+        if scores.shape[0] == 0:
+            return []
+        scores = np.where(mask, scores, -np.inf)
+        results = []
+        for row in top_k_indices(scores, top_k):
+            if not np.isfinite(scores[row]):
+                break
+            path, page = self.row_location(row)
+            results.append({"path": path, "page": page, "score": float(scores[row])})
+        return results
+
+    def all_scores(
+        self, query_embedding: List[float], include: Optional[Include] = None
+    ) -> List[Tuple[str, int, float]]:
+        """有効な全行の (相対パス, ページ番号, スコア) を返す（ハイブリッド検索用）。"""
+        scores, mask = self.scores(query_embedding, include)
+        if scores.shape[0] == 0:
+            return []
+        rows = np.nonzero(mask)[0]
+        return [
+            (path, page, score)
+            for (path, page), score in zip(self.row_locations(rows), scores[rows].tolist())
+        ]
+
+
+def open_corpus_index(root: Path) -> Optional[CorpusIndex]:
+    """既存のコーパスインデックスを開く。存在しなければ None。"""
+    index = CorpusIndex(root)
+    if not index.exists():
+        return None
+    return index
+
+
+def update_corpus_index(root: Path, json_path: Path, matrix: Optional[EmbeddingMatrix] = None) -> int:
+    """1 ドキュメント分をコーパスインデックスに追記する（PDF 分析完了時に呼ぶ）。"""
+    index = CorpusIndex(root)
+    rows = index.add_document(json_path, matrix)
+    if index.rows and index.tombstoned_rows() / index.rows > COMPACT_RATIO:
+        index.compact()
+    return rows
@@ -1,28 +1,58 @@
-import io
 import sys
+import time
 import base64
 import json
-from typing import List, Dict, Any, Optional, Callable
+import queue
+import itertools
+import threading
+from typing import Iterable, Dict, Any, List, Optional, Callable, Union
 from PIL import Image
 from dotenv import load_dotenv
 from openai import OpenAI
 import concurrent.futures
 from skills.rag.utils.prompt_loader import PromptLoader
+from pdf.converter import encode_png
 
 load_dotenv()
 
 loader = PromptLoader()
 
+# Vision 変換中（描画済み〜API 応答待ち）に保持するページ数の既定値。
+# ページ画像と base64 データ URL はこの数までしかメモリに載らない。
+DEFAULT_MAX_IN_FLIGHT_PAGES = 16
+# embedding 段で 1 回の API 呼び出しにまとめるページ数の上限（キューにたまっている分だけまとめる）
+DEFAULT_EMBED_BATCH_PAGES = 16
+
+
+def _bytes_to_data_url(data: bytes, mime: str = "image/png") -> str:
+    encoded = base64.b64encode(data).decode("ascii")
+    return f"data:{mime};base64,{encoded}"
+
 
 def _pil_image_to_data_url(image: Image.Image) -> str:
-    buffer = io.BytesIO()
-    image.save(buffer, format="PNG")
-    encoded = base64.b64encode(buffer.getvalue()).decode("ascii")
-    return f"data:image/png;base64,{encoded}"
+    return _bytes_to_data_url(encode_png(image))
+
+
+def _encode_page(page: Union[Image.Image, bytes, Dict[str, Any]],
+                 encoder: Optional[Callable[[Image.Image], Dict[str, Any]]] = None) -> Dict[str, Any]:
+    """描画済みページを Vision API に送る形 {"images": [bytes], "mime", "detail"} にそろえる。
+
+    page は PIL Image（encoder があればそれで、なければ PNG でエンコード）、
+    描画ワーカーが PNG にしたバイト列、またはエンコード済みの dict (pdf.image_encoding)。
+    """
+    if isinstance(page, dict):
+        return page
+    if isinstance(page, (bytes, bytearray)):
+        return {"images": [bytes(page)], "mime": "image/png", "detail": "high"}
+    if encoder is not None:
+        return encoder(page)
+    return {"images": [encode_png(page)], "mime": "image/png", "detail": "high"}
 
 
-def _image_to_markdown(client: OpenAI, model: str, data_url: str, page_number: int) -> str:
-    """Vision API で画像を Markdown に変換する。"""
+def _image_to_markdown(client: OpenAI, model: str, data_url: Union[str, List[str]], page_number: int,
+                       detail: str = "high") -> str:
+    """Vision API で画像を Markdown に変換する（ページを分割した画像は上から順に並べて送る）。"""
+    data_urls = [data_url] if isinstance(data_url, str) else data_url
     instruction = f"Page {page_number:03}: {loader.get_prompt('PDF_EXTRACTION_PAGE_INSTRUCTIONS')}"
     token_param = "max_completion_tokens" if model.startswith(("gpt-5", "o1", "o3", "o4")) else "max_tokens"
     response = client.chat.completions.create(
@@ -31,7 +61,7 @@ def _image_to_markdown(client: OpenAI, model: str, data_url: str, page_number: i
             {"role": "system", "content": loader.get_prompt("PDF_EXTRACTION_SYSTEM_PROMPT")},
             {"role": "user", "content": [
                 {"type": "text", "text": instruction},
-                {"type": "image_url", "image_url": {"url": data_url, "detail": "high"}},
+                *({"type": "image_url", "image_url": {"url": url, "detail": detail}} for url in data_urls),
             ]},
         ],
         **{token_param: 4096},
@@ -84,75 +114,141 @@ def _markdown_to_metadata(client: OpenAI, model: str, markdown: str) -> dict:
 
 
 def process_pages_batch(
-    images: List[Image.Image],
+    images: Iterable[Union[Image.Image, bytes, Dict[str, Any]]],
     client: OpenAI,
     vision_model: str = "gpt-4.1-mini",
     summary_model: str = "gpt-4.1-mini",
     max_concurrency: int = 100,
     progress_callback: Optional[Callable[[str, int, int], None]] = None,
-) -> Dict[int, Dict[str, str]]:
+    total: Optional[int] = None,
+    max_in_flight: int = DEFAULT_MAX_IN_FLIGHT_PAGES,
+    stage_stats: Optional[Dict[str, Dict[str, float]]] = None,
+    page_numbers: Optional[Iterable[int]] = None,
+    local_markdown: Optional[Dict[int, str]] = None,
+    encoder: Optional[Callable[[Image.Image], Dict[str, Any]]] = None,
+    embedder: Optional[Callable[[List[Dict[str, Any]]], List[Any]]] = None,
+    embed_batch_size: int = DEFAULT_EMBED_BATCH_PAGES,
+) -> Dict[int, Dict[str, Any]]:
     """
-    Processes a batch of images: Image -> Markdown -> Summary.
-    Returns a dict: {page_num: {"markdown": str, "summary": str}}
+    Processes pages as a per-page dataflow: Image -> Markdown -> Metadata (-> Embedding).
+    Returns a dict: {page_num: {"markdown": str, "summary": str, "metadata": dict}}
 
-    progress_callback(phase, completed, total): called on each step completion.
-      phase: "converting" or "summarizing"
+    Each page moves to the next stage as soon as its previous step completes; there is no
+    barrier between the stages, so a slow page only delays itself.
+
+    images may be a lazy iterator of PIL Images, PNG bytes or encoded pages
+    (converter.iter_pdf_images / iter_encoded_pages, optionally with a pdf.image_encoding
+    encoder). Markdown strings (pages read from the text layer, text_layer=True) skip the
+    vision model and go straight to metadata.
+    PIL Images are encoded with encoder (default: PNG). Pages are pulled, encoded,
+    sent to the vision model and released one by one; at most max_in_flight pages are held
+    between rendering and the API response.
+    page_numbers gives the page number of each image (default 1, 2, ...).
+    local_markdown holds pages already converted without the vision model
+    (pdf.text_layer); they skip step 1 but still get metadata.
+    total is the expected page count for progress reporting (defaults to len(images)
+    plus the local pages when images has a length, otherwise None).
+    embedder (optional) receives lists of finished page entries ({"page", "summary",
+    "content", "metadata"}, up to embed_batch_size at a time, fed through a queue bounded by
+    max_in_flight) and returns one value per entry, stored as the page's "embedding".
+    Pages whose embedding failed (an error, or fewer values than entries) have no
+    "embedding" key. If the embedding stage stops, the remaining pages skip it.
+    stage_stats (optional dict) receives {"vision": {"pages", "seconds"}, "metadata": {...},
+    "embedding": {...}, "pipeline": {...}, "upload": {"pages", "bytes", "tokens"}}.
+    seconds is the span from the stage's first start to its last completion (stages overlap);
+    tokens are estimated image tokens, when known.
+
+    progress_callback(phase, completed, total): called on each step completion
+      (serialized, but possibly from worker threads). total is None when unknown.
+      phase: "converting", "summarizing" or "embedding"
     """
-    # Prepare base64 data URLs
-    vision_inputs = []
-    for i, img in enumerate(images):
-        vision_inputs.append({
-            "data_url": _pil_image_to_data_url(img),
-            "page_number": i + 1
-        })
-
-    total = len(images)
-
-    markdown_results = [None] * total
-    summary_results = [None] * total
-
-    # 1. Image -> Markdown (concurrent)
-    def _convert_page(item):
-        return _image_to_markdown(client, vision_model, item["data_url"], item["page_number"])
-
-    completed_count = 0
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrency) as executor:
-        futures = {executor.submit(_convert_page, item): i for i, item in enumerate(vision_inputs)}
-        for future in concurrent.futures.as_completed(futures):
-            index = futures[future]
+    local_markdown = dict(local_markdown or {})
+    if total is None and hasattr(images, "__len__"):
+        total = len(images) + len(local_markdown)
+    max_in_flight = max(1, max_in_flight)
+    if page_numbers is None:
+        page_numbers = itertools.count(1)
+
+    results: Dict[int, Dict[str, Any]] = {}
+    lock = threading.Lock()
+    progress_lock = threading.Lock()
+    counts = {"converting": len(local_markdown), "summarizing": 0, "embedding": 0}
+    spans: Dict[str, list] = {}
+    upload = {"pages": 0, "bytes": 0, "tokens": 0}
+    pipeline_start = time.perf_counter()
+
+    def _stage_started(stage: str):
+        with lock:
+            spans.setdefault(stage, [time.perf_counter(), time.perf_counter(), 0])
+
+    def _stage_done(stage: Optional[str], phase: str, pages: int = 1):
+        with lock:
+            if stage is not None:
+                span = spans[stage]
+                span[1] = time.perf_counter()
+                span[2] += pages
+            counts[phase] += pages
+            completed = counts[phase]
+        if progress_callback:
+            with progress_lock:
+                progress_callback(phase, completed, None if total is None else max(total, completed))
+
+    # 4. Embedding: finished pages are batched from a bounded queue by one thread
+    embed_queue: "queue.Queue[Optional[int]]" = queue.Queue(maxsize=max_in_flight)
+    embed_failed = threading.Event()
+
+    def _embed_batches():
+        finished = False
+        while not finished:
+            batch = [embed_queue.get()]
+            while len(batch) < embed_batch_size:
+                try:
+                    batch.append(embed_queue.get_nowait())
+                except queue.Empty:
+                    break
+            finished = None in batch
+            batch = [page_num for page_num in batch if page_num is not None]
+            if not batch:
+                continue
+            _stage_started("embedding")
             try:
-                markdown_results[index] = future.result()
+                values = list(embedder([_page_entry(page_num, results[page_num]) for page_num in batch]))
+                if len(values) != len(batch):
+                    raise ValueError(f"embedder returned {len(values)} values for {len(batch)} pages")
+                for page_num, value in zip(batch, values):
+                    results[page_num]["embedding"] = value
             except Exception as e:
-                sys.stderr.write(f"Error processing page {index+1}: {e}\n")
-                markdown_results[index] = ""
-            completed_count += 1
-            if progress_callback:
-                progress_callback("converting", completed_count, total)
-
-    # 2. Markdown -> Metadata (summary + topics + keywords etc.) (concurrent)
-    def _extract_metadata(md):
-        return _markdown_to_metadata(client, summary_model, md)
-
-    completed_count = 0
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrency) as executor:
-        futures = {executor.submit(_extract_metadata, md): i for i, md in enumerate(markdown_results)}
-        for future in concurrent.futures.as_completed(futures):
-            index = futures[future]
+                pages = ", ".join(str(page_num) for page_num in batch)
+                sys.stderr.write(f"Error generating embeddings for pages {pages}: {e}\n")
+            _stage_done("embedding", "embedding", len(batch))
+
+    def _embed_worker():
+        try:
+            _embed_batches()
+        except Exception as e:
+            # 止まった embedding 段をメタデータ段が待ち続けないよう、以降のページは embedding なしにする
+            sys.stderr.write(f"Embedding stage stopped: {e}\n")
+            embed_failed.set()
+
+    def _to_embed_queue(item: Optional[int]):
+        """embedding 段にページを渡す（キューが埋まっていれば空くまで待つ。段が止まっていれば渡さない）。"""
+        while not embed_failed.is_set() and embed_thread.is_alive():
             try:
-                summary_results[index] = future.result()
-            except Exception as e:
-                sys.stderr.write(f"Error extracting metadata for page {index+1}: {e}\n")
-                summary_results[index] = {}
-            completed_count += 1
-            if progress_callback:
-                progress_callback("summarizing", completed_count, total)
-
-    results = {}
-    for i in range(total):
-        page_num = i + 1
-        meta = summary_results[i] or {}
+                embed_queue.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    # 3. Markdown -> Metadata (summary + topics + keywords etc.)
+    def _extract_metadata(page_num: int, markdown: str):
+        _stage_started("metadata")
+        try:
+            meta = _markdown_to_metadata(client, summary_model, markdown)
+        except Exception as e:
+            sys.stderr.write(f"Error extracting metadata for page {page_num}: {e}\n")
+            meta = {}
         results[page_num] = {
-            "markdown": markdown_results[i],
+            "markdown": markdown,
             "summary": meta.get("summary", ""),
             "metadata": {
                 "topics": meta.get("topics", []),
@@ -161,5 +257,88 @@ def process_pages_batch(
                 "page_type": meta.get("page_type", "other"),
             },
         }
+        _stage_done("metadata", "summarizing")
+        if embedder is not None:
+            _to_embed_queue(page_num)
+
+    # 2. Image -> Markdown (bounded number of pages in flight)
+    in_flight = threading.Semaphore(max_in_flight)
+    meta_futures: List[concurrent.futures.Future] = []
+
+    def _convert_page(holder: list, page_number: int):
+        _stage_started("vision")
+        try:
+            # 画像は holder から取り出して渡し、エンコード後は API 応答を待つ間も保持しない
+            encoded = _encode_page(holder.pop(), encoder)
+            data_urls = [_bytes_to_data_url(data, encoded["mime"]) for data in encoded["images"]]
+            with lock:
+                upload["pages"] += 1
+                upload["bytes"] += sum(len(data) for data in encoded["images"])
+                upload["tokens"] += encoded.get("tokens", 0)
+            detail = encoded.get("detail", "high")
+            del encoded
+            markdown = _image_to_markdown(client, vision_model, data_urls, page_number, detail=detail)
+        except Exception as e:
+            sys.stderr.write(f"Error processing page {page_number}: {e}\n")
+            markdown = ""
+        finally:
+            in_flight.release()
+        _stage_done("vision", "converting")
+        # 変換が終わったページはすぐに次の段へ進める
+        with lock:
+            meta_futures.append(meta_pool.submit(_extract_metadata, page_number, markdown))
 
-    return results
+    embed_thread = None
+    if embedder is not None:
+        embed_thread = threading.Thread(target=_embed_worker, name="page-embedding", daemon=True)
+        embed_thread.start()
+    workers = max(1, min(max_concurrency, max_in_flight))
+    vision_pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    meta_pool = concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrency)
+    try:
+        # テキストレイヤーから変換済みのページは最初からメタデータ段に入る
+        for page_num, markdown in sorted(local_markdown.items()):
+            meta_futures.append(meta_pool.submit(_extract_metadata, page_num, markdown))
+        # 1. Render: 上限に達していれば、どれかのページの変換が終わるまで次のページを描画しない
+        vision_futures = []
+        in_flight.acquire()
+        for page_num, image in zip(page_numbers, images):
+            if isinstance(image, str):
+                # テキストレイヤーから読めたページは Vision を飛ばしてメタデータ段へ
+                _stage_done(None, "converting")
+                with lock:
+                    meta_futures.append(meta_pool.submit(_extract_metadata, page_num, image))
+                in_flight.release()
+            else:
+                vision_futures.append(vision_pool.submit(_convert_page, [image], page_num))
+            del image
+            in_flight.acquire()
+        in_flight.release()
+        concurrent.futures.wait(vision_futures)
+        with lock:
+            pending = list(meta_futures)
+        concurrent.futures.wait(pending)
+    finally:
+        vision_pool.shutdown(wait=True)
+        meta_pool.shutdown(wait=True)
+        if embed_thread is not None:
+            _to_embed_queue(None)
+            embed_thread.join()
+
+    if stage_stats is not None:
+        for stage, (first, last, pages) in spans.items():
+            stage_stats[stage] = {"pages": pages, "seconds": last - first}
+        stage_stats["upload"] = upload
+        stage_stats["pipeline"] = {"pages": len(results), "seconds": time.perf_counter() - pipeline_start}
+
+    return {page_num: results[page_num] for page_num in sorted(results)}
+
+
+def _page_entry(page_num: int, result: Dict[str, Any]) -> Dict[str, Any]:
+    """処理結果をページ JSON のエントリ（{page, summary, content, metadata}）にする。"""
+    return {
+        "page": page_num,
+        "summary": result["summary"],
+        "content": result["markdown"],
+        "metadata": result["metadata"],
+    }
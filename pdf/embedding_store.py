@@ -0,0 +1,238 @@
+"""バイナリ embedding ストア。
+
+*_embeddings.json（10進テキストの float 配列）の代わりに、
+float32 の .npy 行列 + 小さな JSON サイドカーで embedding を保存する。
+
+    {stem}_embeddings.npy        正規化済み float32 行列 (ページ数 x 次元数)
+    {stem}_embeddings.meta.json  {model, dimensions, count, pages, texts, ...}
+
+truncate_embeddings() は格納済みの embedding を先頭 d 次元に切り詰めて再正規化する
+(Matryoshka 次元削減、API 呼び出し不要)。元の次元数は source_dimensions に記録する。
+
+読み込みは np.load(mmap_mode="r") によるメモリマップで行うため、
+パースはほぼ不要で、複数の検索プロセス間で OS のページキャッシュを共有できる。
+"""
+
+import os
+import json
+from pathlib import Path
+from typing import Dict, Any, Optional, Tuple
+
+import numpy as np
+
+from pdf.similarity import EmbeddingMatrix, normalize_rows, truncate_rows
+
+STORE_FORMAT = "ucf-embeddings"
+STORE_VERSION = 1
+
+
+def json_embeddings_path(json_path: Path) -> Path:
+    """ページ JSON に対応する旧形式 *_embeddings.json のパスを返す。"""
+    return json_path.parent / f"{json_path.stem}_embeddings.json"
+
+
+def binary_embeddings_paths(json_path: Path) -> Tuple[Path, Path]:
+    """ページ JSON に対応する (.npy 行列, サイドカー JSON) のパスを返す。"""
+    base = f"{json_path.stem}_embeddings"
+    return json_path.parent / f"{base}.npy", json_path.parent / f"{base}.meta.json"
+
+
+def has_embeddings(json_path: Path) -> bool:
+    """バイナリ形式または旧 JSON 形式の embedding が存在するか。"""
+    npy_path, meta_path = binary_embeddings_paths(json_path)
+    if npy_path.exists() and meta_path.exists():
+        return True
+    return json_embeddings_path(json_path).exists()
+
+
+def embeddings_mtime(json_path: Path) -> Optional[float]:
+    """embedding の更新時刻（バイナリストア優先）。存在しなければ None。"""
+    npy_path, meta_path = binary_embeddings_paths(json_path)
+    if npy_path.exists() and meta_path.exists():
+        return meta_path.stat().st_mtime
+    emb_path = json_embeddings_path(json_path)
+    if emb_path.exists():
+        return emb_path.stat().st_mtime
+    return None
+
+
+def _atomic_write_bytes(path: Path, write_fn) -> None:
+    """一時ファイルに書き込んでから置き換える（読み込み中の検索を壊さない）。"""
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        write_fn(f)
+    os.replace(tmp_path, path)
+
+
+def save_binary_embeddings(embeddings_data: Dict[str, Any], npy_path: Path) -> Path:
+    """generate_embeddings() 形式の dict をバイナリストアとして保存する。
+
+    npy_path には {stem}_embeddings.npy を渡す。サイドカーは同じ場所に
+    {stem}_embeddings.meta.json として書き出す。サイドカーのパスを返す。
+    """
+    pages = embeddings_data.get("pages", [])
+    dims = embeddings_data.get("dimensions") or (len(pages[0]["embedding"]) if pages else 0)
+    if pages:
+        matrix = normalize_rows(np.array([p["embedding"] for p in pages], dtype=np.float32))
+    else:
+        matrix = np.zeros((0, dims), dtype=np.float32)
+    fingerprint = embeddings_data.get("fingerprint")
+    return _write_binary_store(
+        npy_path, matrix, embeddings_data.get("model", ""),
+        [p["page"] for p in pages], [p.get("text_embedded", "") for p in pages],
+        extra={"fingerprint": fingerprint} if fingerprint else None,
+    )
+
+
+def _write_binary_store(npy_path: Path, matrix: np.ndarray, model: str, pages: list, texts: list,
+                        extra: Optional[Dict[str, Any]] = None) -> Path:
+    """正規化済み行列とサイドカーを書き出し、サイドカーのパスを返す。"""
+    meta = {
+        "format": STORE_FORMAT,
+        "version": STORE_VERSION,
+        "model": model,
+        "dimensions": int(matrix.shape[1]),
+        "count": int(matrix.shape[0]),
+        "dtype": "float32",
+        "normalized": True,
+        "pages": list(pages),
+        "texts": list(texts),
+    }
+    meta.update(extra or {})
+
+    npy_path.parent.mkdir(parents=True, exist_ok=True)
+    meta_path = npy_path.with_suffix(".meta.json")
+    # 行列を先に書き、サイドカーを最後に置き換える（サイドカーが整合性の基準）
+    _atomic_write_bytes(npy_path, lambda f: np.save(f, matrix, allow_pickle=False))
+    _atomic_write_bytes(
+        meta_path,
+        lambda f: f.write(json.dumps(meta, ensure_ascii=False).encode("utf-8")),
+    )
+    return meta_path
+
+
+def load_store_meta(meta_path: Path) -> Optional[Dict[str, Any]]:
+    """サイドカー JSON を読み込む。存在しない・不正な場合は None。"""
+    if not meta_path.exists():
+        return None
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+    except Exception:
+        return None
+    if meta.get("format") != STORE_FORMAT:
+        return None
+    return meta
+
+
+def load_store(npy_path: Path) -> Optional[EmbeddingMatrix]:
+    """.npy 行列とサイドカーをメモリマップで開き、EmbeddingMatrix を返す。"""
+    meta = load_store_meta(npy_path.with_suffix(".meta.json"))
+    if meta is None or not npy_path.exists():
+        return None
+    try:
+        vectors = np.load(npy_path, mmap_mode="r", allow_pickle=False)
+    except Exception:
+        return None
+    if vectors.ndim != 2 or vectors.shape[0] != meta.get("count") or vectors.dtype != np.float32:
+        return None
+    return EmbeddingMatrix(
+        vectors,
+        meta.get("pages", []),
+        meta.get("texts"),
+        normalized=bool(meta.get("normalized")),
+        model=meta.get("model", ""),
+        fingerprint=meta.get("fingerprint", ""),
+    )
+
+
+def load_binary_meta(json_path: Path) -> Optional[Dict[str, Any]]:
+    """バイナリストアのサイドカーを読み込む。存在しない・不正な場合は None。"""
+    _, meta_path = binary_embeddings_paths(json_path)
+    return load_store_meta(meta_path)
+
+
+def load_binary_embeddings(json_path: Path) -> Optional[EmbeddingMatrix]:
+    """バイナリストアをメモリマップで開き、EmbeddingMatrix を返す。"""
+    npy_path, _ = binary_embeddings_paths(json_path)
+    return load_store(npy_path)
+
+
+def load_embedding_matrix(json_path: Path) -> Optional[EmbeddingMatrix]:
+    """ページ JSON に対応する embedding を読み込む。
+
+    バイナリストアを優先し、なければ旧形式の *_embeddings.json にフォールバックする。
+    """
+    matrix = load_binary_embeddings(json_path)
+    if matrix is not None:
+        return matrix
+
+    emb_path = json_embeddings_path(json_path)
+    if not emb_path.exists():
+        return None
+    try:
+        with open(emb_path, "r", encoding="utf-8") as f:
+            emb_data = json.load(f)
+        return EmbeddingMatrix.from_embeddings_data(emb_data)
+    except Exception:
+        return None
+
+
+def convert_json_to_binary(emb_json_path: Path, remove_json: bool = False) -> Optional[Path]:
+    """旧形式の *_embeddings.json をバイナリストアに変換する。
+
+    Returns:
+        書き出した .npy のパス（変換対象でない場合は None）
+    """
+    name = emb_json_path.name
+    if not name.endswith("_embeddings.json"):
+        return None
+
+    with open(emb_json_path, "r", encoding="utf-8") as f:
+        embeddings_data = json.load(f)
+
+    npy_path = emb_json_path.with_name(name[: -len(".json")] + ".npy")
+    save_binary_embeddings(embeddings_data, npy_path)
+    if remove_json:
+        emb_json_path.unlink()
+    return npy_path
+
+
+def truncate_embeddings(json_path: Path, dimensions: int) -> Optional[Tuple[int, int]]:
+    """ページ JSON の embedding を先頭 dimensions 次元に切り詰めてバイナリストアに保存する。
+
+    旧形式の *_embeddings.json しかない場合も、切り詰めたものをバイナリストアとして書き出す。
+
+    Returns:
+        (元の次元数, 新しい次元数)。embedding がない・既に dimensions 次元以下なら None。
+    """
+    npy_path, _ = binary_embeddings_paths(json_path)
+    return _truncate_matrix(lambda: (load_embedding_matrix(json_path), load_binary_meta(json_path)),
+                            npy_path, dimensions)
+
+
+def truncate_store(npy_path: Path, dimensions: int) -> Optional[Tuple[int, int]]:
+    """.npy 行列 + サイドカーのストアを先頭 dimensions 次元に切り詰める（戻り値は truncate_embeddings と同じ）。"""
+    return _truncate_matrix(
+        lambda: (load_store(npy_path), load_store_meta(npy_path.with_suffix(".meta.json"))),
+        npy_path, dimensions,
+    )
+
+
+def _truncate_matrix(load, npy_path: Path, dimensions: int) -> Optional[Tuple[int, int]]:
+    """load() が返す (EmbeddingMatrix, サイドカー) を切り詰めて npy_path に書き出す。"""
+    matrix, meta = load()
+    if matrix is None or matrix.dimensions <= dimensions:
+        return None
+    source = matrix.dimensions
+    meta = meta or {}
+    vectors = truncate_rows(matrix.vectors, dimensions)
+    model, pages, texts = matrix.model, matrix.page_numbers, matrix.texts
+    extra = {"source_dimensions": int(meta.get("source_dimensions") or source)}
+    if matrix.fingerprint:
+        extra["fingerprint"] = matrix.fingerprint
+    # メモリマップを閉じてから .npy を置き換える
+    del matrix
+
+    _write_binary_store(npy_path, vectors, model, pages, texts, extra=extra)
+    return source, dimensions
@@ -2,12 +2,25 @@
 
 OpenAI text-embedding-3-small を使用してページ単位のベクトルを生成し、
 コサイン類似度によるセマンティック検索を提供する。
+類似度計算は pdf.similarity の NumPy 行列エンジンで行う。
+検索クエリの embedding は pdf.query_cache でディスクにキャッシュする。
+
+dimensions を指定すると text-embedding-3 系の短縮ベクトル (Matryoshka) を要求する
+（config.json の embedding_dimensions。None ならモデルの既定次元数）。
+
+model に "local:<name>" を指定すると API を使わず pdf.local_embeddings のローカルモデルで
+embedding を計算する（client は使わないので None でよい）。
 """
 
 import math
-from typing import List, Dict, Any
+import sqlite3
+from typing import List, Dict, Any, Optional, Union
 from openai import OpenAI
 
+from pdf.similarity import EmbeddingMatrix, QueryEmbedding
+from pdf.query_cache import default_cache
+from pdf.local_embeddings import LocalEmbedder, is_local_model, local_embed_texts, model_fingerprint
+
 
 EMBEDDING_MODEL = "text-embedding-3-small"
 EMBEDDING_DIMENSIONS = 1536
@@ -49,12 +62,14 @@ def generate_embeddings(
     pages_data: List[Dict[str, Any]],
     model: str = EMBEDDING_MODEL,
     batch_size: int = 50,
+    dimensions: Optional[int] = None,
 ) -> Dict[str, Any]:
     """全ページのembeddingを一括生成する。
 
     Returns:
         {
             "model": str,
+            "fingerprint": str,   # ローカルモデルのみ（API のモデルは空文字）
             "dimensions": int,
             "pages": [{"page": int, "text_embedded": str, "embedding": List[float]}]
         }
@@ -66,12 +81,8 @@ def generate_embeddings(
         texts.append(text)
         page_numbers.append(page["page"])
 
-    all_embeddings = []
-    for i in range(0, len(texts), batch_size):
-        batch = texts[i:i + batch_size]
-        response = client.embeddings.create(model=model, input=batch)
-        for item in response.data:
-            all_embeddings.append(item.embedding)
+    fingerprint = model_fingerprint(model)
+    all_embeddings = embed_texts(client, texts, model=model, batch_size=batch_size, dimensions=dimensions)
 
     pages_output = []
     for idx, page_num in enumerate(page_numbers):
@@ -83,15 +94,73 @@ def generate_embeddings(
 
     return {
         "model": model,
-        "dimensions": len(all_embeddings[0]) if all_embeddings else EMBEDDING_DIMENSIONS,
+        "fingerprint": fingerprint,
+        "dimensions": len(all_embeddings[0]) if all_embeddings else (dimensions or EMBEDDING_DIMENSIONS),
         "pages": pages_output,
     }
 
 
-def embed_query(client: OpenAI, query: str, model: str = EMBEDDING_MODEL) -> List[float]:
-    """検索クエリのembeddingを生成する。"""
-    response = client.embeddings.create(model=model, input=[query])
-    return response.data[0].embedding
+def embed_texts(
+    client: OpenAI,
+    texts: List[str],
+    model: str = EMBEDDING_MODEL,
+    batch_size: int = 50,
+    dimensions: Optional[int] = None,
+) -> List[List[float]]:
+    """テキスト列の embedding を batch_size 件ずつ生成する（入力と同じ順序で返す）。"""
+    if is_local_model(model):
+        return local_embed_texts(model, texts, dimensions)
+    all_embeddings = []
+    options = _dimension_options(dimensions)
+    for i in range(0, len(texts), batch_size):
+        batch = texts[i:i + batch_size]
+        response = client.embeddings.create(model=model, input=batch, **options)
+        for item in response.data:
+            all_embeddings.append(item.embedding)
+    return all_embeddings
+
+
+def _dimension_options(dimensions: Optional[int]) -> Dict[str, Any]:
+    return {"dimensions": int(dimensions)} if dimensions else {}
+
+
+def embed_query(
+    client: OpenAI,
+    query: str,
+    model: str = EMBEDDING_MODEL,
+    use_cache: bool = True,
+    dimensions: Optional[int] = None,
+) -> QueryEmbedding:
+    """検索クエリのembeddingを生成する（モデル名・fingerprint を持つ QueryEmbedding で返す）。
+
+    use_cache=True の場合は pdf.query_cache のディスクキャッシュを先に引き、
+    ヒットすれば API を呼ばない。キャッシュのエラーは無視して API にフォールバックする。
+    次元数ごとに別のエントリとしてキャッシュする。
+    ローカルモデルはキャッシュを引くより計算する方が速いため、キャッシュを使わない。
+    """
+    if is_local_model(model):
+        embedder = LocalEmbedder.load(model)
+        return QueryEmbedding(embedder.embed([query], dimensions)[0].tolist(), model,
+                              embedder.meta.get("fingerprint", ""))
+    cache = default_cache() if use_cache else None
+    cache_model = f"{model}@{dimensions}" if dimensions else model
+    if cache is not None:
+        try:
+            cached = cache.get(cache_model, query)
+            if cached is not None:
+                return QueryEmbedding(cached, model)
+        except (sqlite3.Error, OSError):
+            cache = None
+
+    response = client.embeddings.create(model=model, input=[query], **_dimension_options(dimensions))
+    embedding = response.data[0].embedding
+
+    if cache is not None:
+        try:
+            cache.put(cache_model, query, embedding)
+        except (sqlite3.Error, OSError):
+            pass
+    return QueryEmbedding(embedding, model)
 
 
 def cosine_similarity(a: List[float], b: List[float]) -> float:
@@ -106,21 +175,17 @@ def cosine_similarity(a: List[float], b: List[float]) -> float:
 
 def semantic_search(
     query_embedding: List[float],
-    embeddings_data: Dict[str, Any],
+    embeddings_data: Union[Dict[str, Any], EmbeddingMatrix],
     top_k: int = 5,
 ) -> List[Dict[str, Any]]:
     """embeddingのコサイン類似度でページを検索する。
 
+    embeddings_data には generate_embeddings() 形式の dict か、
+    構築済みの EmbeddingMatrix を渡せる（繰り返し検索する場合は後者を使う）。
+
     Returns:
         スコア降順の [{page, score, text_embedded}, ...]
     """
-    results = []
-    for page_entry in embeddings_data.get("pages", []):
-        score = cosine_similarity(query_embedding, page_entry["embedding"])
-        results.append({
-            "page": page_entry["page"],
-            "score": score,
-            "text_embedded": page_entry.get("text_embedded", ""),
-        })
-    results.sort(key=lambda x: x["score"], reverse=True)
-    return results[:top_k]
+    if not isinstance(embeddings_data, EmbeddingMatrix):
+        embeddings_data = EmbeddingMatrix.from_embeddings_data(embeddings_data)
+    return embeddings_data.search(query_embedding, top_k=top_k)
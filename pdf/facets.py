@@ -0,0 +1,132 @@
+"""ページのメタデータによるファセット索引（検索前の候補の絞り込み用）。
+
+ページ JSON の metadata.page_type・metadata.section_header とドキュメントごとに、
+該当するページの集合をビットマップ（ページ id のビットを立てた int）で保持する。
+検索時はフィルタ式のビットマップの論理積を取り、残ったページだけをスコアリングの対象にする。
+
+    page_type  page_type が一致（大文字小文字を区別しない）
+    section    section_header に部分一致（大文字小文字を区別しない）
+    doc        ファイル名（拡張子の有無は問わない）、root からの相対パス、またはその上位ディレクトリ
+
+同じ種類の値を複数指定すると OR、異なる種類は AND で組み合わせる。
+"""
+
+from pathlib import PurePosixPath
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+FACETS = ("page_type", "section", "doc")
+
+
+def parse_filters(page_type=None, section=None, doc=None) -> Dict[str, List[str]]:
+    """CLI・ツールの引数（文字列またはリスト、カンマ区切り可）をフィルタ式 {facet: [値, ...]} にする。"""
+    filters = {}
+    for facet, raw in zip(FACETS, (page_type, section, doc)):
+        if not raw:
+            continue
+        if isinstance(raw, str):
+            raw = [raw]
+        values = [v.strip() for item in raw for v in str(item).split(",") if v.strip()]
+        if values:
+            filters[facet] = values
+    return filters
+
+
+def filters_key(filters: Optional[Dict[str, List[str]]]) -> Tuple:
+    """検索結果キャッシュのキーに使える形にする。"""
+    return tuple(sorted((facet, tuple(values)) for facet, values in (filters or {}).items()))
+
+
+def match_document(rel: str, wanted: Iterable[str]) -> bool:
+    """root からの相対パス rel が doc フィルタのいずれかに一致するか。"""
+    path = PurePosixPath(rel)
+    for value in wanted:
+        value = value.strip("/")
+        if value in (rel, path.name, path.stem) or rel.startswith(value + "/"):
+            return True
+    return False
+
+
+def page_facets(entries: list) -> List[Tuple[Any, str, str]]:
+    """ページ JSON のエントリ列から [(page, page_type, section_header), ...] を取り出す。"""
+    facets = []
+    for entry in entries:
+        if not isinstance(entry, dict):
+            continue
+        metadata = entry.get("metadata") or {}
+        facets.append((
+            entry.get("page", "?"),
+            str(metadata.get("page_type") or "").strip().lower(),
+            str(metadata.get("section_header") or "").strip(),
+        ))
+    return facets
+
+
+def _bitmap(ids: List[int], size: int) -> int:
+    bits = np.zeros(size, dtype=bool)
+    bits[ids] = True
+    return int.from_bytes(np.packbits(bits, bitorder="little").tobytes(), "little")
+
+
+class FacetIndex:
+    """1 ルート分のファセット → ページ集合のビットマップ。"""
+
+    def __init__(self):
+        self.pages: List[Tuple[str, Any]] = []  # ページ id -> (相対パス, ページ番号)
+        self._ids: Dict[str, Dict[str, List[int]]] = {facet: {} for facet in FACETS}
+        self._bitmaps: Optional[Dict[str, Dict[str, int]]] = None
+
+    def add_document(self, rel: str, facets: List[Tuple[Any, str, str]]) -> None:
+        """ドキュメントのページを登録する（facets は page_facets() の結果）。"""
+        for page, page_type, section in facets:
+            page_id = len(self.pages)
+            self.pages.append((rel, page))
+            for facet, value in zip(FACETS, (page_type, section, rel)):
+                self._ids[facet].setdefault(value, []).append(page_id)
+        self._bitmaps = None
+
+    def bitmaps(self, facet: str) -> Dict[str, int]:
+        """{値: ビットマップ}（初回に全ファセットのビットマップを作る）。"""
+        if self._bitmaps is None:
+            size = len(self.pages)
+            self._bitmaps = {
+                name: {value: _bitmap(ids, size) for value, ids in values.items()}
+                for name, values in self._ids.items()
+            }
+        return self._bitmaps[facet]
+
+    def values(self, facet: str) -> Dict[str, int]:
+        """{値: ページ数}（フィルタに使える値の一覧表示用）。"""
+        return {value: len(ids) for value, ids in self._ids[facet].items()}
+
+    def select(self, filters: Dict[str, List[str]]) -> int:
+        """フィルタ式に一致するページのビットマップを返す。"""
+        result = (1 << len(self.pages)) - 1
+        for facet, wanted in filters.items():
+            if facet == "page_type":
+                wanted_set = {w.lower() for w in wanted}
+                match = lambda value: value in wanted_set  # noqa: E731
+            elif facet == "section":
+                wanted_lower = [w.lower() for w in wanted]
+                match = lambda value: any(w in value.lower() for w in wanted_lower)  # noqa: E731
+            else:
+                match = lambda value: match_document(value, wanted)  # noqa: E731
+            bits = 0
+            for value, bitmap in self.bitmaps(facet).items():
+                if match(value):
+                    bits |= bitmap
+            result &= bits
+        return result
+
+    def allowed(self, bitmap: int) -> Dict[str, Set[Any]]:
+        """ビットマップのページを {相対パス: {ページ番号, ...}} にする。"""
+        size = len(self.pages)
+        if size == 0 or bitmap == 0:
+            return {}
+        packed = np.frombuffer(bitmap.to_bytes((size + 7) // 8, "little"), dtype=np.uint8)
+        allowed: Dict[str, Set[Any]] = {}
+        for page_id in np.nonzero(np.unpackbits(packed, bitorder="little")[:size])[0].tolist():
+            rel, page = self.pages[page_id]
+            allowed.setdefault(rel, set()).add(page)
+        return allowed
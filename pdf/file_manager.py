@@ -4,6 +4,49 @@ import shutil
 from pathlib import Path
 from typing import List, Dict, Any
 
+# 分析結果から派生した成果物（検索対象のページ JSON ではないファイル）のサフィックス
+DERIVED_FILE_SUFFIXES = (
+    "_embeddings.json",
+    "_embeddings.npy",
+    "_embeddings.meta.json",
+    "_passages.npy",
+    "_passages.meta.json",
+)
+
+
+# コーパス全体のインデックスを置くディレクトリ（<root>/.index/）
+INDEX_DIR_NAME = ".index"
+
+
+def is_derived_file(path: Path) -> bool:
+    """embedding などの派生ファイルかどうかを判定する。"""
+    return path.name.endswith(DERIVED_FILE_SUFFIXES)
+
+
+def is_hidden_path(path: Path, base: Path) -> bool:
+    """base からの相対パスに隠しファイル・隠しディレクトリ（.index/ 等）を含むか。"""
+    try:
+        parts = path.relative_to(base).parts
+    except ValueError:
+        parts = path.parts
+    return any(part.startswith(".") for part in parts)
+
+
+def corpus_index_dir(root: Path, name: str) -> Path:
+    """コーパスインデックスの保存先ディレクトリ（<root>/.index/<name>）を返す。"""
+    return Path(root) / INDEX_DIR_NAME / name
+
+
+def find_page_json_files(directory: str) -> List[Path]:
+    """分析済みのページ JSON を再帰的に検索する（派生ファイル・隠しディレクトリは除外）。"""
+    base = Path(directory)
+    if not base.exists():
+        return []
+    return [
+        f for f in sorted(base.rglob("*.json"))
+        if f.is_file() and not is_derived_file(f) and not is_hidden_path(f, base)
+    ]
+
 def find_unanalyzed_pdfs(directory: str) -> List[Path]:
     """
     Finds PDF files in the directory that have not been analyzed yet.
@@ -57,10 +100,12 @@ def save_json(pages_data: List[Dict[str, Any]], output_path: Path) -> None:
 
 
 def save_embeddings(embeddings_data: dict, output_path: Path) -> None:
-    """埋め込みデータをJSON形式で保存する（インデントなしでファイルサイズ削減）。"""
-    output_path.parent.mkdir(parents=True, exist_ok=True)
-    with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(embeddings_data, f, ensure_ascii=False)
+    """埋め込みデータをバイナリストア（.npy + .meta.json サイドカー）として保存する。
+
+    output_path には {stem}_embeddings.npy を渡す。
+    """
+    from pdf.embedding_store import save_binary_embeddings
+    save_binary_embeddings(embeddings_data, output_path)
 
 
 def move_processed_pdf(pdf_path: Path, output_dir: Path) -> Path:
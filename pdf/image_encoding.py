@@ -0,0 +1,251 @@
+"""Vision API に送るページ画像のエンコード方針を決める。
+
+ページごとに内容の密度（インクの量・細部の量・色数・中間調）を測り、
+形式と画質、グレースケール化、解像度、分割数 (tiles) と detail を選ぶ。
+解像度は「モデルが実際に見る大きさ」と「1 ページあたりの画像トークン予算」の小さい方に合わせる。
+
+形式は、カラーの写真・網掛けが JPEG、それ以外のカラーページが WebP。
+グレースケールで送るページと色数の少ないページ（pdfplumber の描画は文字・線画がほぼ数色になる）は、
+文字の輪郭で非可逆圧縮の方が大きくなるため 16 階調のパレット PNG にする。
+
+    encoder = vision_encoder("adaptive", "gpt-4.1-mini")
+    encoded = encoder(image)   # {"images": [bytes], "mime", "detail", "tokens", "policy"}
+
+encoder はモジュール関数の partial なので、描画ワーカープロセスにもそのまま渡せる。
+"""
+
+import io
+import math
+import functools
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+from pdf.converter import encode_png
+
+ENCODING_MODES = ("adaptive", "png")
+# 1 ページあたりの画像入力トークンの目安（細部の多いページは DENSE_BUDGET_FACTOR 倍まで使う）
+DEFAULT_TOKEN_BUDGET = 1800
+DENSE_BUDGET_FACTOR = 1.5
+# 予算を守るためでも描画解像度のこの割合より小さくはしない（文字が読めなくなるため。白紙は除く）
+MIN_SCALE = 0.5
+
+# パッチ単位で課金されるモデル（32px パッチ、1 画像 1536 パッチまで）のトークン倍率
+_PATCH_MULTIPLIERS = {"gpt-4.1-mini": 1.62, "gpt-4.1-nano": 2.46, "o4-mini": 1.72}
+_PATCH = 32
+_MAX_PATCHES = 1536
+
+# 密度の判定しきい値（描画解像度 150dpi で測る。彩度だけは 512px の縮小画像で測る）
+_THUMB = 512
+_BLANK_INK = 0.002      # インクがこれ未満ならほぼ白紙
+_SPARSE_INK = 0.02      # インクがこれ未満なら大きな文字・余白の多いページ
+_DENSE_EDGES = 0.10     # 輪郭画素がこれ以上なら小さな文字・細かい図の多いページ
+_PHOTO_MIDTONE = 0.25   # 中間調がこれ以上なら写真・網掛け
+_GRAY_COLOR = 0.04      # 彩度の平均がこれ未満ならグレースケールで送る
+_PALETTE_COLORS = 32    # 色数がこれ以下ならパレット PNG
+_PNG_LEVELS = 16
+
+
+def _patch_multiplier(model: str) -> Optional[float]:
+    for prefix, multiplier in _PATCH_MULTIPLIERS.items():
+        if model.startswith(prefix):
+            return multiplier
+    return None
+
+
+def _seen_size(width: int, height: int, model: str, detail: str) -> Tuple[float, float]:
+    """モデルが実際に処理する画像サイズ（API 側の縮小後）を返す。"""
+    if _patch_multiplier(model) is not None:
+        patches = math.ceil(width / _PATCH) * math.ceil(height / _PATCH)
+        if patches <= _MAX_PATCHES:
+            return float(width), float(height)
+        scale = math.sqrt(_PATCH * _PATCH * _MAX_PATCHES / (width * height))
+        return width * scale, height * scale
+    if detail == "low":
+        scale = min(1.0, 512 / max(width, height))
+        return width * scale, height * scale
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    return width * scale, height * scale
+
+
+def estimate_image_tokens(width: int, height: int, model: str, detail: str = "high") -> int:
+    """画像 1 枚の入力トークン数の見積もり（OpenAI の公開している計算方法）。"""
+    multiplier = _patch_multiplier(model)
+    if multiplier is not None:
+        w, h = _seen_size(width, height, model, detail)
+        patches = min(_MAX_PATCHES, math.ceil(w / _PATCH) * math.ceil(h / _PATCH))
+        return math.ceil(patches * multiplier)
+    if detail == "low":
+        return 85
+    w, h = _seen_size(width, height, model, detail)
+    return 85 + 170 * math.ceil(w / 512) * math.ceil(h / 512)
+
+
+def page_features(image: Image.Image) -> Dict[str, float]:
+    """ページの密度を測る。
+
+    ink: 暗い画素（文字・線）の割合, edges: 輪郭画素の割合（細部の量）,
+    midtone: 中間調の割合（写真・網掛け）, colors: 色数（_PALETTE_COLORS を超えたら +1 で打ち切り）,
+    color: 彩度の平均 (0〜1、縮小画像で測る)。
+    """
+    gray = image.convert("L")
+    hist = gray.histogram()
+    total = sum(hist) or 1
+    edges = gray.filter(ImageFilter.FIND_EDGES).histogram()
+    colors = image.getcolors(_PALETTE_COLORS)
+    thumb = image.convert("RGB")
+    thumb.thumbnail((_THUMB, _THUMB))
+    rgb = np.asarray(thumb, dtype=np.int16)
+    return {
+        "ink": sum(hist[:160]) / total,
+        "edges": sum(edges[64:]) / total,
+        "midtone": sum(hist[64:224]) / total,
+        "colors": len(colors) if colors is not None else _PALETTE_COLORS + 1,
+        "color": float((rgb.max(axis=2) - rgb.min(axis=2)).mean()) / 255,
+    }
+
+
+def _seen_scale(width: int, height: int, model: str, detail: str) -> float:
+    """これより大きく送っても API 側で縮小される縮小率。"""
+    return min(1.0, _seen_size(width, height, model, detail)[0] / width)
+
+
+def _fit_scale(width: int, height: int, model: str, detail: str, budget: float) -> float:
+    """モデルが見る大きさを超えず、見積もりトークンが budget 以下になる最大の縮小率。"""
+    high = _seen_scale(width, height, model, detail)
+    if estimate_image_tokens(round(width * high), round(height * high), model, detail) <= budget:
+        return high
+    low = 0.0
+    for _ in range(20):
+        mid = (low + high) / 2
+        if estimate_image_tokens(max(1, round(width * mid)), max(1, round(height * mid)), model, detail) <= budget:
+            low = mid
+        else:
+            high = mid
+    return low
+
+
+def choose_policy(image: Image.Image, model: str, token_budget: int = DEFAULT_TOKEN_BUDGET,
+                  features: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
+    """ページ画像のエンコード方針を返す。
+
+    {"format", "quality", "grayscale", "scale", "tiles", "detail", "density"}
+    tiles は縦に分割する枚数（細部の多いページで分割した方が解像度を保てる場合に 2）。
+    """
+    features = features or page_features(image)
+    width, height = image.size
+    patch_model = _patch_multiplier(model) is not None
+    if features["ink"] < _BLANK_INK:
+        density = "blank"
+    elif features["edges"] >= _DENSE_EDGES:
+        density = "dense"
+    elif features["ink"] < _SPARSE_INK:
+        density = "sparse"
+    else:
+        density = "normal"
+
+    grayscale = features["color"] < _GRAY_COLOR
+    if grayscale or features["colors"] <= _PALETTE_COLORS:
+        fmt = "png"
+    elif features["midtone"] >= _PHOTO_MIDTONE:
+        fmt = "jpeg"
+    else:
+        fmt = "webp"
+    policy: Dict[str, Any] = {
+        "format": fmt,
+        "quality": {"dense": 85, "normal": 80}.get(density, 70),
+        "grayscale": grayscale,
+        "detail": "high",
+        "tiles": 1,
+        "density": density,
+    }
+    # 白紙・余白の多いページは低解像度で足りる（タイル課金のモデルは detail=low で固定 85 トークン）
+    if density in ("blank", "sparse") and not patch_model:
+        policy["detail"] = "low"
+        policy["scale"] = _fit_scale(width, height, model, "low", token_budget)
+        return policy
+
+    budget = {"dense": token_budget * DENSE_BUDGET_FACTOR, "normal": token_budget,
+              "sparse": token_budget * 0.5, "blank": 85}[density]
+    scale = _fit_scale(width, height, model, "high", budget)
+    if density == "dense" and scale < MIN_SCALE:
+        # 1 枚では文字が潰れる大きさまで縮むときは上下 2 枚に分け、1 枚あたりの縮小を緩くする
+        half = _fit_scale(width, -(-height // 2), model, "high", budget / 2)
+        if half > scale * 1.2:
+            policy["tiles"], scale = 2, half
+    if density != "blank":
+        scale = max(scale, min(MIN_SCALE, _seen_scale(width, height, model, "high")))
+    policy["scale"] = scale
+    return policy
+
+
+def _tiles(image: Image.Image, tiles: int) -> List[Image.Image]:
+    if tiles <= 1:
+        return [image]
+    width, height = image.size
+    # 境目の行が欠けないよう、分割した画像どうしを少し重ねる
+    overlap = height // 40
+    step = -(-height // tiles)
+    return [image.crop((0, max(0, i * step - overlap), width, min(height, (i + 1) * step + overlap)))
+            for i in range(tiles)]
+
+
+def encode_with_policy(image: Image.Image, policy: Dict[str, Any], model: str) -> Dict[str, Any]:
+    """方針どおりに画像をエンコードする。"""
+    if policy["grayscale"]:
+        image = image.convert("L")
+    elif image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    fmt = policy["format"].upper()
+    encoded: List[bytes] = []
+    tokens = 0
+    for tile in _tiles(image, policy["tiles"]):
+        width = max(1, round(tile.width * policy["scale"]))
+        height = max(1, round(tile.height * policy["scale"]))
+        if (width, height) != tile.size:
+            # パレット PNG は色数を増やさない BOX で縮小する（LANCZOS だと中間色が増えて大きくなる）
+            tile = tile.resize((width, height), Image.BOX if fmt == "PNG" else Image.LANCZOS)
+        buffer = io.BytesIO()
+        if fmt == "PNG":
+            tile.quantize(_PNG_LEVELS).save(buffer, format="PNG", optimize=True)
+        elif fmt == "JPEG":
+            tile.save(buffer, format="JPEG", quality=policy["quality"], optimize=True)
+        else:
+            tile.save(buffer, format="WEBP", quality=policy["quality"], method=4)
+        encoded.append(buffer.getvalue())
+        tokens += estimate_image_tokens(width, height, model, policy["detail"])
+    return {
+        "images": encoded,
+        "mime": f"image/{policy['format']}",
+        "detail": policy["detail"],
+        "tokens": tokens,
+        "policy": policy,
+    }
+
+
+def encode_adaptive(image: Image.Image, model: str, token_budget: int = DEFAULT_TOKEN_BUDGET) -> Dict[str, Any]:
+    """ページの密度とトークン予算に合わせて画像をエンコードする。"""
+    return encode_with_policy(image, choose_policy(image, model, token_budget), model)
+
+
+def encode_png_page(image: Image.Image, model: str, token_budget: int = DEFAULT_TOKEN_BUDGET) -> Dict[str, Any]:
+    """従来どおり描画解像度の PNG をそのまま送る（比較の基準）。"""
+    return {
+        "images": [encode_png(image)],
+        "mime": "image/png",
+        "detail": "high",
+        "tokens": estimate_image_tokens(image.width, image.height, model, "high"),
+        "policy": {"format": "png"},
+    }
+
+
+def vision_encoder(mode: str = "adaptive", model: str = "gpt-4.1-mini",
+                   token_budget: Optional[int] = None) -> Callable[[Image.Image], Dict[str, Any]]:
+    """ページ画像 -> エンコード結果の関数を返す（pickle できるので描画ワーカーに渡せる）。"""
+    if mode not in ENCODING_MODES:
+        raise ValueError(f"Unknown image encoding: {mode} (expected one of {', '.join(ENCODING_MODES)})")
+    encode = encode_png_page if mode == "png" else encode_adaptive
+    return functools.partial(encode, model=model, token_budget=token_budget or DEFAULT_TOKEN_BUDGET)
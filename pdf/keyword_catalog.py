@@ -0,0 +1,356 @@
+"""keywords コマンド用のキーワードカタログ（ページごとの抽出結果と文書頻度）。
+
+ページのサマリーから extract_keywords() で抽出した語と metadata.keywords の和集合を
+ページごとに保存し、全体の語彙をキーワードごとの出現ページ数・ファイル数とともに保持する。
+keywords はファイルを読み直さずにこれを返し、出現ページ数の多い順に上位だけを返せる。
+
+    <root>/.index/catalog/index.sqlite
+        meta      形式・バージョン
+        files     対象ファイル (相対パス, mtime_ns, size, 種別)
+                  種別は pages（ページ JSON）/ text（md・csv・txt の先頭 1000 文字）/ NULL（対象外の JSON）
+        keywords  ページごとのキーワード（JSON 配列）
+        terms     キーワードごとの出現ページ数・ファイル数（ファイルの更新時に差分で更新）
+
+ファイルは (mtime_ns, size) で変更を検出し、変更されたファイルだけ抽出し直す。
+"""
+
+import re
+import json
+import sqlite3
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from pdf.file_manager import corpus_index_dir
+
+CATALOG_FORMAT = "ucf-keyword-catalog"
+CATALOG_VERSION = 1
+
+# md / csv / txt はファイル先頭のこの文字数だけからキーワードを抽出する
+TEXT_HEAD_CHARS = 1000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    kind TEXT
+);
+CREATE TABLE IF NOT EXISTS keywords (
+    path TEXT NOT NULL,
+    ord INTEGER NOT NULL,
+    page,
+    keywords TEXT NOT NULL,
+    PRIMARY KEY (path, ord)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS terms (
+    keyword TEXT PRIMARY KEY,
+    pages INTEGER NOT NULL,
+    files INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS terms_pages ON terms(pages DESC, files DESC);
+"""
+
+_KANJI_RE = re.compile(r'[\u4e00-\u9fff]{2,8}')
+_KATAKANA_RE = re.compile(r'[\u30a0-\u30ffー]{2,}')
+_O_PREFIX_RE = re.compile(r'お[\u3040-\u309f\u4e00-\u9fff]{2,6}')
+_PARTICLE_TAIL_RE = re.compile(r'[のがはをにでともやへ]+$')
+_PHRASE_SPLIT_RE = re.compile(r'[。、．，「」（）【】\n・]')
+_HAS_KANJI_KANA_RE = re.compile(r'[\u4e00-\u9fff\u30a0-\u30ff]')
+_DEMONSTRATIVE_RE = re.compile(r'^(この|その|あの|それ|これ|あれ)')
+
+# 汎用すぎる語・文末表現
+_STOPWORDS = {
+    'されて', 'しています', 'ています', 'について', 'において',
+    'における', 'として', 'ために', 'それぞれ', 'これら',
+    'そのため', 'できます', 'ありません', 'ください', 'おります',
+    'このページ', 'されています', 'また', 'および', 'さらに',
+    'ただし', 'なお', 'ほか', 'ことが', 'ものが',
+    '説明', '記載', '案内', 'ページ',
+}
+
+
+def extract_keywords(text: str) -> List[str]:
+    """テキストから検索用キーワードを抽出する。
+
+    形態素解析器なしで動作するため、以下のパターンで抽出する:
+    1. 漢字熟語（2〜8文字の漢字連続）
+    2. カタカナ語（2文字以上）
+    3. 「お〜」で始まる和語（例: お手入れ）
+    4. 句読点区切りの短いフレーズ
+    """
+    if not text:
+        return []
+
+    keywords = set()
+
+    # 1. 漢字の連続（2〜8文字）— 日本語の技術用語の大半をカバー
+    keywords.update(_KANJI_RE.findall(text))
+
+    # 2. カタカナの連続（2文字以上、長音記号を含む）
+    keywords.update(_KATAKANA_RE.findall(text))
+
+    # 3. 「お」+ひらがな/漢字 パターン（例: お手入れ、おそうじ）
+    for m in _O_PREFIX_RE.findall(text):
+        kw = _PARTICLE_TAIL_RE.sub('', m)
+        if len(kw) >= 3:
+            keywords.add(kw)
+
+    # 4. 句読点・括弧で区切った短いフレーズ（漢字+かな混在の複合語を拾う）
+    for phrase in _PHRASE_SPLIT_RE.split(text):
+        phrase = phrase.strip()
+        # 短すぎる・長すぎるフレーズは除外
+        if 3 <= len(phrase) <= 12:
+            # ひらがなだけのフレーズは除外
+            if not _HAS_KANJI_KANA_RE.search(phrase):
+                continue
+            # 「この〜」「その〜」で始まるフレーズは除外
+            if _DEMONSTRATIVE_RE.match(phrase):
+                continue
+            keywords.add(phrase)
+
+    keywords -= _STOPWORDS
+
+    return sorted(kw for kw in keywords if 2 <= len(kw) <= 12)
+
+
+def file_keywords(path: Path) -> Tuple[Optional[str], List[Tuple[Any, List[str]]]]:
+    """ファイルから (種別, [(page, キーワード), ...]) を抽出する。
+
+    ページ JSON はページごとに summary の抽出結果と metadata.keywords の和集合、
+    md / csv / txt は先頭 TEXT_HEAD_CHARS 文字の抽出結果を 1 行（page は None）にする。
+    読めないファイルやページ配列でない JSON は (None, [])。
+    """
+    path = Path(path)
+    if path.suffix.lower() == ".json":
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None, []
+        if not isinstance(data, list):
+            return None, []
+        rows = []
+        for entry in data:
+            if not isinstance(entry, dict):
+                continue
+            meta_kws = (entry.get("metadata") or {}).get("keywords", []) or []
+            kws = extract_keywords(entry.get("summary", ""))
+            rows.append((entry.get("page", "?"), sorted(set(kws) | set(meta_kws))))
+        return "pages", rows
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            head = f.read(TEXT_HEAD_CHARS)
+    except (OSError, ValueError):
+        return None, []
+    return "text", [(None, extract_keywords(head))]
+
+
+def rank_terms(documents: Iterable[List[List[str]]]) -> List[Tuple[str, int, int]]:
+    """ドキュメントごとのページのキーワード列から [(キーワード, 出現ページ数, 出現ファイル数)] を作る。
+
+    出現ページ数・ファイル数の多い順（同数はキーワード順）。
+    """
+    pages: Counter = Counter()
+    files: Counter = Counter()
+    for page_keywords in documents:
+        seen = set()
+        for kws in page_keywords:
+            pages.update(set(kws))
+            seen.update(kws)
+        files.update(seen)
+    return sorted(((kw, n, files[kw]) for kw, n in pages.items()),
+                  key=lambda t: (-t[1], -t[2], t[0]))
+
+
+def _term_counts(rows: List[Tuple[Any, List[str]]]) -> Counter:
+    counts: Counter = Counter()
+    for _, kws in rows:
+        counts.update(set(kws))
+    return counts
+
+
+class KeywordCatalog:
+    """<root>/.index/catalog/index.sqlite の読み書きを行う。"""
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.index_dir = corpus_index_dir(self.root, "catalog")
+        self.path = self.index_dir / "index.sqlite"
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.index_dir.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), timeout=30.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            has_meta = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'meta'"
+            ).fetchone() is not None
+            version = dict(conn.execute("SELECT key, value FROM meta").fetchall()) if has_meta else {}
+            if version.get("format") != CATALOG_FORMAT or version.get("version") != str(CATALOG_VERSION):
+                # 形式が変わった場合は作り直す（次の sync で再登録）
+                conn.execute("BEGIN IMMEDIATE")
+                for table in ("terms", "keywords", "files", "meta"):
+                    conn.execute(f"DROP TABLE IF EXISTS {table}")
+                for statement in _SCHEMA.split(";"):
+                    if statement.strip():
+                        conn.execute(statement)
+                conn.executemany("INSERT INTO meta(key, value) VALUES(?, ?)", [
+                    ("format", CATALOG_FORMAT),
+                    ("version", str(CATALOG_VERSION)),
+                ])
+                conn.execute("COMMIT")
+            self._conn = conn
+        return self._conn
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _rel_path(self, path: Path) -> str:
+        return Path(path).relative_to(self.root).as_posix()
+
+    # ── 書き込み ─────────────────────────────────
+
+    def _stored_rows(self, rel: str) -> List[Tuple[Any, List[str]]]:
+        return [
+            (page, json.loads(kws)) for page, kws in self._connect().execute(
+                "SELECT page, keywords FROM keywords WHERE path = ? ORDER BY ord", (rel,))
+        ]
+
+    def _apply_counts(self, counts: Counter, sign: int) -> None:
+        """terms の出現ページ数・ファイル数に 1 ファイル分を加算（sign=-1 で減算）する。"""
+        if not counts:
+            return
+        self._connect().executemany(
+            "INSERT INTO terms(keyword, pages, files) VALUES(?, ?, ?) "
+            "ON CONFLICT(keyword) DO UPDATE SET pages = pages + excluded.pages, files = files + excluded.files",
+            ((kw, sign * n, sign) for kw, n in counts.items()),
+        )
+
+    def _replace(self, rel: str, stamp: Optional[Tuple[int, int]], kind: Optional[str],
+                 rows: List[Tuple[Any, List[str]]]) -> None:
+        """rel の登録内容を置き換える（stamp が None なら削除）。"""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._apply_counts(_term_counts(self._stored_rows(rel)), -1)
+            conn.execute("DELETE FROM keywords WHERE path = ?", (rel,))
+            if stamp is None:
+                conn.execute("DELETE FROM files WHERE path = ?", (rel,))
+            else:
+                conn.execute(
+                    "INSERT OR REPLACE INTO files(path, mtime_ns, size, kind) VALUES(?, ?, ?, ?)",
+                    (rel, stamp[0], stamp[1], kind),
+                )
+                conn.executemany(
+                    "INSERT INTO keywords(path, ord, page, keywords) VALUES(?, ?, ?, ?)",
+                    ((rel, i, page, json.dumps(kws, ensure_ascii=False)) for i, (page, kws) in enumerate(rows)),
+                )
+                self._apply_counts(_term_counts(rows), 1)
+            conn.execute("DELETE FROM terms WHERE pages <= 0")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def update_file(self, path: Path, stamp: Optional[Tuple[int, int]] = None) -> bool:
+        """1 ファイルのキーワードを抽出し直す。変更がなければ何もしない。"""
+        path = Path(path)
+        rel = self._rel_path(path)
+        if stamp is None:
+            st = path.stat()
+            stamp = (st.st_mtime_ns, st.st_size)
+        row = self._connect().execute("SELECT mtime_ns, size FROM files WHERE path = ?", (rel,)).fetchone()
+        if row is not None and tuple(row) == tuple(stamp):
+            return False
+        kind, rows = file_keywords(path)
+        self._replace(rel, stamp, kind, rows)
+        return True
+
+    def remove_file(self, rel: str) -> bool:
+        if self._connect().execute("SELECT 1 FROM files WHERE path = ?", (rel,)).fetchone() is None:
+            return False
+        self._replace(rel, None, None, [])
+        return True
+
+    def sync(self, files: Optional[List[Path]] = None) -> Dict[str, int]:
+        """ディスク上のファイル\u4e00覧と同期する（変更・追加・削除されたものだけ処理）。
+
+        files を省略した場合は root 以下を走査する（PDF 分析・移行時に使う）。
+        """
+        if files is None:
+            from pdf.page_index import find_indexed_files
+            files = find_indexed_files(self.root)
+        conn = self._connect()
+        indexed = {
+            path: (mtime_ns, size)
+            for path, mtime_ns, size in conn.execute("SELECT path, mtime_ns, size FROM files")
+        }
+        stats = {"updated": 0, "removed": 0}
+        seen = set()
+        for f in files:
+            rel = self._rel_path(f)
+            seen.add(rel)
+            st = f.stat()
+            stamp = (st.st_mtime_ns, st.st_size)
+            if indexed.get(rel) != stamp and self.update_file(f, stamp):
+                stats["updated"] += 1
+        for rel in indexed.keys() - seen:
+            if self.remove_file(rel):
+                stats["removed"] += 1
+        return stats
+
+    # ── 読み込み ─────────────────────────────────
+
+    def documents(self) -> Dict[str, Optional[str]]:
+        """{相対パス: 種別}"""
+        return dict(self._connect().execute("SELECT path, kind FROM files"))
+
+    def page_keywords(self, rel: str) -> List[Tuple[Any, List[str]]]:
+        """[(page, キーワード), ...]（登録順）"""
+        return self._stored_rows(rel)
+
+    def top_terms(self, n: Optional[int] = None,
+                  paths: Optional[Iterable[str]] = None) -> List[Tuple[str, int, int]]:
+        """[(キーワード, 出現ページ数, 出現ファイル数)] を多い順に n 件返す。
+
+        paths を指定した場合はそのファイルだけで数え直す。
+        """
+        if paths is not None:
+            ranked = rank_terms([kws for _, kws in self._stored_rows(rel)] for rel in paths)
+            return ranked if n is None else ranked[:n]
+        sql = "SELECT keyword, pages, files FROM terms ORDER BY pages DESC, files DESC, keyword"
+        if n is not None:
+            return self._connect().execute(sql + " LIMIT ?", (int(n),)).fetchall()
+        return self._connect().execute(sql).fetchall()
+
+    def term_count(self) -> int:
+        return self._connect().execute("SELECT COUNT(*) FROM terms").fetchone()[0]
+
+    def stats(self) -> Dict[str, int]:
+        conn = self._connect()
+        return {
+            "files": conn.execute("SELECT COUNT(*) FROM files WHERE kind IS NOT NULL").fetchone()[0],
+            "pages": conn.execute("SELECT COUNT(*) FROM keywords").fetchone()[0],
+            "terms": self.term_count(),
+        }
+
+
+def update_keyword_catalog(root: Path, json_path: Path) -> bool:
+    """1 ドキュメント分をキーワードカタログに登録する（PDF 分析完了時に呼ぶ）。"""
+    catalog = KeywordCatalog(root)
+    try:
+        return catalog.update_file(json_path)
+    finally:
+        catalog.close()
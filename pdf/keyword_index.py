@@ -0,0 +1,488 @@
+"""ページ JSON の転置インデックスと BM25F ランキング（キーワード検索用）。
+
+全ページの summary / content / metadata を小文字化し、空白を含まない
+文字 bigram ごとのポスティング（フィールドごとの出現回数付き）を SQLite に保存する。
+検索語の bigram のポスティングを積集合して候補ページを絞り、候補ページだけを
+部分一致で検証するため、ページ数が増えても全文走査をしない。
+
+スコアは BM25F で、検索語を bigram の集まりとして扱い、ポスティング上の
+フィールド別出現回数・文書頻度 (df)・フィールド長・平均フィールド長から計算する。
+これらの統計はインデックス更新時に事前計算して保存しておく。
+
+    <root>/.index/keywords/index.sqlite
+        meta      形式・バージョン、ページ数とフィールド長の合計
+        docs      ドキュメント (相対パス, mtime_ns, size)
+        pages     ページごとの summary / content / metadata テキストとフィールド長
+        terms     bigram ごとの文書頻度 (df)
+        postings  (bigram, page_id) -> フィールドごとの出現回数
+
+ドキュメントは (mtime_ns, size) で変更を検出し、変わったものだけを入れ替える。
+"""
+
+import re
+import json
+import math
+import sqlite3
+from collections import Counter
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Iterable, Set, Tuple
+
+from pdf.file_manager import corpus_index_dir
+
+KEYWORD_INDEX_FORMAT = "ucf-keyword-index"
+KEYWORD_INDEX_VERSION = 2
+
+FIELDS = ("summary", "content", "meta")
+
+# BM25F のパラメータ（フィールド重みと長さ正規化の強さ）
+FIELD_WEIGHTS = {"summary": 2.0, "content": 1.0, "meta": 1.5}
+FIELD_B = {"summary": 0.5, "content": 0.75, "meta": 0.3}
+BM25_K1 = 1.2
+
+_SQL_CHUNK = 500
+_WS_RE = re.compile(r"\s+")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS docs (
+    doc_id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pages (
+    page_id INTEGER PRIMARY KEY,
+    doc_id INTEGER NOT NULL,
+    ord INTEGER NOT NULL,
+    page,
+    summary TEXT NOT NULL,
+    content TEXT NOT NULL,
+    meta TEXT NOT NULL,
+    len_summary INTEGER NOT NULL,
+    len_content INTEGER NOT NULL,
+    len_meta INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pages_doc ON pages(doc_id);
+CREATE TABLE IF NOT EXISTS terms (
+    token TEXT PRIMARY KEY,
+    df INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS postings (
+    token TEXT NOT NULL,
+    page_id INTEGER NOT NULL,
+    tf_summary INTEGER NOT NULL,
+    tf_content INTEGER NOT NULL,
+    tf_meta INTEGER NOT NULL,
+    PRIMARY KEY (token, page_id)
+) WITHOUT ROWID;
+"""
+
+_STAT_KEYS = ("pages",) + tuple(f"len_{field}" for field in FIELDS)
+
+
+def _chunk_bigrams(text: str) -> Iterable[str]:
+    for chunk in _WS_RE.split(text.lower()):
+        for i in range(len(chunk) - 1):
+            yield chunk[i:i + 2]
+
+
+def text_bigrams(text: str) -> Set[str]:
+    """小文字化したテキストから、空白を含まない文字 bigram の集合を返す。"""
+    return set(_chunk_bigrams(text))
+
+
+def page_fields(entry: Dict[str, Any]) -> Tuple[str, str, str]:
+    """ページ JSON のエントリから (summary, content, metadata テキスト) を取り出す。"""
+    metadata = entry.get("metadata", {}) or {}
+    meta_text = " ".join(metadata.get("keywords", []) + metadata.get("topics", []))
+    return entry.get("summary", "") or "", entry.get("content", "") or "", meta_text
+
+
+def _page_postings(summary: str, content: str, meta: str) -> Tuple[Dict[str, List[int]], List[int]]:
+    """ページの {bigram: [summary, content, meta の出現回数]} とフィールド長 (bigram 数) を返す。"""
+    postings: Dict[str, List[int]] = {}
+    lengths = []
+    for i, text in enumerate((summary, content, meta)):
+        counts = Counter(_chunk_bigrams(text))
+        lengths.append(sum(counts.values()))
+        for gram, tf in counts.items():
+            tfs = postings.get(gram)
+            if tfs is None:
+                tfs = postings[gram] = [0, 0, 0]
+            tfs[i] = tf
+    return postings, lengths
+
+
+def _chunks(items: list, size: int = _SQL_CHUNK) -> Iterable[list]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def bm25_idf(df: int, pages: int) -> float:
+    return math.log(1.0 + (pages - df + 0.5) / (df + 0.5))
+
+
+class KeywordIndex:
+    """<root>/.index/keywords/index.sqlite の読み書きを行う。
+
+    サブクラスで INDEX_NAME と _page_rows を差し替えると、ページ以外の単位
+    （pdf.passages のパッセージなど）を同じ形式で索引できる。
+    """
+
+    INDEX_NAME = "keywords"
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.index_dir = corpus_index_dir(self.root, self.INDEX_NAME)
+        self.path = self.index_dir / "index.sqlite"
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.index_dir.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), timeout=30.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA cache_size=-65536")
+            version = dict(conn.execute(
+                "SELECT key, value FROM meta" if _has_table(conn, "meta") else "SELECT 1, 1 WHERE 0"
+            ).fetchall())
+            if version.get("format") != KEYWORD_INDEX_FORMAT or version.get("version") != str(KEYWORD_INDEX_VERSION):
+                # 形式が変わった場合は作り直す（次の sync で全ドキュメントを再登録）
+                conn.execute("BEGIN IMMEDIATE")
+                for table in ("postings", "terms", "pages", "docs", "meta"):
+                    conn.execute(f"DROP TABLE IF EXISTS {table}")
+                for statement in _SCHEMA.split(";"):
+                    if statement.strip():
+                        conn.execute(statement)
+                conn.executemany("INSERT INTO meta(key, value) VALUES(?, ?)", [
+                    ("format", KEYWORD_INDEX_FORMAT),
+                    ("version", str(KEYWORD_INDEX_VERSION)),
+                ] + [(key, "0") for key in _STAT_KEYS])
+                conn.execute("COMMIT")
+            self._conn = conn
+        return self._conn
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _rel_path(self, json_path: Path) -> str:
+        return Path(json_path).relative_to(self.root).as_posix()
+
+    def _page_rows(self, entries: list) -> Iterable[Tuple[int, Any, str, str, str]]:
+        """ページ JSON のエントリ列から (ord, page, summary, content, meta) を列挙する。"""
+        for ord_, entry in enumerate(entries):
+            if isinstance(entry, dict):
+                yield (ord_, entry.get("page", "?")) + page_fields(entry)
+
+    def _bump_stats(self, conn: sqlite3.Connection, sign: int, pages: int, lengths: List[int]) -> None:
+        for key, amount in zip(_STAT_KEYS, [pages] + list(lengths)):
+            conn.execute(
+                "UPDATE meta SET value = CAST(CAST(value AS INTEGER) + ? AS TEXT) WHERE key = ?",
+                (sign * amount, key),
+            )
+
+    # ── 書き込み ─────────────────────────────────
+
+    def _delete_doc(self, conn: sqlite3.Connection, doc_id: int) -> None:
+        """ドキュメントのページ・ポスティング・統計を削除する（ポスティングは保存済みテキストから再計算）。"""
+        df = Counter()
+        lengths = [0, 0, 0]
+        pages = conn.execute(
+            "SELECT page_id, summary, content, meta FROM pages WHERE doc_id = ?", (doc_id,)
+        ).fetchall()
+        for page_id, summary, content, meta in pages:
+            postings, page_lengths = _page_postings(summary, content, meta)
+            df.update(postings.keys())
+            lengths = [a + b for a, b in zip(lengths, page_lengths)]
+            conn.executemany(
+                "DELETE FROM postings WHERE token = ? AND page_id = ?",
+                ((t, page_id) for t in postings),
+            )
+        conn.executemany("UPDATE terms SET df = df - ? WHERE token = ?",
+                         ((n, t) for t, n in df.items()))
+        conn.execute("DELETE FROM terms WHERE df <= 0")
+        self._bump_stats(conn, -1, len(pages), lengths)
+        conn.execute("DELETE FROM pages WHERE doc_id = ?", (doc_id,))
+        conn.execute("DELETE FROM docs WHERE doc_id = ?", (doc_id,))
+
+    def update_document(self, json_path: Path, stamp: Optional[Tuple[int, int]] = None) -> bool:
+        """1 ドキュメントを登録し直す。変更がなければ何もしない。登録した場合 True。"""
+        json_path = Path(json_path)
+        rel = self._rel_path(json_path)
+        if stamp is None:
+            st = json_path.stat()
+            stamp = (st.st_mtime_ns, st.st_size)
+        try:
+            with open(json_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception:
+            data = None
+        entries = data if isinstance(data, list) else []
+
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT doc_id, mtime_ns, size FROM docs WHERE path = ?", (rel,)).fetchone()
+            if row is not None and (row[1], row[2]) == tuple(stamp):
+                conn.execute("COMMIT")
+                return False
+            if row is not None:
+                self._delete_doc(conn, row[0])
+            doc_id = conn.execute(
+                "INSERT INTO docs(path, mtime_ns, size) VALUES(?, ?, ?)", (rel, stamp[0], stamp[1])
+            ).lastrowid
+            rows = []
+            df = Counter()
+            lengths = [0, 0, 0]
+            pages = 0
+            for ord_, page, summary, content, meta in self._page_rows(entries):
+                postings, page_lengths = _page_postings(summary, content, meta)
+                page_id = conn.execute(
+                    "INSERT INTO pages(doc_id, ord, page, summary, content, meta, "
+                    "len_summary, len_content, len_meta) VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (doc_id, ord_, page, summary, content, meta, *page_lengths),
+                ).lastrowid
+                rows.extend((token, page_id, *tfs) for token, tfs in postings.items())
+                df.update(postings.keys())
+                lengths = [a + b for a, b in zip(lengths, page_lengths)]
+                pages += 1
+            # B-tree のキー順に挿入する（ランダム順より大幅に速い）
+            rows.sort()
+            conn.executemany("INSERT INTO postings(token, page_id, tf_summary, tf_content, tf_meta) "
+                             "VALUES(?, ?, ?, ?, ?)", rows)
+            conn.executemany(
+                "INSERT INTO terms(token, df) VALUES(?, ?) "
+                "ON CONFLICT(token) DO UPDATE SET df = df + excluded.df",
+                sorted(df.items()),
+            )
+            self._bump_stats(conn, 1, pages, lengths)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return True
+
+    def remove_document(self, rel: str) -> bool:
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT doc_id FROM docs WHERE path = ?", (rel,)).fetchone()
+            if row is not None:
+                self._delete_doc(conn, row[0])
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return row is not None
+
+    def sync(self, json_files: List[Path]) -> Dict[str, int]:
+        """ディスク上のページ JSON 一覧と同期する（変更・追加・削除されたものだけ処理）。"""
+        conn = self._connect()
+        indexed = {
+            path: (mtime_ns, size)
+            for path, mtime_ns, size in conn.execute("SELECT path, mtime_ns, size FROM docs")
+        }
+        stats = {"updated": 0, "removed": 0}
+        seen = set()
+        for f in json_files:
+            rel = self._rel_path(f)
+            seen.add(rel)
+            st = f.stat()
+            stamp = (st.st_mtime_ns, st.st_size)
+            if indexed.get(rel) != stamp and self.update_document(f, stamp):
+                stats["updated"] += 1
+        for rel in indexed.keys() - seen:
+            if self.remove_document(rel):
+                stats["removed"] += 1
+        return stats
+
+    # ── 読み込み ─────────────────────────────────
+
+    def _stat_totals(self) -> Dict[str, int]:
+        conn = self._connect()
+        values = {key: int(value) for key, value in conn.execute(
+            f"SELECT key, value FROM meta WHERE key IN ({','.join('?' * len(_STAT_KEYS))})", _STAT_KEYS
+        )}
+        return {key: values.get(key, 0) for key in _STAT_KEYS}
+
+    def corpus_stats(self) -> Dict[str, float]:
+        """ページ数と各フィールドの平均長（bigram 数）。"""
+        return _average_stats(self._stat_totals())
+
+    def query_stats(self, terms: List[str]) -> Dict[str, Any]:
+        """検索語の bigram の文書頻度とページ数・フィールド長の合計を返す。
+
+        複数ルートの横断検索では各ルートの値を merge_query_stats で合算し、
+        search(terms, corpus=...) に渡して全ルート共通の統計でスコアを付ける。
+        """
+        grams = set().union(*(text_bigrams(term) for term in terms)) if terms else set()
+        stats: Dict[str, Any] = dict(self._stat_totals())
+        stats["df"] = self._document_frequencies(grams)
+        return stats
+
+    def _postings(self, gram: str) -> Dict[int, Tuple[int, int, int]]:
+        conn = self._connect()
+        return {
+            page_id: (tf_s, tf_c, tf_m)
+            for page_id, tf_s, tf_c, tf_m in conn.execute(
+                "SELECT page_id, tf_summary, tf_content, tf_meta FROM postings WHERE token = ?", (gram,)
+            )
+        }
+
+    def _document_frequencies(self, grams: Iterable[str]) -> Dict[str, int]:
+        conn = self._connect()
+        grams = list(grams)
+        df = {}
+        for chunk in _chunks(grams):
+            df.update(conn.execute(
+                f"SELECT token, df FROM terms WHERE token IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall())
+        return {g: df.get(g, 0) for g in grams}
+
+    def search(self, terms: List[str], corpus: Optional[Dict[str, Any]] = None,
+               include: Optional[Dict[str, Set[Any]]] = None) -> List[Dict[str, Any]]:
+        """全検索語（小文字）を summary + content に含むページを BM25F スコア付きで返す。
+
+        corpus に merge_query_stats の結果を渡すと、文書頻度・平均フィールド長は
+        このインデックスではなく corpus の値を使う（候補の絞り込みはこのインデックスで行う）。
+        include に {相対パス: {ページ番号, ...}} を渡すと、それ以外のページは検証・スコア計算の前に除く。
+
+        Returns:
+            [{path (root からの相対パス), ord, page, summary, content, meta, score}, ...]
+        """
+        conn = self._connect()
+        term_grams = {term: text_bigrams(term) for term in terms}
+        all_grams = set().union(*term_grams.values()) if term_grams else set()
+        df = self._document_frequencies(all_grams)
+        if any(n == 0 for n in df.values()):
+            return []
+
+        # ポスティングの短い bigram から順に積集合を取り、候補ページを絞る
+        postings: Dict[str, Dict[int, Tuple[int, int, int]]] = {}
+        candidates: Optional[Set[int]] = None
+        for gram in sorted(all_grams, key=lambda g: df[g]):
+            postings[gram] = self._postings(gram)
+            ids = {pid for pid, (tf_s, tf_c, _) in postings[gram].items() if tf_s or tf_c}
+            candidates = ids if candidates is None else candidates & ids
+            if not candidates:
+                return []
+
+        query = (
+            "SELECT p.page_id, d.path, p.ord, p.page, p.summary, p.content, p.meta, "
+            "p.len_summary, p.len_content, p.len_meta "
+            "FROM pages p JOIN docs d ON d.doc_id = p.doc_id"
+        )
+        if candidates is None:
+            # 2 文字以上の検索語がなく絞り込めない場合は全ページを検証する
+            rows = conn.execute(query).fetchall()
+        else:
+            rows = []
+            for chunk in _chunks(sorted(candidates)):
+                rows.extend(conn.execute(
+                    f"{query} WHERE p.page_id IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall())
+
+        if include is not None:
+            rows = [row for row in rows if row[3] in include.get(row[1], ())]
+
+        hits = []
+        for page_id, path, ord_, page, summary, content, meta, *lengths in rows:
+            text = summary.lower() + " " + content.lower()
+            if all(term in text for term in terms):
+                hits.append({
+                    "page_id": page_id, "path": path, "ord": ord_, "page": page,
+                    "summary": summary, "content": content, "meta": meta, "lengths": lengths,
+                })
+
+        if corpus is not None:
+            stats = _average_stats(corpus)
+            df = {g: max(corpus["df"].get(g, 0), n) for g, n in df.items()}
+        else:
+            stats = self.corpus_stats()
+        for hit in hits:
+            hit["score"] = self._bm25f(hit, term_grams, postings, df, stats, len(hits))
+            del hit["page_id"], hit["lengths"]
+        return hits
+
+    @staticmethod
+    def _bm25f(hit: Dict[str, Any], term_grams: Dict[str, Set[str]],
+               postings: Dict[str, Dict[int, Tuple[int, int, int]]],
+               df: Dict[str, int], stats: Dict[str, float], matched: int) -> float:
+        """BM25F スコアを、同じクエリで取りうる最大値で割って 0〜1 に正規化する。
+
+        検索語は bigram の集まりとして扱う（希少な bigram ほど idf で重く効く）。1 文字の検索語は bigram を持たないため、
+        フィールド本文の出現回数と一致ページ数を df の代わりに使う。
+        """
+        norms = []
+        for field, length in zip(FIELDS, hit["lengths"]):
+            avg = stats[f"avg_{field}"] or 1.0
+            b = FIELD_B[field]
+            norms.append(FIELD_WEIGHTS[field] / (1.0 - b + b * length / avg))
+        pages = max(int(stats["pages"]), 1)
+
+        score = max_score = 0.0
+        for term, grams in term_grams.items():
+            if grams:
+                weighted = [(bm25_idf(df[g], pages), postings[g].get(hit["page_id"], (0, 0, 0)))
+                            for g in grams]
+            else:
+                texts = (hit["summary"], hit["content"], hit["meta"])
+                weighted = [(bm25_idf(matched, pages), tuple(t.lower().count(term) for t in texts))]
+            for idf, tfs in weighted:
+                tf = sum(n * w for n, w in zip(tfs, norms))
+                score += idf * tf * (BM25_K1 + 1.0) / (BM25_K1 + tf)
+                max_score += idf * (BM25_K1 + 1.0)
+        return score / max_score if max_score > 0 else 0.0
+
+    def stats(self) -> Dict[str, int]:
+        conn = self._connect()
+        return {
+            "documents": conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0],
+            "pages": conn.execute("SELECT COUNT(*) FROM pages").fetchone()[0],
+            "terms": conn.execute("SELECT COUNT(*) FROM terms").fetchone()[0],
+            "postings": conn.execute("SELECT COUNT(*) FROM postings").fetchone()[0],
+        }
+
+
+def _has_table(conn: sqlite3.Connection, name: str) -> bool:
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+    ).fetchone() is not None
+
+
+def _average_stats(totals: Dict[str, int]) -> Dict[str, float]:
+    pages = totals.get("pages", 0)
+    stats: Dict[str, float] = {"pages": pages}
+    for field in FIELDS:
+        stats[f"avg_{field}"] = totals.get(f"len_{field}", 0) / pages if pages else 0.0
+    return stats
+
+
+def merge_query_stats(stats_list: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """複数インデックスの query_stats を合算する。"""
+    merged: Dict[str, Any] = {key: 0 for key in _STAT_KEYS}
+    df: Counter = Counter()
+    for stats in stats_list:
+        for key in _STAT_KEYS:
+            merged[key] += stats.get(key, 0)
+        df.update(stats.get("df", {}))
+    merged["df"] = dict(df)
+    return merged
+
+
+def update_keyword_index(root: Path, json_path: Path) -> bool:
+    """1 ドキュメント分をキーワードインデックスに登録する（PDF 分析完了時に呼ぶ）。"""
+    index = KeywordIndex(root)
+    try:
+        return index.update_document(json_path)
+    finally:
+        index.close()
@@ -0,0 +1,317 @@
+"""ネットワーク不要のローカル embedding（embedding_model: "local:<name>"）。
+
+文字 n-gram（1〜3 文字）をハッシュで N_BUCKETS 個のバケットに落とした TF-IDF ベクトルを、
+コーパスから求めた切り詰め SVD（潜在意味解析）の射影で dims 次元に縮める。
+学習・推論とも NumPy だけで行い、クエリ 1 件の embedding は 1 ミリ秒未満で求まる。
+
+    .ucf_desktop/models/local/<name>.npz
+        buckets     学習コーパスに出現したバケット番号（昇順）
+        idf         各バケットの idf
+        projection  (バケット数 x dims) の射影行列（特異値の大きい順）
+        meta        {format, version, n_buckets, dims, documents, fingerprint} の JSON
+
+射影の列は特異値の大きい順に並ぶため、embedding_dimensions で先頭 d 次元に
+切り詰めても使える。モデルを作り直すと既存の embedding とは比較できなくなるため、
+`python -m pdf.migration --build-local-model` は学習後に全ドキュメントの embedding を作り直す。
+embedding ストアのサイドカーとコーパスインデックスには fingerprint を記録し、
+別のモデルで作ったクエリ・ドキュメントは検索時・インデックス登録時に拒否する。
+UCF_LOCAL_MODEL_DIR で保存先を変更できる。
+"""
+
+import os
+import sys
+import json
+import zlib
+import hashlib
+import threading
+import unicodedata
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+LOCAL_PREFIX = "local:"
+MODEL_FORMAT = "ucf-local-embedding"
+MODEL_VERSION = 1
+
+N_BUCKETS = 1 << 16
+NGRAM_SIZES = (1, 2, 3)
+DEFAULT_DIMS = 256
+
+_PROJECT_DIR = Path(__file__).resolve().parent.parent
+DEFAULT_MODEL_DIR = _PROJECT_DIR / ".ucf_desktop" / "models" / "local"
+_ENV_DIR = "UCF_LOCAL_MODEL_DIR"
+
+# 学習時に密行列へ展開する行ブロックの要素数の上限（float32 で 64MB）
+_DENSE_BLOCK = 1 << 24
+
+_lock = threading.Lock()
+# {モデルファイルの絶対パス: ((mtime_ns, size), LocalEmbedder)}
+_models: Dict[str, Tuple[Tuple[int, int], "LocalEmbedder"]] = {}
+
+
+def _log(msg: str):
+    sys.stderr.write(msg + "\n")
+    sys.stderr.flush()
+
+
+def is_local_model(model: Optional[str]) -> bool:
+    return bool(model) and model.startswith(LOCAL_PREFIX)
+
+
+def local_model_path(model: str) -> Path:
+    """embedding_model（local:<name>）に対応するモデルファイルのパス。"""
+    name = model[len(LOCAL_PREFIX):] if is_local_model(model) else model
+    name = "".join(c if c.isalnum() or c in "-_." else "_" for c in name) or "default"
+    return Path(os.environ.get(_ENV_DIR) or DEFAULT_MODEL_DIR) / f"{name}.npz"
+
+
+def _ngram_buckets(text: str) -> np.ndarray:
+    """NFKC 正規化・小文字化したテキストの文字 n-gram をバケット番号の配列にする（重複あり）。"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    buckets = []
+    for chunk in text.split():
+        for n in NGRAM_SIZES:
+            for i in range(len(chunk) - n + 1):
+                buckets.append(zlib.crc32(chunk[i:i + n].encode("utf-8")) & (N_BUCKETS - 1))
+    return np.asarray(buckets, dtype=np.int64)
+
+
+def _term_weights(buckets: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """(バケット番号, 1 + log(tf)) を返す。"""
+    ids, counts = np.unique(buckets, return_counts=True)
+    return ids, 1.0 + np.log(counts.astype(np.float32))
+
+
+class LocalEmbedder:
+    """ハッシュ化文字 n-gram TF-IDF + SVD 射影による embedding。"""
+
+    def __init__(self, buckets: np.ndarray, idf: np.ndarray, projection: np.ndarray, meta: dict):
+        self.buckets = np.asarray(buckets, dtype=np.int64)
+        self.idf = np.asarray(idf, dtype=np.float32)
+        self.projection = np.ascontiguousarray(projection, dtype=np.float32)
+        self.meta = meta
+        # バケット番号 -> 射影行列の行番号（学習コーパスにないバケットは -1）
+        self._rows = np.full(meta.get("n_buckets", N_BUCKETS), -1, dtype=np.int64)
+        self._rows[self.buckets] = np.arange(len(self.buckets))
+
+    @property
+    def dimensions(self) -> int:
+        return int(self.projection.shape[1])
+
+    def embed(self, texts: Iterable[str], dimensions: Optional[int] = None) -> np.ndarray:
+        """テキスト列を正規化済みの (件数 x 次元数) 行列にする（dimensions で先頭 d 次元に切り詰め）。"""
+        dims = min(int(dimensions), self.dimensions) if dimensions else self.dimensions
+        projection = self.projection[:, :dims]
+        texts = list(texts)
+        out = np.zeros((len(texts), dims), dtype=np.float32)
+        for i, text in enumerate(texts):
+            ids, tf = _term_weights(_ngram_buckets(text))
+            rows = self._rows[ids]
+            known = rows >= 0
+            if not known.any():
+                continue
+            rows = rows[known]
+            weights = tf[known] * self.idf[rows]
+            vector = (weights / np.linalg.norm(weights)) @ projection[rows]
+            norm = np.linalg.norm(vector)
+            if norm > 0:
+                out[i] = vector / norm
+        return out
+
+    def save(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "wb") as f:
+            np.savez(f, buckets=self.buckets, idf=self.idf, projection=self.projection,
+                     meta=np.array(json.dumps(self.meta)))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, model: str) -> "LocalEmbedder":
+        """モデルファイルを読み込む（ファイルが変わらなければプロセス内で使い回す）。"""
+        path = local_model_path(model)
+        try:
+            st = path.stat()
+        except OSError:
+            raise FileNotFoundError(
+                f"ローカル embedding モデルがありません: {path} "
+                f"(uv run python -m pdf.migration --dir database --build-local-model で作成)"
+            ) from None
+        stamp = (st.st_mtime_ns, st.st_size)
+        key = str(path)
+        with _lock:
+            hit = _models.get(key)
+            if hit is not None and hit[0] == stamp:
+                return hit[1]
+            with np.load(path, allow_pickle=False) as data:
+                meta = json.loads(str(data["meta"]))
+                if meta.get("format") != MODEL_FORMAT:
+                    raise ValueError(f"ローカル embedding モデルの形式が不正です: {path}")
+                embedder = cls(data["buckets"], data["idf"], data["projection"], meta)
+            _models[key] = (stamp, embedder)
+            return embedder
+
+
+# ── 学習 ─────────────────────────────────────
+
+class _TfidfRows:
+    """学習コーパスの TF-IDF 行列（行正規化済み）を CSR 形式で保持し、行ブロックごとに密行列にする。"""
+
+    def __init__(self, texts: List[str]):
+        docs = [_term_weights(_ngram_buckets(t)) for t in texts]
+        docs = [(ids, tf) for ids, tf in docs if len(ids)]
+        all_ids = np.concatenate([ids for ids, _ in docs]) if docs else np.zeros(0, dtype=np.int64)
+        self.buckets, columns = np.unique(all_ids, return_inverse=True)
+        df = np.bincount(columns, minlength=len(self.buckets))
+        n = len(docs)
+        self.idf = (np.log((1.0 + n) / (1.0 + df)) + 1.0).astype(np.float32)
+
+        self.indptr = np.zeros(n + 1, dtype=np.int64)
+        self.indptr[1:] = np.cumsum([len(ids) for ids, _ in docs])
+        self.indices = columns
+        self.data = np.concatenate([tf for _, tf in docs]).astype(np.float32) if docs else \
+            np.zeros(0, dtype=np.float32)
+        self.data *= self.idf[self.indices]
+        for i in range(n):
+            lo, hi = self.indptr[i], self.indptr[i + 1]
+            self.data[lo:hi] /= np.linalg.norm(self.data[lo:hi])
+        self.shape = (n, len(self.buckets))
+
+    def blocks(self) -> Iterable[Tuple[int, int, np.ndarray]]:
+        rows, cols = self.shape
+        step = max(1, _DENSE_BLOCK // max(cols, 1))
+        for start in range(0, rows, step):
+            end = min(rows, start + step)
+            lo, hi = self.indptr[start], self.indptr[end]
+            dense = np.zeros((end - start, cols), dtype=np.float32)
+            row_ids = np.repeat(np.arange(end - start), np.diff(self.indptr[start:end + 1]))
+            dense[row_ids, self.indices[lo:hi]] = self.data[lo:hi]
+            yield start, end, dense
+
+    def matmul(self, m: np.ndarray) -> np.ndarray:
+        """X @ m"""
+        out = np.zeros((self.shape[0], m.shape[1]), dtype=np.float32)
+        for start, end, dense in self.blocks():
+            out[start:end] = dense @ m
+        return out
+
+    def rmatmul(self, m: np.ndarray) -> np.ndarray:
+        """X.T @ m"""
+        out = np.zeros((self.shape[1], m.shape[1]), dtype=np.float32)
+        for start, end, dense in self.blocks():
+            out += dense.T @ m[start:end]
+        return out
+
+
+def fit_local_model(texts: List[str], dims: int = DEFAULT_DIMS, oversample: int = 10,
+                    power_iters: int = 3, seed: int = 0) -> LocalEmbedder:
+    """テキスト列から TF-IDF を求め、乱択 SVD で dims 次元の射影を学習する。
+
+    次元数は学習テキスト数・出現バケット数を超えられない（小さいコーパスでは dims より小さくなる）。
+    """
+    x = _TfidfRows(texts)
+    n_docs, n_cols = x.shape
+    k = min(dims, n_docs, n_cols)
+    if k == 0:
+        raise ValueError("ローカル embedding モデルの学習テキストがありません")
+    width = min(k + oversample, n_docs, n_cols)
+    rng = np.random.default_rng(seed)
+    y = x.matmul(rng.standard_normal((n_cols, width)).astype(np.float32))
+    for _ in range(power_iters):
+        y, _ = np.linalg.qr(y)
+        z, _ = np.linalg.qr(x.rmatmul(y))
+        y = x.matmul(z)
+    q, _ = np.linalg.qr(y)
+    # B = Q^T X の右特異ベクトルが X の右特異ベクトルの近似になる
+    _, singular, vt = np.linalg.svd(x.rmatmul(q).T, full_matrices=False)
+    projection = vt[:k].T.astype(np.float32)
+
+    meta = {
+        "format": MODEL_FORMAT,
+        "version": MODEL_VERSION,
+        "n_buckets": N_BUCKETS,
+        "ngram": list(NGRAM_SIZES),
+        "dims": int(k),
+        "documents": int(n_docs),
+        "singular_values": [round(float(s), 6) for s in singular[:k]],
+        "fingerprint": hashlib.sha256(projection.tobytes()).hexdigest()[:16],
+    }
+    return LocalEmbedder(x.buckets, x.idf, projection, meta)
+
+
+def corpus_texts(json_files: Iterable[Path]) -> List[str]:
+    """学習コーパス: 各ページの embedding 用テキスト（要約 + メタデータ）と本文のパッセージ。"""
+    from pdf.embeddings import _build_embedding_text
+    from pdf.passages import page_passages
+
+    texts = []
+    for json_path in json_files:
+        try:
+            with open(json_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        entries = [e for e in data if isinstance(e, dict)] if isinstance(data, list) else []
+        texts.extend(t for t in (_build_embedding_text(e) for e in entries) if t)
+        texts.extend(text for _, _, text in page_passages(entries))
+    return texts
+
+
+def build_local_model(model: str, json_files: Iterable[Path], dims: Optional[int] = None) -> LocalEmbedder:
+    """コーパスからモデルを学習して保存する。"""
+    texts = corpus_texts(json_files)
+    embedder = fit_local_model(texts, dims or DEFAULT_DIMS)
+    path = local_model_path(model)
+    embedder.save(path)
+    _log(f"Local embedding model saved: {path} ({embedder.meta['documents']} texts, "
+         f"{len(embedder.buckets)} n-gram buckets, {embedder.dimensions} dims)")
+    return embedder
+
+
+def model_fingerprint(model: str) -> str:
+    """ローカルモデルの fingerprint（射影行列のハッシュ）。API のモデルは空文字。"""
+    if not is_local_model(model):
+        return ""
+    return LocalEmbedder.load(model).meta.get("fingerprint", "")
+
+
+def _stores_using_model(model: str, json_files: List[Path]) -> List[Path]:
+    """model で作った embedding ストア（ページ・パッセージ）のサイドカーを返す。"""
+    from pdf.embedding_store import binary_embeddings_paths, load_store_meta
+    from pdf.passages import passage_embeddings_path
+
+    found = []
+    for json_path in json_files:
+        for meta_path in (binary_embeddings_paths(json_path)[1],
+                          passage_embeddings_path(json_path).with_suffix(".meta.json")):
+            meta = load_store_meta(meta_path)
+            if meta is not None and meta.get("model") == model:
+                found.append(meta_path)
+    return found
+
+
+def ensure_local_model(model: str, root: Path, dims: Optional[int] = None) -> bool:
+    """モデルがなければ root 以下のページ JSON から学習する。学習した場合 True。
+
+    このモデルで作った embedding が既にある場合は学習しない（RuntimeError）。
+    作り直したモデルの射影は既存の embedding と比較できないため、
+    --build-local-model で全ドキュメントの embedding と一緒に作り直す必要がある。
+    """
+    if local_model_path(model).exists():
+        return False
+    from pdf.file_manager import find_page_json_files
+    json_files = find_page_json_files(root)
+    existing = _stores_using_model(model, json_files)
+    if existing:
+        raise RuntimeError(
+            f"ローカル embedding モデルがありませんが、{model} の embedding が {len(existing)} 件あります"
+            f" (例: {existing[0]})。uv run python -m pdf.migration --dir {root} --build-local-model で"
+            f"モデルと embedding をまとめて作り直してください"
+        )
+    build_local_model(model, json_files, dims)
+    return True
+
+
+def local_embed_texts(model: str, texts: List[str], dimensions: Optional[int] = None) -> List[List[float]]:
+    return LocalEmbedder.load(model).embed(texts, dimensions).tolist()
@@ -10,8 +10,32 @@ Usage:
     # メタデータのみ
     uv run python -m pdf.migration --dir database --metadata-only
 
-    # embeddingのみ
+    # embeddingのみ（ページとパッセージ）
     uv run python -m pdf.migration --dir database --embeddings-only
+
+    # パッセージ（ページ本文の重なりのあるチャンク）の embedding のみ
+    uv run python -m pdf.migration --dir database --passages-only
+
+    # 既存の *_embeddings.json をバイナリストア (.npy + .meta.json) に変換（API 不要）
+    uv run python -m pdf.migration --dir database --to-binary [--remove-json]
+
+    # コーパスインデックス (database/.index/vectors/) の再構築（API 不要）
+    uv run python -m pdf.migration --dir database --build-index [--compact]
+
+    # 近似最近傍 (IVF) インデックスの構築と recall 評価（API 不要）
+    uv run python -m pdf.migration --dir database --build-ann [--nlist 64] [--nprobe 8]
+
+    # embedding の量子化インデックス (int8 / 直積量子化) の構築（API 不要）
+    uv run python -m pdf.migration --dir database --quantize int8
+    uv run python -m pdf.migration --dir database --quantize pq [--pq-subspaces 96]
+
+    # 既存の embedding を先頭 256 次元に切り詰めて再正規化（Matryoshka、API 不要）
+    # 検索クエリと合わせるため config.json の embedding_dimensions も 256 にしておく
+    uv run python -m pdf.migration --dir database --truncate-dims 256
+
+    # ローカル embedding モデル (embedding_model: "local:<name>") をコーパスから学習し、
+    # 全ドキュメントのページ・パッセージ embedding を作り直す（API 不要）
+    uv run python -m pdf.migration --dir database --build-local-model [--embedding-model local:default]
 """
 
 import json
@@ -70,14 +94,16 @@ def migrate_metadata(json_path: Path, client: OpenAI, model: str = "gpt-4.1-mini
         sys.stderr.write(f"  Updated {json_path}\n")
 
 
-def migrate_embeddings(json_path: Path, client: OpenAI, embedding_model: str = "text-embedding-3-small"):
-    """既存JSONからembeddingを生成する。"""
+def migrate_embeddings(json_path: Path, client: OpenAI, embedding_model: str = "text-embedding-3-small",
+                       dimensions: int = None, force: bool = False):
+    """既存JSONからembeddingを生成する（force なら既存の embedding も作り直す）。"""
     from pdf.embeddings import generate_embeddings
+    from pdf.embedding_store import has_embeddings, binary_embeddings_paths
     from pdf.file_manager import save_embeddings
 
-    emb_path = json_path.parent / f"{json_path.stem}_embeddings.json"
-    if emb_path.exists():
-        sys.stderr.write(f"  Embeddings already exist: {emb_path}\n")
+    emb_path, _ = binary_embeddings_paths(json_path)
+    if has_embeddings(json_path) and not force:
+        sys.stderr.write(f"  Embeddings already exist for: {json_path}\n")
         return
 
     with open(json_path, "r", encoding="utf-8") as f:
@@ -90,13 +116,252 @@ def migrate_embeddings(json_path: Path, client: OpenAI, embedding_model: str = "
     sys.stderr.flush()
 
     try:
-        embeddings_data = generate_embeddings(client, data, model=embedding_model)
+        embeddings_data = generate_embeddings(client, data, model=embedding_model, dimensions=dimensions)
         save_embeddings(embeddings_data, emb_path)
         sys.stderr.write(f"  Saved: {emb_path}\n")
     except Exception as e:
         sys.stderr.write(f"  Error generating embeddings: {e}\n")
 
 
+def migrate_passages(json_path: Path, client: OpenAI, embedding_model: str = "text-embedding-3-small",
+                     dimensions: int = None, force: bool = False) -> bool:
+    """ページ本文をパッセージに分割し、パッセージごとの embedding を生成する（古い・ない場合のみ）。
+
+    生成した場合 True を返す。
+    """
+    from pdf.passages import update_passage_embeddings
+
+    try:
+        count = update_passage_embeddings(client, json_path, embedding_model, dimensions, force=force)
+    except Exception as e:
+        sys.stderr.write(f"  Error generating passage embeddings: {e}\n")
+        return False
+    if count is None:
+        sys.stderr.write(f"  Passage embeddings are up to date for: {json_path}\n")
+        return False
+    sys.stderr.write(f"  Saved {count} passage embeddings\n")
+    return True
+
+
+def migrate_to_binary(json_path: Path, remove_json: bool = False):
+    """既存の *_embeddings.json をバイナリストアに変換する（API 呼び出し不要）。"""
+    from pdf.embedding_store import json_embeddings_path, load_binary_meta, convert_json_to_binary
+
+    emb_json = json_embeddings_path(json_path)
+    if not emb_json.exists():
+        return
+    if load_binary_meta(json_path) is not None:
+        sys.stderr.write(f"  Binary embeddings already exist for: {json_path}\n")
+        if remove_json:
+            emb_json.unlink()
+            sys.stderr.write(f"  Removed: {emb_json}\n")
+        return
+
+    try:
+        before = emb_json.stat().st_size
+        npy_path = convert_json_to_binary(emb_json, remove_json=remove_json)
+        after = npy_path.stat().st_size + npy_path.with_suffix(".meta.json").stat().st_size
+        sys.stderr.write(f"  Converted: {emb_json.name} ({before:,} bytes) -> {npy_path.name} ({after:,} bytes)\n")
+    except Exception as e:
+        sys.stderr.write(f"  Error converting embeddings: {e}\n")
+
+
+def migrate_truncate(json_path: Path, dimensions: int):
+    """格納済みの embedding を dimensions 次元に切り詰める（API 呼び出し不要）。"""
+    from pdf.embedding_store import truncate_embeddings
+
+    try:
+        result = truncate_embeddings(json_path, dimensions)
+    except Exception as e:
+        sys.stderr.write(f"  Error truncating embeddings: {e}\n")
+        return
+    if result is None:
+        sys.stderr.write(f"  Skipped (no embeddings or already <= {dimensions} dims): {json_path.name}\n")
+    else:
+        sys.stderr.write(f"  Truncated: {json_path.name} ({result[0]} -> {result[1]} dims)\n")
+
+    # パッセージ embedding も同じ次元に揃える
+    from pdf.embedding_store import truncate_store
+    from pdf.passages import passage_embeddings_path
+    try:
+        result = truncate_store(passage_embeddings_path(json_path), dimensions)
+    except Exception as e:
+        sys.stderr.write(f"  Error truncating passage embeddings: {e}\n")
+        return
+    if result is not None:
+        sys.stderr.write(f"  Truncated passages: {json_path.name} ({result[0]} -> {result[1]} dims)\n")
+
+
+def sync_corpus_index(base: Path, json_files: list, compact: bool = False, rebuild: bool = False):
+    """コーパスインデックスをディスク上の embedding と同期する。
+
+    rebuild=True なら作り直す（モデル・次元数の異なる embedding は通常の同期ではスキップされる）。
+    """
+    from pdf.corpus_index import CorpusIndex
+
+    index = CorpusIndex(base)
+    stats = index.sync(json_files, rebuild=rebuild)
+    changed = bool(stats["added"] or stats["removed"])
+    if compact and index.tombstoned_rows():
+        index.compact()
+    sys.stderr.write(
+        f"\nCorpus index: +{stats['added']} document(s) ({stats['rows']} rows), "
+        f"-{stats['removed']} removed, {index.rows} rows total\n"
+    )
+
+    # ANN・量子化インデックスがあれば増分更新する
+    # 失敗しても任意のインデックスなので、残りの同期は続ける
+    from pdf.ann_index import update_ann_index
+    try:
+        status = update_ann_index(base)
+    except Exception as e:
+        sys.stderr.write(f"Error updating ANN index: {e}\n")
+    else:
+        if status:
+            sys.stderr.write(f"ANN index: {status}\n")
+
+    from pdf.quantization import update_quantized_index
+    try:
+        status = update_quantized_index(base)
+    except Exception as e:
+        sys.stderr.write(f"Error updating quantized index: {e}\n")
+    else:
+        if status:
+            sys.stderr.write(f"Quantized index: {status}\n")
+
+    # キーワード検索用の転置インデックスも変更分だけ更新する
+    from pdf.keyword_index import KeywordIndex
+    keyword_index = KeywordIndex(base)
+    try:
+        kw_stats = keyword_index.sync(json_files)
+        totals = keyword_index.stats()
+    finally:
+        keyword_index.close()
+    sys.stderr.write(
+        f"Keyword index: {kw_stats['updated']} updated, {kw_stats['removed']} removed, "
+        f"{totals['pages']} pages / {totals['postings']} postings\n"
+    )
+
+    # パッセージ単位の転置インデックス（search_json.py passages 用）
+    from pdf.passages import PassageIndex
+    passage_index = PassageIndex(base)
+    try:
+        ps_stats = passage_index.sync(json_files)
+        totals = passage_index.stats()
+    finally:
+        passage_index.close()
+    sys.stderr.write(
+        f"Passage index: {ps_stats['updated']} updated, {ps_stats['removed']} removed, "
+        f"{totals['pages']} passages / {totals['postings']} postings\n"
+    )
+
+    # get_page / summaries 用のページオフセット索引とファイル名対応表（ツリー全体）
+    from pdf.page_index import PageIndex
+    page_index = PageIndex(base)
+    try:
+        pg_stats = page_index.sync()
+        totals = page_index.stats()
+    finally:
+        page_index.close()
+    sys.stderr.write(
+        f"Page index: {pg_stats['updated']} updated, {pg_stats['removed']} removed, "
+        f"{totals['files']} files / {totals['pages']} pages\n"
+    )
+
+    # keywords 用のキーワードカタログ（ツリー全体）
+    from pdf.keyword_catalog import KeywordCatalog
+    catalog = KeywordCatalog(base)
+    try:
+        kc_stats = catalog.sync()
+        totals = catalog.stats()
+    finally:
+        catalog.close()
+    sys.stderr.write(
+        f"Keyword catalog: {kc_stats['updated']} updated, {kc_stats['removed']} removed, "
+        f"{totals['pages']} pages / {totals['terms']} terms\n"
+    )
+
+    # ドキュメントに変更があれば検索結果キャッシュを無効化する
+    changed = changed or any(kw_stats.values()) or any(ps_stats.values()) or any(pg_stats.values())
+    if changed:
+        from pdf.result_cache import bump_corpus_generation
+        sys.stderr.write(f"Corpus generation: {bump_corpus_generation(base)}\n")
+
+
+def build_ann_index(base: Path, json_files: list, nlist: int = None, nprobe: int = None):
+    """コーパスインデックスから IVF インデックスを構築し、recall を評価する。"""
+    from pdf.ann_index import IVFIndex, DEFAULT_NPROBE, evaluate_recall
+
+    sync_corpus_index(base, json_files)
+    from pdf.corpus_index import CorpusIndex
+    corpus = CorpusIndex(base)
+    if corpus.rows == 0:
+        sys.stderr.write("Corpus index is empty; generate embeddings first.\n")
+        return
+
+    ann = IVFIndex(corpus)
+    meta = ann.build(nlist=nlist)
+    # --index ann の検索結果が変わるためキャッシュを無効化する
+    from pdf.result_cache import bump_corpus_generation
+    bump_corpus_generation(base)
+    nprobe = nprobe or DEFAULT_NPROBE
+    result = evaluate_recall(ann, top_k=10, nprobe=nprobe)
+    sys.stderr.write(
+        f"ANN index built: nlist={meta['nlist']}, rows={meta['indexed_rows']}\n"
+        f"  recall@10 vs exact (nprobe={nprobe}, {result['queries']} queries): {result['recall']:.3f}, "
+        f"scanned {result['scan_ratio'] * 100:.1f}% of rows\n"
+    )
+
+
+def build_quantized_index(base: Path, json_files: list, method: str, subspaces: int = None):
+    """コーパスインデックスから量子化インデックスを構築する。"""
+    from pdf.corpus_index import CorpusIndex
+    from pdf.quantization import QuantizedIndex
+
+    sync_corpus_index(base, json_files)
+    corpus = CorpusIndex(base)
+    if corpus.rows == 0:
+        sys.stderr.write("Corpus index is empty; generate embeddings first.\n")
+        return
+
+    meta = QuantizedIndex(corpus).build(method, subspaces)
+    # --index quantized の検索結果が変わるためキャッシュを無効化する
+    from pdf.result_cache import bump_corpus_generation
+    bump_corpus_generation(base)
+    ratio = meta["float32_bytes"] / max(1, meta["code_bytes"])
+    sys.stderr.write(
+        f"Quantized index built ({method}): {meta['indexed_rows']} rows, "
+        f"{meta['float32_bytes']:,} -> {meta['code_bytes']:,} bytes ({ratio:.1f}x smaller)\n"
+        f"  recall: uv run python -m benchmarks.bench_quantization --dir {base}\n"
+    )
+
+
+def build_local_embeddings(base: Path, json_files: list, embedding_model: str, dimensions: int = None,
+                           configured_model: str = None):
+    """ローカル embedding モデルを学習し、全ドキュメントの embedding を作り直して索引を同期する。
+
+    モデルを学習し直すと射影が変わり既存の embedding と比較できなくなるため、常に全件を作り直す。
+    """
+    from pdf.local_embeddings import LOCAL_PREFIX, is_local_model, build_local_model
+    from pdf.result_cache import bump_corpus_generation
+
+    if not is_local_model(embedding_model):
+        embedding_model = LOCAL_PREFIX + "default"
+    build_local_model(embedding_model, json_files, dimensions)
+    for jf in json_files:
+        sys.stderr.write(f"\nProcessing {jf}...\n")
+        migrate_embeddings(jf, None, embedding_model=embedding_model, dimensions=dimensions, force=True)
+        migrate_passages(jf, None, embedding_model=embedding_model, dimensions=dimensions, force=True)
+    sync_corpus_index(base, json_files, rebuild=True)
+    bump_corpus_generation(base)
+    if configured_model != embedding_model:
+        sys.stderr.write(
+            f"\nNote: set \"embedding_model\": \"{embedding_model}\" in .ucf_desktop/config.json "
+            f"so that new documents and queries use the local model.\n"
+        )
+    sys.stderr.write("\nMigration complete.\n")
+
+
 def main():
     parser = argparse.ArgumentParser(description="既存JSONのマイグレーション")
     parser.add_argument("--dir", default="database",
@@ -105,26 +370,54 @@ def main():
                         help="メタデータ追加のみ実行")
     parser.add_argument("--embeddings-only", action="store_true",
                         help="embedding生成のみ実行")
+    parser.add_argument("--passages-only", action="store_true",
+                        help="パッセージ（ページ本文のチャンク）の embedding 生成のみ実行")
+    parser.add_argument("--to-binary", action="store_true",
+                        help="既存の *_embeddings.json をバイナリストアに変換のみ実行")
+    parser.add_argument("--remove-json", action="store_true",
+                        help="--to-binary で変換後に元の *_embeddings.json を削除する")
+    parser.add_argument("--build-index", action="store_true",
+                        help="コーパスインデックスを作り直す（embedding のモデル・次元数を変えた後など）")
+    parser.add_argument("--compact", action="store_true",
+                        help="--build-index で tombstone 行を詰め直す")
+    parser.add_argument("--build-ann", action="store_true",
+                        help="近似最近傍 (IVF) インデックスを構築して recall を評価する")
+    parser.add_argument("--nlist", type=int, default=None,
+                        help="--build-ann のクラスタ数 (default: √ページ数)")
+    parser.add_argument("--nprobe", type=int, default=None,
+                        help="--build-ann の recall 評価で探索するクラスタ数 (default: 8)")
+    parser.add_argument("--quantize", choices=["int8", "pq"], default=None,
+                        help="embedding の量子化インデックスを構築する")
+    parser.add_argument("--pq-subspaces", type=int, default=None,
+                        help="--quantize pq の部分空間数 (default: 次元数/16)")
     parser.add_argument("--model", default="gpt-4.1-mini",
                         help="メタデータ抽出用モデル (default: gpt-4.1-mini)")
     parser.add_argument("--embedding-model", default=None,
                         help="embeddingモデル (default: config.json の embedding_model)")
+    parser.add_argument("--embedding-dimensions", type=int, default=None,
+                        help="生成する embedding の次元数 (default: config.json の embedding_dimensions)")
+    parser.add_argument("--truncate-dims", type=int, default=None,
+                        help="既存の embedding を指定次元に切り詰めて再正規化する (API 不要)")
+    parser.add_argument("--build-local-model", action="store_true",
+                        help="ローカル embedding モデルを学習し、全 embedding を作り直す (API 不要)")
     args = parser.parse_args()
 
-    # embedding_model: CLI引数 > config.json > デフォルト
+    # embedding_model / embedding_dimensions: CLI引数 > config.json > デフォルト
+    config_path = Path(__file__).resolve().parent.parent / ".ucf_desktop" / "config.json"
+    try:
+        with open(config_path, "r", encoding="utf-8") as f:
+            cfg = json.load(f)
+    except Exception:
+        cfg = {}
     if args.embedding_model is None:
-        config_path = Path(__file__).resolve().parent.parent / ".ucf_desktop" / "config.json"
-        try:
-            with open(config_path, "r", encoding="utf-8") as f:
-                cfg = json.load(f)
-            args.embedding_model = cfg.get("embedding_model", "text-embedding-3-small")
-        except Exception:
-            args.embedding_model = "text-embedding-3-small"
+        args.embedding_model = cfg.get("embedding_model", "text-embedding-3-small")
+    if args.embedding_dimensions is None:
+        args.embedding_dimensions = cfg.get("embedding_dimensions") or None
+
+    from pdf.file_manager import find_page_json_files
 
-    client = OpenAI()
     base = Path(args.dir)
-    json_files = sorted(base.rglob("*.json"))
-    json_files = [f for f in json_files if not f.name.endswith("_embeddings.json")]
+    json_files = find_page_json_files(args.dir)
 
     if not json_files:
         sys.stderr.write(f"No JSON files found in {base}\n")
@@ -132,13 +425,66 @@ def main():
 
     sys.stderr.write(f"Found {len(json_files)} JSON file(s) to migrate.\n")
 
+    if args.truncate_dims:
+        for jf in json_files:
+            migrate_truncate(jf, args.truncate_dims)
+        sync_corpus_index(base, json_files, rebuild=True)
+        if cfg.get("embedding_dimensions") != args.truncate_dims:
+            sys.stderr.write(
+                f"\nNote: set \"embedding_dimensions\": {args.truncate_dims} in .ucf_desktop/config.json "
+                f"so that new documents and queries use the same dimensions.\n"
+            )
+        sys.stderr.write("\nMigration complete.\n")
+        return
+
+    if args.build_local_model:
+        build_local_embeddings(base, json_files, args.embedding_model, args.embedding_dimensions,
+                               cfg.get("embedding_model"))
+        return
+
+    if args.quantize:
+        build_quantized_index(base, json_files, args.quantize, args.pq_subspaces)
+        return
+
+    if args.build_ann:
+        build_ann_index(base, json_files, nlist=args.nlist, nprobe=args.nprobe)
+        return
+
+    if args.build_index:
+        sync_corpus_index(base, json_files, compact=args.compact, rebuild=True)
+        return
+
+    if args.to_binary:
+        for jf in json_files:
+            sys.stderr.write(f"\nProcessing {jf}...\n")
+            migrate_to_binary(jf, remove_json=args.remove_json)
+        sync_corpus_index(base, json_files)
+        sys.stderr.write("\nMigration complete.\n")
+        return
+
+    # ローカル embedding モデルで embedding だけを生成する場合は API キーが不要
+    from pdf.local_embeddings import is_local_model
+    embeddings_only = args.embeddings_only or args.passages_only
+    client = None if embeddings_only and is_local_model(args.embedding_model) else OpenAI()
+    passages_changed = False
     for jf in json_files:
         sys.stderr.write(f"\nProcessing {jf}...\n")
-        if not args.embeddings_only:
-            migrate_metadata(jf, client, args.model)
+        if not args.passages_only:
+            if not args.embeddings_only:
+                migrate_metadata(jf, client, args.model)
+            if not args.metadata_only:
+                migrate_embeddings(jf, client, embedding_model=args.embedding_model,
+                                   dimensions=args.embedding_dimensions)
         if not args.metadata_only:
-            migrate_embeddings(jf, client, embedding_model=args.embedding_model)
-
+            passages_changed |= migrate_passages(jf, client, embedding_model=args.embedding_model,
+                                                 dimensions=args.embedding_dimensions)
+
+    # メタデータのみの場合もキーワード・ページ索引と世代番号を更新する
+    sync_corpus_index(base, json_files)
+    if passages_changed:
+        # パッセージ embedding は索引の同期では検出しないため、ここで検索結果キャッシュを無効化する
+        from pdf.result_cache import bump_corpus_generation
+        bump_corpus_generation(base)
     sys.stderr.write("\nMigration complete.\n")
 
 
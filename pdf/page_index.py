@@ -0,0 +1,358 @@
+"""ページ JSON のバイトオフセット索引とファイル名 -> パスの対応表。
+
+get_page / summaries はページ配列全体を json.load せず、索引のオフセットへ
+seek して 1 ページ分（またはサマリー文字列だけ）を読んで解析する。
+ファイル名の解決も索引を引くだけで、ディレクトリツリーを走査しない。
+
+    <root>/.index/pages/index.sqlite
+        meta   形式・バージョン
+        files  検索対象ファイル (相対パス, ファイル名, mtime_ns, size, ページ数)
+        pages  ページごとのエントリと summary 値のバイト範囲 [start, end)
+
+オフセットは JSON を latin-1 として走査して求める（UTF-8 の多バイト文字は
+0x80 以上のバイトだけで構成され、JSON の構文文字と衝突しないため、
+文字位置がそのままバイト位置になる）。
+ファイルは (mtime_ns, size) で変更を検出し、古くなった索引は読み出し時に作り直す。
+"""
+
+import re
+import json
+import sqlite3
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Tuple
+
+from pdf.file_manager import corpus_index_dir, is_derived_file, is_hidden_path
+
+PAGE_INDEX_FORMAT = "ucf-page-index"
+PAGE_INDEX_VERSION = 1
+
+# ファイル名の対応表に載せる拡張子（search_json.py の検索対象と同じ）
+INDEXED_EXTENSIONS = {".json", ".md", ".csv", ".txt"}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    pages INTEGER
+);
+CREATE INDEX IF NOT EXISTS files_name ON files(name);
+CREATE TABLE IF NOT EXISTS pages (
+    path TEXT NOT NULL,
+    ord INTEGER NOT NULL,
+    page,
+    start INTEGER NOT NULL,
+    end INTEGER NOT NULL,
+    summary_start INTEGER,
+    summary_end INTEGER,
+    PRIMARY KEY (path, ord)
+) WITHOUT ROWID;
+"""
+
+_WS_RE = re.compile(r"[ \t\n\r]*")
+_GLOB_CHARS = set("*?[")
+_decoder = json.JSONDecoder()
+
+
+def _skip_ws(text: str, pos: int) -> int:
+    return _WS_RE.match(text, pos).end()
+
+
+def _scan_object(text: str, pos: int) -> Tuple[int, Dict[str, Tuple[int, int, Any]]]:
+    """text[pos] の '{' から 1 オブジェクトを走査し、(終端位置, {キー: (値の開始, 値の終端, page の値)}) を返す。"""
+    fields: Dict[str, Tuple[int, int, Any]] = {}
+    pos = _skip_ws(text, pos + 1)
+    if text[pos] == "}":
+        return pos + 1, fields
+    while True:
+        key, pos = _decoder.raw_decode(text, pos)
+        pos = _skip_ws(text, pos)
+        if text[pos] != ":":
+            raise ValueError(f"':' expected at byte {pos}")
+        start = _skip_ws(text, pos + 1)
+        value, pos = _decoder.raw_decode(text, start)
+        # 値そのものは page（数値）だけ保持する。文字列は latin-1 のままで意味を持たない
+        fields[key] = (start, pos, value if key == "page" else None)
+        pos = _skip_ws(text, pos)
+        if text[pos] == ",":
+            pos = _skip_ws(text, pos + 1)
+        elif text[pos] == "}":
+            return pos + 1, fields
+        else:
+            raise ValueError(f"',' or '}}' expected at byte {pos}")
+
+
+def scan_page_offsets(raw: bytes) -> Optional[List[Tuple[Any, int, int, Optional[int], Optional[int]]]]:
+    """ページ JSON のバイト列から [(page, start, end, summary_start, summary_end)] を返す。
+
+    トップレベルが配列でなければ None。
+    """
+    text = raw.decode("latin-1")
+    pos = _skip_ws(text, 0)
+    if text[pos:pos + 1] != "[":
+        return None
+    pos = _skip_ws(text, pos + 1)
+    rows = []
+    if text[pos:pos + 1] == "]":
+        return rows
+    while True:
+        start = pos
+        if text[pos] == "{":
+            pos, fields = _scan_object(text, pos)
+        else:
+            _, pos = _decoder.raw_decode(text, pos)
+            fields = {}
+        page = fields.get("page", (0, 0, None))[2]
+        summary = fields.get("summary")
+        rows.append((page, start, pos,
+                     summary[0] if summary else None, summary[1] if summary else None))
+        pos = _skip_ws(text, pos)
+        if text[pos] == ",":
+            pos = _skip_ws(text, pos + 1)
+        elif text[pos] == "]":
+            return rows
+        else:
+            raise ValueError(f"',' or ']' expected at byte {pos}")
+
+
+def _read_range(fh, start: int, end: int) -> Any:
+    fh.seek(start)
+    return json.loads(fh.read(end - start))
+
+
+class PageIndex:
+    """<root>/.index/pages/index.sqlite の読み書きを行う。"""
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.index_dir = corpus_index_dir(self.root, "pages")
+        self.path = self.index_dir / "index.sqlite"
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.index_dir.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), timeout=30.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            version = dict(conn.execute(
+                "SELECT key, value FROM meta" if _has_table(conn, "meta") else "SELECT 1, 1 WHERE 0"
+            ).fetchall())
+            if version.get("format") != PAGE_INDEX_FORMAT or version.get("version") != str(PAGE_INDEX_VERSION):
+                # 形式が変わった場合は作り直す（次の sync または読み出し時に再登録）
+                conn.execute("BEGIN IMMEDIATE")
+                for table in ("pages", "files", "meta"):
+                    conn.execute(f"DROP TABLE IF EXISTS {table}")
+                for statement in _SCHEMA.split(";"):
+                    if statement.strip():
+                        conn.execute(statement)
+                conn.executemany("INSERT INTO meta(key, value) VALUES(?, ?)", [
+                    ("format", PAGE_INDEX_FORMAT),
+                    ("version", str(PAGE_INDEX_VERSION)),
+                ])
+                conn.execute("COMMIT")
+            self._conn = conn
+        return self._conn
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _rel_path(self, path: Path) -> str:
+        return Path(path).relative_to(self.root).as_posix()
+
+    # ── 書き込み ─────────────────────────────────
+
+    def update_file(self, path: Path, stamp: Optional[Tuple[int, int]] = None) -> bool:
+        """1 ファイルを登録し直す（JSON ならページのオフセットも）。変更がなければ何もしない。"""
+        path = Path(path)
+        rel = self._rel_path(path)
+        if stamp is None:
+            st = path.stat()
+            stamp = (st.st_mtime_ns, st.st_size)
+
+        conn = self._connect()
+        row = conn.execute("SELECT mtime_ns, size FROM files WHERE path = ?", (rel,)).fetchone()
+        if row is not None and tuple(row) == tuple(stamp):
+            return False
+
+        rows = None
+        if path.suffix.lower() == ".json":
+            try:
+                with open(path, "rb") as f:
+                    rows = scan_page_offsets(f.read())
+            except (OSError, ValueError):
+                rows = None
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM pages WHERE path = ?", (rel,))
+            conn.execute(
+                "INSERT OR REPLACE INTO files(path, name, mtime_ns, size, pages) VALUES(?, ?, ?, ?, ?)",
+                (rel, path.name, stamp[0], stamp[1], None if rows is None else len(rows)),
+            )
+            if rows:
+                conn.executemany(
+                    "INSERT INTO pages(path, ord, page, start, end, summary_start, summary_end) "
+                    "VALUES(?, ?, ?, ?, ?, ?, ?)",
+                    ((rel, i, *r) for i, r in enumerate(rows)),
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return True
+
+    def remove_file(self, rel: str) -> bool:
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            cur = conn.execute("DELETE FROM files WHERE path = ?", (rel,))
+            conn.execute("DELETE FROM pages WHERE path = ?", (rel,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return cur.rowcount > 0
+
+    def sync(self, files: Optional[List[Path]] = None) -> Dict[str, int]:
+        """ディスク上のファイル一覧と同期する（変更・追加・削除されたものだけ処理）。
+
+        files を省略した場合は root 以下を走査する（PDF 分析・移行時に使う）。
+        """
+        if files is None:
+            files = find_indexed_files(self.root)
+        conn = self._connect()
+        indexed = {
+            path: (mtime_ns, size)
+            for path, mtime_ns, size in conn.execute("SELECT path, mtime_ns, size FROM files")
+        }
+        stats = {"updated": 0, "removed": 0}
+        seen = set()
+        for f in files:
+            rel = self._rel_path(f)
+            seen.add(rel)
+            st = f.stat()
+            stamp = (st.st_mtime_ns, st.st_size)
+            if indexed.get(rel) != stamp and self.update_file(f, stamp):
+                stats["updated"] += 1
+        for rel in indexed.keys() - seen:
+            if self.remove_file(rel):
+                stats["removed"] += 1
+        return stats
+
+    # ── 読み込み ─────────────────────────────────
+
+    def resolve(self, name: str) -> Optional[Path]:
+        """ファイル名または相対パスから登録済みのファイルを返す（完全一致 -> 末尾一致の順）。
+
+        glob パターンや未登録のファイルは None（呼び出し側でツリーを走査する）。
+        """
+        if not name or _GLOB_CHARS & set(name):
+            return None
+        rel = Path(name).as_posix()
+        if Path(name).is_absolute() or rel.startswith(".."):
+            return None
+        conn = self._connect()
+        row = conn.execute("SELECT path FROM files WHERE path = ?", (rel,)).fetchone()
+        if row is None:
+            parts = rel.split("/")
+            for (path,) in conn.execute(
+                "SELECT path FROM files WHERE name = ? ORDER BY path", (parts[-1],)
+            ):
+                if len(parts) == 1 or path.endswith("/" + rel):
+                    row = (path,)
+                    break
+        if row is None:
+            return None
+        path = self.root / row[0]
+        return path if path.is_file() else None
+
+    def _fresh_rows(self, path: Path) -> Optional[list]:
+        """最新のページオフセットを返す（古ければ作り直す）。ページ配列でなければ None。"""
+        rel = self._rel_path(path)
+        st = path.stat()
+        stamp = (st.st_mtime_ns, st.st_size)
+        self.update_file(path, stamp)
+        conn = self._connect()
+        row = conn.execute("SELECT pages FROM files WHERE path = ?", (rel,)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return conn.execute(
+            "SELECT page, start, end, summary_start, summary_end FROM pages WHERE path = ? ORDER BY ord",
+            (rel,),
+        ).fetchall()
+
+    def read_page(self, path: Path, page) -> Tuple[Optional[dict], List[Any]]:
+        """(ページのエントリ, 利用可能なページ番号の一覧) を返す。ページがなければエントリは None。
+
+        ページ配列として索引できないファイルは ValueError。
+        """
+        path = Path(path)
+        rows = self._fresh_rows(path)
+        if rows is None:
+            raise ValueError(f"not a page array: {path}")
+        for page_no, start, end, _, _ in rows:
+            if page_no == page:
+                with open(path, "rb") as f:
+                    entry = _read_range(f, start, end)
+                if not isinstance(entry, dict) or entry.get("page") != page:
+                    raise ValueError(f"stale offsets: {path}")
+                return entry, [r[0] for r in rows]
+        return None, [r[0] for r in rows]
+
+    def read_summaries(self, path: Path) -> List[Tuple[Any, Optional[str]]]:
+        """[(page, summary)] を返す。summary キーのないページは None。"""
+        path = Path(path)
+        rows = self._fresh_rows(path)
+        if rows is None:
+            raise ValueError(f"not a page array: {path}")
+        summaries = []
+        with open(path, "rb") as f:
+            for page_no, _, _, s_start, s_end in rows:
+                summaries.append((page_no, None if s_start is None else _read_range(f, s_start, s_end)))
+        return summaries
+
+    def stats(self) -> Dict[str, int]:
+        conn = self._connect()
+        return {
+            "files": conn.execute("SELECT COUNT(*) FROM files").fetchone()[0],
+            "documents": conn.execute("SELECT COUNT(*) FROM files WHERE pages IS NOT NULL").fetchone()[0],
+            "pages": conn.execute("SELECT COUNT(*) FROM pages").fetchone()[0],
+        }
+
+
+def _has_table(conn: sqlite3.Connection, name: str) -> bool:
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+    ).fetchone() is not None
+
+
+def find_indexed_files(root: Path) -> List[Path]:
+    """root 以下の検索対象ファイル（派生ファイル・隠しディレクトリは除外）。"""
+    base = Path(root)
+    if not base.exists():
+        return []
+    return [
+        f for f in sorted(base.rglob("*"))
+        if f.is_file() and f.suffix.lower() in INDEXED_EXTENSIONS
+        and not is_derived_file(f) and not is_hidden_path(f, base)
+    ]
+
+
+def update_page_index(root: Path, json_path: Path) -> bool:
+    """1 ドキュメント分をページ索引に登録する（PDF 分析完了時に呼ぶ）。"""
+    index = PageIndex(root)
+    try:
+        return index.update_file(json_path)
+    finally:
+        index.close()
@@ -0,0 +1,210 @@
+"""ページ本文のパッセージ（チャンク）分割とパッセージ単位の索引。
+
+ページの markdown (content) を段落単位でまとめ、PASSAGE_CHARS 文字前後の
+重なり (PASSAGE_OVERLAP 文字) のあるパッセージに分割する。パッセージごとに
+embedding とキーワードのポスティングを持たせ、質問に答える段落だけを
+ページ番号・ファイルと一緒に返せるようにする（ページ全文を LLM に渡さずに済む）。
+
+    {stem}_passages.npy        パッセージの正規化済み float32 行列（embedding ストアと同じ形式）
+    {stem}_passages.meta.json  {model, dimensions, count, pages, texts, ...}
+    <root>/.index/passages/index.sqlite
+                               パッセージの転置インデックス（pdf.keyword_index と同じ形式）
+
+分割は決定的で、ページ JSON の content が同じなら同じパッセージ列になる。
+ドキュメント内のパッセージ番号 (ord) は embedding の行番号と一致し、
+サイドカーの texts と現在の分割結果を比べれば embedding が古いかどうかが分かる。
+"""
+
+import re
+import json
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from pdf.keyword_index import KeywordIndex
+from pdf.similarity import EmbeddingMatrix
+
+PASSAGE_CHARS = 600
+PASSAGE_OVERLAP = 120
+
+_BLOCK_RE = re.compile(r"\n\s*\n")
+# 重なり部分の先頭を揃える区切り（改行・文末）
+_BOUNDARY_RE = re.compile(r"[\n。．！？!?]\s*")
+
+
+def _pieces(text: str, max_chars: int) -> Iterable[Tuple[str, str]]:
+    """本文を (断片, 直前の断片とのつなぎ文字) に分ける。
+
+    段落（空行区切り）を単位とし、max_chars を超える段落は行ごとに、
+    それでも長い行は max_chars 文字ごとに切る。
+    """
+    for block in _BLOCK_RE.split(text):
+        block = block.strip()
+        if not block:
+            continue
+        if len(block) <= max_chars:
+            yield block, "\n\n"
+            continue
+        joiner = "\n\n"
+        for line in block.splitlines():
+            line = line.strip()
+            for i in range(0, len(line), max_chars):
+                yield line[i:i + max_chars], joiner if i == 0 else ""
+                joiner = "\n"
+
+
+def _overlap_tail(text: str, overlap: int) -> str:
+    """パッセージ末尾の overlap 文字を、区切りの直後から始まるように取り出す。"""
+    if overlap <= 0 or len(text) <= overlap:
+        return ""
+    tail = text[-overlap:]
+    m = _BOUNDARY_RE.search(tail)
+    if m and m.end() < len(tail):
+        tail = tail[m.end():]
+    return tail.strip()
+
+
+def split_passages(text: str, max_chars: int = PASSAGE_CHARS,
+                   overlap: int = PASSAGE_OVERLAP) -> List[str]:
+    """ページ本文を max_chars 文字前後の、前のパッセージと重なりのあるパッセージ列にする。"""
+    passages: List[str] = []
+    current = ""
+    for piece, joiner in _pieces(text or "", max_chars):
+        if current and len(current) + len(joiner) + len(piece) > max_chars:
+            passages.append(current)
+            current = _overlap_tail(current, overlap)
+            joiner = "\n"
+        current = current + joiner + piece if current else piece
+    if current:
+        passages.append(current)
+    return passages
+
+
+def page_passages(entries: list) -> List[Tuple[Any, int, str]]:
+    """ページ JSON のエントリ列を [(page, ページ内のパッセージ番号 (0 始まり), 本文), ...] にする。
+
+    リストの添字がドキュメント内のパッセージ番号 (ord) になる。
+    """
+    passages = []
+    for entry in entries:
+        if not isinstance(entry, dict):
+            continue
+        page = entry.get("page", "?")
+        for i, text in enumerate(split_passages(entry.get("content", "") or "")):
+            passages.append((page, i, text))
+    return passages
+
+
+def load_page_passages(json_path: Path) -> List[Tuple[Any, int, str]]:
+    """ページ JSON を読み込んでパッセージに分割する（読めなければ空）。"""
+    try:
+        with open(json_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return []
+    return page_passages(data if isinstance(data, list) else [])
+
+
+# ── embedding ─────────────────────────────────
+
+def passage_embeddings_path(json_path: Path) -> Path:
+    """ページ JSON に対応する {stem}_passages.npy のパス（サイドカーは .meta.json）。"""
+    json_path = Path(json_path)
+    return json_path.parent / f"{json_path.stem}_passages.npy"
+
+
+def load_passage_embeddings(json_path: Path) -> Optional[EmbeddingMatrix]:
+    """パッセージの embedding をメモリマップで開く。なければ None。"""
+    from pdf.embedding_store import load_store
+    return load_store(passage_embeddings_path(json_path))
+
+
+def passage_embeddings_mtime(json_path: Path) -> Optional[int]:
+    """パッセージ embedding のサイドカーの mtime_ns（なければ None）。"""
+    try:
+        return passage_embeddings_path(json_path).with_suffix(".meta.json").stat().st_mtime_ns
+    except OSError:
+        return None
+
+
+def passage_embeddings_current(json_path: Path, passages: Optional[list] = None) -> bool:
+    """パッセージ embedding が現在のページ本文の分割結果と一致するか。"""
+    from pdf.embedding_store import load_store_meta
+
+    meta = load_store_meta(passage_embeddings_path(json_path).with_suffix(".meta.json"))
+    if meta is None:
+        return False
+    if passages is None:
+        passages = load_page_passages(json_path)
+    return meta.get("texts") == [text for _, _, text in passages]
+
+
+def generate_passage_embeddings(client, pages_data: list, model: str,
+                                dimensions: Optional[int] = None) -> Dict[str, Any]:
+    """全パッセージの embedding を生成する（generate_embeddings() と同じ形式の dict を返す）。"""
+    from pdf.embeddings import embed_texts, EMBEDDING_DIMENSIONS
+    from pdf.local_embeddings import model_fingerprint
+
+    passages = page_passages(pages_data)
+    texts = [text for _, _, text in passages]
+    fingerprint = model_fingerprint(model)
+    vectors = embed_texts(client, texts, model=model, dimensions=dimensions) if texts else []
+    return {
+        "model": model,
+        "fingerprint": fingerprint,
+        "dimensions": len(vectors[0]) if vectors else (dimensions or EMBEDDING_DIMENSIONS),
+        "pages": [
+            {"page": page, "text_embedded": text, "embedding": vector}
+            for (page, _, text), vector in zip(passages, vectors)
+        ],
+    }
+
+
+def save_passage_embeddings(embeddings_data: Dict[str, Any], json_path: Path) -> Path:
+    """generate_passage_embeddings() の結果を {stem}_passages.npy に保存し、そのパスを返す。"""
+    from pdf.embedding_store import save_binary_embeddings
+
+    npy_path = passage_embeddings_path(json_path)
+    save_binary_embeddings(embeddings_data, npy_path)
+    return npy_path
+
+
+def update_passage_embeddings(client, json_path: Path, model: str,
+                              dimensions: Optional[int] = None, force: bool = False) -> Optional[int]:
+    """パッセージ embedding が古い・ない場合だけ生成し直す（force なら常に生成する）。
+
+    Returns:
+        生成したパッセージ数（最新で何もしなかった場合は None）
+    """
+    with open(json_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    entries = data if isinstance(data, list) else []
+    if not force and passage_embeddings_current(json_path, page_passages(entries)):
+        return None
+    embeddings_data = generate_passage_embeddings(client, entries, model, dimensions)
+    save_passage_embeddings(embeddings_data, json_path)
+    return len(embeddings_data["pages"])
+
+
+# ── キーワードインデックス ───────────────────────
+
+class PassageIndex(KeywordIndex):
+    """パッセージ単位の転置インデックス（<root>/.index/passages/index.sqlite）。
+
+    1 パッセージを 1 行として登録する（content にパッセージ本文、page に元のページ番号、
+    ord にドキュメント内のパッセージ番号）。検索・BM25F のスコアは KeywordIndex と同じ。
+    """
+
+    INDEX_NAME = "passages"
+
+    def _page_rows(self, entries: list) -> Iterable[Tuple[int, Any, str, str, str]]:
+        for ord_, (page, _, text) in enumerate(page_passages(entries)):
+            yield ord_, page, "", text, ""
+
+
+def update_passage_index(root: Path, json_path: Path) -> bool:
+    """1 ドキュメント分をパッセージの転置インデックスに登録する（PDF 分析完了時に呼ぶ）。"""
+    index = PassageIndex(root)
+    try:
+        return index.update_document(json_path)
+    finally:
+        index.close()
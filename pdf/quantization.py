@@ -0,0 +1,375 @@
+"""embedding の量子化（int8 スカラー量子化 / 直積量子化）。
+
+コーパスインデックスの float32 行列を圧縮コードとして保持し、
+クエリは float32 のまま圧縮コードと直接スコアリングする（非対称距離計算, ADC）。
+上位候補は必要に応じて元の float32 行列（メモリマップ）で厳密に再スコアリングする。
+
+    int8: 次元ごとの対称スケールで 1 次元 1 バイト（float32 の 1/4）
+    pq:   次元を M 個の部分空間に分け、各部分空間を 256 個の代表ベクトルの
+          ID (1 バイト) で表す（1536 次元・M=96 なら 1/64）
+
+    <root>/.index/quantized/
+        quantized.json   {method, corpus_generation, indexed_rows, ...}
+        codes.npy        行ごとの圧縮コード
+        <param>.npy      量子化パラメータ（scale / codebooks）
+"""
+
+import os
+import json
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
+from pdf.corpus_index import CorpusIndex, Include
+from pdf.file_manager import corpus_index_dir
+from pdf.similarity import query_vector, top_k_indices
+
+QUANT_FORMAT = "ucf-quantized-index"
+QUANT_VERSION = 1
+
+QUANTIZE_METHODS = ("int8", "pq")
+# 再スコアリングする上位候補数の既定値
+DEFAULT_RERANK = 50
+# PQ の部分空間あたりの次元数の目安
+PQ_SUBVECTOR_DIMS = 16
+# PQ 学習に使う最大サンプル数
+MAX_TRAIN_SAMPLES = 20000
+# ADC 計算のバッチサイズ（一時配列のメモリ上限）
+_BATCH = 8192
+
+
+class ScalarQuantizer:
+    """次元ごとの対称スケールによる int8 量子化。"""
+
+    method = "int8"
+
+    def __init__(self, scale: Optional[np.ndarray] = None):
+        self.scale = scale
+
+    def fit(self, vectors: np.ndarray) -> "ScalarQuantizer":
+        max_abs = np.zeros(vectors.shape[1], dtype=np.float32)
+        for lo in range(0, vectors.shape[0], _BATCH):
+            block = np.abs(np.asarray(vectors[lo:lo + _BATCH], dtype=np.float32))
+            np.maximum(max_abs, block.max(axis=0), out=max_abs)
+        max_abs[max_abs == 0] = 1.0
+        self.scale = (max_abs / 127.0).astype(np.float32)
+        return self
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        codes = np.empty(vectors.shape, dtype=np.int8)
+        for lo in range(0, vectors.shape[0], _BATCH):
+            block = np.asarray(vectors[lo:lo + _BATCH], dtype=np.float32) / self.scale
+            codes[lo:lo + len(block)] = np.clip(np.rint(block), -127, 127)
+        return codes
+
+    def scores(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        """int8 コードと float32 クエリの内積（スケールはクエリ側に掛ける）。"""
+        scaled_query = (query * self.scale).astype(np.float32)
+        out = np.empty(codes.shape[0], dtype=np.float32)
+        for lo in range(0, codes.shape[0], _BATCH):
+            block = np.asarray(codes[lo:lo + _BATCH], dtype=np.float32)
+            out[lo:lo + len(block)] = block @ scaled_query
+        return out
+
+    def state(self) -> Dict[str, np.ndarray]:
+        return {"scale": self.scale}
+
+    @classmethod
+    def from_state(cls, arrays: Dict[str, np.ndarray], meta: Dict[str, Any]) -> "ScalarQuantizer":
+        return cls(np.asarray(arrays["scale"], dtype=np.float32))
+
+
+def default_subspaces(dimensions: int) -> int:
+    """次元数を割り切る部分空間数のうち、1 部分空間 ≒ 16 次元になるものを選ぶ。"""
+    for m in range(max(1, dimensions // PQ_SUBVECTOR_DIMS), 0, -1):
+        if dimensions % m == 0:
+            return m
+    return 1
+
+
+def _kmeans(data: np.ndarray, k: int, iterations: int, rng) -> np.ndarray:
+    """ユークリッド距離の k-means（PQ の部分空間用）。"""
+    centroids = data[rng.choice(data.shape[0], k, replace=False)].copy()
+    for _ in range(iterations):
+        dists = (
+            (data * data).sum(axis=1, keepdims=True)
+            - 2.0 * data @ centroids.T
+            + (centroids * centroids).sum(axis=1)
+        )
+        assignments = np.argmin(dists, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, data)
+        counts = np.bincount(assignments, minlength=k).astype(np.float32)
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = data[rng.choice(data.shape[0], int(empty.sum()), replace=False)]
+            counts[empty] = 1.0
+        centroids = sums / counts[:, None]
+    return centroids.astype(np.float32)
+
+
+class ProductQuantizer:
+    """直積量子化。M 個の部分空間それぞれを最大 256 個の代表ベクトルで表す。"""
+
+    method = "pq"
+
+    def __init__(self, subspaces: Optional[int] = None, codebooks: Optional[np.ndarray] = None):
+        self.subspaces = subspaces
+        self.codebooks = codebooks  # (M, ksub, dsub)
+
+    def fit(self, vectors: np.ndarray, iterations: int = 15, seed: int = 0) -> "ProductQuantizer":
+        rng = np.random.default_rng(seed)
+        n, dims = vectors.shape
+        m = self.subspaces or default_subspaces(dims)
+        if dims % m != 0:
+            raise ValueError(f"次元数 {dims} は部分空間数 {m} で割り切れません")
+        if n > MAX_TRAIN_SAMPLES:
+            sample = np.asarray(vectors[np.sort(rng.choice(n, MAX_TRAIN_SAMPLES, replace=False))])
+        else:
+            sample = np.asarray(vectors)
+        sample = np.asarray(sample, dtype=np.float32)
+        ksub = min(256, sample.shape[0])
+        dsub = dims // m
+        self.subspaces = m
+        self.codebooks = np.stack([
+            _kmeans(np.ascontiguousarray(sample[:, i * dsub:(i + 1) * dsub]), ksub, iterations, rng)
+            for i in range(m)
+        ])
+        return self
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        m, ksub, dsub = self.codebooks.shape
+        codes = np.empty((vectors.shape[0], m), dtype=np.uint8)
+        norms = (self.codebooks * self.codebooks).sum(axis=2)  # (M, ksub)
+        for lo in range(0, vectors.shape[0], _BATCH):
+            block = np.asarray(vectors[lo:lo + _BATCH], dtype=np.float32)
+            for i in range(m):
+                sub = block[:, i * dsub:(i + 1) * dsub]
+                dists = norms[i] - 2.0 * sub @ self.codebooks[i].T
+                codes[lo:lo + len(block), i] = np.argmin(dists, axis=1)
+        return codes
+
+    def scores(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        """部分空間ごとの内積テーブルを引いて合計する（ADC）。"""
+        m, ksub, dsub = self.codebooks.shape
+        table = np.einsum("mkd,md->mk", self.codebooks, query.reshape(m, dsub)).astype(np.float32)
+        out = np.empty(codes.shape[0], dtype=np.float32)
+        cols = np.arange(m)
+        for lo in range(0, codes.shape[0], _BATCH):
+            block = np.asarray(codes[lo:lo + _BATCH])
+            out[lo:lo + len(block)] = table[cols, block].sum(axis=1)
+        return out
+
+    def state(self) -> Dict[str, np.ndarray]:
+        return {"codebooks": self.codebooks}
+
+    @classmethod
+    def from_state(cls, arrays: Dict[str, np.ndarray], meta: Dict[str, Any]) -> "ProductQuantizer":
+        codebooks = np.asarray(arrays["codebooks"], dtype=np.float32)
+        return cls(codebooks.shape[0], codebooks)
+
+
+_QUANTIZERS = {"int8": ScalarQuantizer, "pq": ProductQuantizer}
+_STATE_KEYS = {"int8": ("scale",), "pq": ("codebooks",)}
+
+
+def make_quantizer(method: str, subspaces: Optional[int] = None):
+    if method == "int8":
+        return ScalarQuantizer()
+    if method == "pq":
+        return ProductQuantizer(subspaces)
+    raise ValueError(f"不明な量子化方式: {method} (int8 / pq)")
+
+
+class QuantizedIndex:
+    """<root>/.index/quantized/ の量子化インデックス。"""
+
+    def __init__(self, corpus: CorpusIndex):
+        self.corpus = corpus
+        self.index_dir = corpus_index_dir(corpus.root, "quantized")
+        self.meta_path = self.index_dir / "quantized.json"
+        self.meta = self._load_meta()
+        self._quantizer = None
+        self._codes = None
+
+    def _load_meta(self) -> Optional[Dict[str, Any]]:
+        if not self.meta_path.exists():
+            return None
+        try:
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except Exception:
+            return None
+        if meta.get("format") != QUANT_FORMAT or meta.get("method") not in _QUANTIZERS:
+            return None
+        return meta
+
+    def exists(self) -> bool:
+        return self.meta is not None
+
+    @property
+    def method(self) -> str:
+        return self.meta["method"] if self.meta else ""
+
+    def is_compatible(self) -> bool:
+        return (
+            self.meta is not None
+            and self.meta.get("corpus_generation") == self.corpus.manifest.get("generation")
+            and self.meta.get("dimensions") == self.corpus.dimensions
+            and self.meta.get("indexed_rows", 0) <= self.corpus.rows
+        )
+
+    def _save(self, quantizer, codes: np.ndarray, meta: Dict[str, Any]):
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        self._quantizer = self._codes = None
+        for name, arr in [("codes", codes), *quantizer.state().items()]:
+            tmp_path = self.index_dir / f"{name}.npy.tmp"
+            with open(tmp_path, "wb") as f:
+                np.save(f, arr, allow_pickle=False)
+            os.replace(tmp_path, self.index_dir / f"{name}.npy")
+        tmp_path = self.meta_path.with_name(self.meta_path.name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_path, self.meta_path)
+        self.meta = meta
+
+    def build(self, method: str = "int8", subspaces: Optional[int] = None) -> Dict[str, Any]:
+        """コーパス全行を学習・量子化してインデックスを作り直す。"""
+        vectors = self.corpus.matrix()
+        rows = self.corpus.rows
+        if rows == 0:
+            raise ValueError("コーパスインデックスが空です")
+        quantizer = make_quantizer(method, subspaces)
+        quantizer.fit(vectors)
+        codes = quantizer.encode(vectors)
+        meta = {
+            "format": QUANT_FORMAT,
+            "version": QUANT_VERSION,
+            "method": method,
+            "subspaces": getattr(quantizer, "subspaces", None),
+            "dimensions": self.corpus.dimensions,
+            "corpus_generation": self.corpus.manifest.get("generation"),
+            "indexed_rows": rows,
+            "code_bytes": int(codes.nbytes),
+            "float32_bytes": int(rows * self.corpus.dimensions * 4),
+        }
+        self._save(quantizer, codes, meta)
+        return meta
+
+    def update(self) -> str:
+        """コーパスに追記された行を既存のパラメータで量子化する。
+
+        Returns:
+            "unchanged" / "appended" / "rebuilt"
+        """
+        if not self.is_compatible():
+            subspaces = self.meta.get("subspaces") if self.meta else None
+            # 次元数が変わった（--truncate-dims / ローカルモデル）ときは部分空間数を選び直す
+            if subspaces and (self.meta.get("dimensions") != self.corpus.dimensions
+                              or self.corpus.dimensions % subspaces != 0):
+                subspaces = default_subspaces(self.corpus.dimensions)
+            self.build(self.meta["method"] if self.meta else "int8", subspaces)
+            return "rebuilt"
+        indexed = self.meta.get("indexed_rows", 0)
+        if indexed == self.corpus.rows:
+            return "unchanged"
+        quantizer = self._load_quantizer()
+        old_codes = np.load(self.index_dir / "codes.npy", allow_pickle=False)
+        new_codes = quantizer.encode(self.corpus.matrix()[indexed:])
+        codes = np.concatenate([old_codes[:indexed], new_codes])
+        meta = dict(self.meta, indexed_rows=self.corpus.rows,
+                    code_bytes=int(codes.nbytes),
+                    float32_bytes=int(self.corpus.rows * self.corpus.dimensions * 4))
+        self._save(quantizer, codes, meta)
+        return "appended"
+
+    # ── 検索 ──────────────────────────────────────
+
+    def _load_quantizer(self):
+        if self._quantizer is None:
+            method = self.meta["method"]
+            arrays = {
+                key: np.load(self.index_dir / f"{key}.npy", allow_pickle=False)
+                for key in _STATE_KEYS[method]
+            }
+            self._quantizer = _QUANTIZERS[method].from_state(arrays, self.meta)
+        return self._quantizer
+
+    def _load_codes(self) -> np.ndarray:
+        if self._codes is None:
+            self._codes = np.load(self.index_dir / "codes.npy", mmap_mode="r", allow_pickle=False)
+        return self._codes
+
+    def approximate_scores(self, query: np.ndarray) -> np.ndarray:
+        """全行の近似スコア。量子化後に追記された末尾行は float32 で計算する。"""
+        scores = self._load_quantizer().scores(self._load_codes(), query)
+        indexed = self.meta.get("indexed_rows", 0)
+        if indexed < self.corpus.rows:
+            tail = np.asarray(self.corpus.matrix()[indexed:]) @ query
+            scores = np.concatenate([scores[:indexed], tail])
+        return scores
+
+    def _scored(
+        self, query_embedding: List[float], include: Optional[Include], rerank: int
+    ) -> np.ndarray:
+        query = query_vector(query_embedding, self.corpus.dimensions,
+                             self.corpus.model, self.corpus.fingerprint)
+        scores = self.approximate_scores(query)
+        scores = np.where(self.corpus.row_mask(include), scores, -np.inf).astype(np.float32)
+        if rerank > 0:
+            candidates = top_k_indices(scores, rerank)
+            candidates = np.sort(candidates[np.isfinite(scores[candidates])])
+            if candidates.shape[0]:
+                scores[candidates] = np.asarray(self.corpus.matrix()[candidates]) @ query
+        return scores
+
+    def search(
+        self,
+        query_embedding: List[float],
+        top_k: int = 5,
+        include: Optional[Include] = None,
+        rerank: int = DEFAULT_RERANK,
+    ) -> List[Dict[str, Any]]:
+        """ADC で上位候補を選び、上位 rerank 件を float32 で再スコアリングする。"""
+        scores = self._scored(query_embedding, include, max(rerank, top_k) if rerank else 0)
+        results = []
+        for row in top_k_indices(scores, top_k):
+            if not np.isfinite(scores[row]):
+                break
+            path, page = self.corpus.row_location(row)
+            results.append({"path": path, "page": page, "score": float(scores[row])})
+        return results
+
+    def all_scores(
+        self,
+        query_embedding: List[float],
+        include: Optional[Include] = None,
+        rerank: int = DEFAULT_RERANK,
+    ) -> List[Tuple[str, int, float]]:
+        """有効な全行の (相対パス, ページ番号, スコア)。上位 rerank 件は厳密スコア。"""
+        scores = self._scored(query_embedding, include, rerank)
+        rows = np.nonzero(np.isfinite(scores))[0]
+        return [
+            (path, page, score)
+            for (path, page), score in zip(self.corpus.row_locations(rows), scores[rows].tolist())
+        ]
+
+
+def open_quantized_index(root: Path) -> Optional[QuantizedIndex]:
+    """既存の量子化インデックスを開く。存在しなければ None。"""
+    corpus = CorpusIndex(root)
+    if not corpus.exists():
+        return None
+    index = QuantizedIndex(corpus)
+    if not index.exists():
+        return None
+    return index
+
+
+def update_quantized_index(root: Path) -> Optional[str]:
+    """量子化インデックスが存在すればコーパスに合わせて増分更新する。"""
+    index = open_quantized_index(root)
+    if index is None or index.corpus.rows == 0:
+        return None
+    return index.update()
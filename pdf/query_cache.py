@@ -0,0 +1,239 @@
+"""検索クエリ embedding のディスクキャッシュ。
+
+(embedding モデル, 正規化したクエリ文字列) をキーに、クエリ embedding を
+SQLite (WAL モード) に float32 の BLOB として保存する。
+RAG の ReAct ループで同じクエリを何度も投げても API は 1 回で済む。
+
+    .ucf_desktop/cache/query_embeddings.sqlite
+
+- LRU: ヒットのたびに最終利用時刻を更新し、件数が上限を超えたら古い順に削除する
+- TTL: 作成から ttl 秒を過ぎたエントリは使わずに削除する
+- 複数プロセス・複数スレッドから同時に使っても安全（スレッドごとの接続 + SQLite のロック + busy timeout）
+- キャッシュの失敗は検索を止めない（常に API 呼び出しにフォールバック）
+
+Usage:
+    uv run python -m pdf.query_cache            # 統計を表示
+    uv run python -m pdf.query_cache --clear    # キャッシュを削除
+"""
+
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+import argparse
+import unicodedata
+from pathlib import Path
+from typing import Optional, List, Dict, Any
+
+import numpy as np
+
+_PROJECT_DIR = Path(__file__).resolve().parent.parent
+DEFAULT_CACHE_PATH = _PROJECT_DIR / ".ucf_desktop" / "cache" / "query_embeddings.sqlite"
+
+DEFAULT_MAX_ENTRIES = 5000
+DEFAULT_TTL_SECONDS = 30 * 24 * 3600
+
+# UCF_QUERY_CACHE=0 で無効化、UCF_QUERY_CACHE_PATH で保存先を変更できる
+_ENV_ENABLE = "UCF_QUERY_CACHE"
+_ENV_PATH = "UCF_QUERY_CACHE_PATH"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    query TEXT NOT NULL,
+    dims INTEGER NOT NULL,
+    vector BLOB NOT NULL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_last_used ON entries(last_used);
+CREATE TABLE IF NOT EXISTS stats (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+_WS_RE = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    """キャッシュキー用にクエリを正規化する（NFKC + 空白の畳み込み）。"""
+    return _WS_RE.sub(" ", unicodedata.normalize("NFKC", query)).strip()
+
+
+def cache_key(model: str, query: str) -> str:
+    return hashlib.sha256(f"{model}\0{normalize_query(query)}".encode("utf-8")).hexdigest()
+
+
+class QueryEmbeddingCache:
+    """SQLite によるクエリ embedding の LRU + TTL キャッシュ。"""
+
+    def __init__(
+        self,
+        path: Optional[Path] = None,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+    ):
+        self.path = Path(path) if path else DEFAULT_CACHE_PATH
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        # sqlite3 の接続は作ったスレッドでしか使えないため、スレッドごとに開く
+        # （エージェントの並列ツール実行・Web サーバーのスレッドから embed_query が呼ばれる）
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._conns: List[sqlite3.Connection] = []
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # 自動トランザクションは使わず、書き込みは BEGIN IMMEDIATE で明示的に行う
+            # （close() は別スレッドから呼ばれることがあるため check_same_thread=False）
+            conn = sqlite3.connect(str(self.path), timeout=10.0, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+            with self._lock:
+                self._conns.append(conn)
+        return conn
+
+    def close(self) -> None:
+        """全スレッドの接続を閉じる（使用中のスレッドがない時に呼ぶ）。"""
+        with self._lock:
+            conns, self._conns = self._conns, []
+        for conn in conns:
+            conn.close()
+        self._local = threading.local()
+
+    def _bump(self, conn: sqlite3.Connection, name: str, amount: int = 1) -> None:
+        conn.execute(
+            "INSERT INTO stats(name, value) VALUES(?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            (name, amount),
+        )
+
+    def get(self, model: str, query: str) -> Optional[List[float]]:
+        """キャッシュ済みの embedding を返す。なければ（または期限切れなら）None。"""
+        key = cache_key(model, query)
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT dims, vector, created FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self.ttl_seconds and now - row[2] > self.ttl_seconds:
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._bump(conn, "expired")
+                row = None
+            if row is None:
+                self._bump(conn, "misses")
+                conn.execute("COMMIT")
+                return None
+            conn.execute("UPDATE entries SET last_used = ? WHERE key = ?", (now, key))
+            self._bump(conn, "hits")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        vector = np.frombuffer(row[1], dtype=np.float32)
+        if vector.shape[0] != row[0]:
+            return None
+        return vector.tolist()
+
+    def put(self, model: str, query: str, embedding: List[float]) -> None:
+        """embedding を保存し、上限を超えた分を LRU 順に削除する。"""
+        vector = np.asarray(embedding, dtype=np.float32)
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries(key, model, query, dims, vector, created, last_used) "
+                "VALUES(?, ?, ?, ?, ?, ?, ?)",
+                (cache_key(model, query), model, normalize_query(query),
+                 int(vector.shape[0]), vector.tobytes(), now, now),
+            )
+            if self.ttl_seconds:
+                cur = conn.execute("DELETE FROM entries WHERE created < ?", (now - self.ttl_seconds,))
+                if cur.rowcount > 0:
+                    self._bump(conn, "expired", cur.rowcount)
+            if self.max_entries:
+                cur = conn.execute(
+                    "DELETE FROM entries WHERE key IN ("
+                    "SELECT key FROM entries ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+                if cur.rowcount > 0:
+                    self._bump(conn, "evicted", cur.rowcount)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def stats(self) -> Dict[str, Any]:
+        """件数・ヒット数・ミス数・ヒット率などを返す。"""
+        conn = self._connect()
+        counters = dict(conn.execute("SELECT name, value FROM stats").fetchall())
+        entries = conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        hits = counters.get("hits", 0)
+        misses = counters.get("misses", 0)
+        return {
+            "path": str(self.path),
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            "evicted": counters.get("evicted", 0),
+            "expired": counters.get("expired", 0),
+        }
+
+    def clear(self) -> None:
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM entries")
+        conn.execute("DELETE FROM stats")
+        conn.execute("COMMIT")
+
+
+_default_cache: Optional[QueryEmbeddingCache] = None
+
+
+def default_cache() -> Optional[QueryEmbeddingCache]:
+    """プロセス共通のキャッシュを返す。UCF_QUERY_CACHE=0 の場合は None。"""
+    global _default_cache
+    if os.environ.get(_ENV_ENABLE, "1").lower() in ("0", "false", "off", "no"):
+        return None
+    if _default_cache is None:
+        _default_cache = QueryEmbeddingCache(os.environ.get(_ENV_PATH) or None)
+    return _default_cache
+
+
+def main():
+    parser = argparse.ArgumentParser(description="クエリ embedding キャッシュの統計表示・削除")
+    parser.add_argument("--clear", action="store_true", help="キャッシュを全削除する")
+    parser.add_argument("--path", default=None, help="キャッシュファイルのパス")
+    args = parser.parse_args()
+
+    cache = QueryEmbeddingCache(args.path or os.environ.get(_ENV_PATH) or None)
+    if args.clear:
+        cache.clear()
+        print(f"Cleared: {cache.path}")
+        return
+
+    s = cache.stats()
+    print(f"Cache:    {s['path']}")
+    print(f"Entries:  {s['entries']} / {s['max_entries']} (TTL {s['ttl_seconds'] / 86400:.0f} days)")
+    print(f"Hits:     {s['hits']}  Misses: {s['misses']}  Hit rate: {s['hit_rate']:.1%}")
+    print(f"Evicted:  {s['evicted']}  Expired: {s['expired']}")
+
+
+if __name__ == "__main__":
+    main()
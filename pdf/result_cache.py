@@ -0,0 +1,139 @@
+"""検索結果のキャッシュとコーパスの世代番号。
+
+コーパスの世代番号は <root>/.index/generation.json に保存する単調増加のカウンタで、
+PDF 分析・マイグレーション・インデックス同期がドキュメントの変更を反映するたびに
+bump_corpus_generation() で 1 増やす。
+
+検索結果は (コマンド, 正規化したクエリ, top_k, 重みなどのオプション, 各ルートの世代番号)
+をキーにプロセス内の LRU に保持する。世代が進めばキーが変わるため、古い結果は返らない。
+（search_json.py は世代番号を進めない直接の編集に備え、ディレクトリの mtime の stamp もキーに含める）
+常駐検索デーモン・エージェントの rag_search（/api/query 経由を含む）で共有される。
+
+UCF_RESULT_CACHE=0 で無効化できる。
+"""
+
+import os
+import json
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+from pdf.file_manager import INDEX_DIR_NAME
+
+GENERATION_FILE = "generation.json"
+DEFAULT_MAX_ENTRIES = 256
+
+_ENV_ENABLE = "UCF_RESULT_CACHE"
+
+_generation_lock = threading.Lock()
+# {generation.json の絶対パス: ((mtime_ns, size), 世代番号)}
+_generation_cache: Dict[str, Tuple[Tuple[int, int], int]] = {}
+
+
+def _generation_path(root: Path) -> Path:
+    return Path(root) / INDEX_DIR_NAME / GENERATION_FILE
+
+
+def corpus_generation(root: Path) -> Tuple[int, int]:
+    """コーパスの世代 (世代番号, ファイルの mtime_ns) を返す。未作成なら (0, 0)。
+
+    mtime_ns も含めるのは、generation.json が削除されて番号が 1 からやり直しになった場合にも
+    世代を区別するため。
+    """
+    path = _generation_path(root)
+    try:
+        st = path.stat()
+    except OSError:
+        return 0, 0
+    stamp = (st.st_mtime_ns, st.st_size)
+    key = str(path)
+    hit = _generation_cache.get(key)
+    if hit is not None and hit[0] == stamp:
+        return hit[1], stamp[0]
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            value = int(json.load(f).get("generation", 0))
+    except (OSError, ValueError, AttributeError):
+        value = 0
+    _generation_cache[key] = (stamp, value)
+    return value, stamp[0]
+
+
+def bump_corpus_generation(root: Path) -> int:
+    """コーパスの世代番号を 1 増やして新しい番号を返す（ドキュメントを変更した側が呼ぶ）。
+
+    読み込みから書き込みまでを .index/.lock のロックでプロセス間でも直列化する
+    （分析とマイグレーションが同時に bump しても番号が重ならない）。
+    """
+    from pdf.corpus_index import _lock_file, _unlock_file
+
+    path = _generation_path(root)
+    with _generation_lock:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path.parent / ".lock", "a+b") as lock:
+            _lock_file(lock)
+            try:
+                try:
+                    with open(path, "r", encoding="utf-8") as f:
+                        value = int(json.load(f).get("generation", 0))
+                except (OSError, ValueError, AttributeError):
+                    value = 0
+                value += 1
+                tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump({"generation": value}, f)
+                os.replace(tmp_path, path)
+            finally:
+                _unlock_file(lock)
+    return value
+
+
+class ResultCache:
+    """スレッドセーフな LRU キャッシュ（ヒット率などのカウンタ付き）。"""
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evicted += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evicted": self.evicted,
+            }
+
+
+def result_cache_enabled() -> bool:
+    return os.environ.get(_ENV_ENABLE, "1").lower() not in ("0", "false", "off", "no")
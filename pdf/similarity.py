@@ -0,0 +1,171 @@
+"""NumPy ベースの類似度計算エンジン。
+
+ドキュメントごとの embedding を正規化済み float32 行列として保持し、
+クエリとの行列ベクトル積 1 回 + argpartition で top-k を求める。
+"""
+
+from typing import List, Dict, Any, Optional, Sequence
+
+import numpy as np
+
+
+def normalize_vector(vector: Sequence[float]) -> np.ndarray:
+    """ベクトルを float32 の単位ベクトルに変換する（ゼロベクトルはそのまま）。"""
+    vec = np.asarray(vector, dtype=np.float32).reshape(-1)
+    norm = float(np.linalg.norm(vec))
+    if norm == 0.0:
+        return vec
+    return vec / norm
+
+
+class QueryEmbedding(list):
+    """embedding を作ったモデル名 (model) を持つクエリ embedding（中身は list[float]）。
+
+    ローカルモデルの場合は fingerprint（pdf.local_embeddings）も持つ。
+    """
+
+    def __init__(self, values: Sequence[float] = (), model: str = "", fingerprint: str = ""):
+        super().__init__(values)
+        self.model = model
+        self.fingerprint = fingerprint
+
+
+def query_vector(query_embedding: Sequence[float], dimensions: int, model: str = "",
+                 fingerprint: str = "") -> np.ndarray:
+    """クエリを格納済み embedding の次元数に合わせた単位ベクトルにする。
+
+    model は格納済み embedding のモデル名。クエリが QueryEmbedding でモデルが異なれば
+    スコアに意味がないので ValueError（切り詰めは同じモデルどうしでだけ行う）。
+    ローカルモデルは名前が同じでも作り直すと射影が変わるため、fingerprint も比較する。
+    text-embedding-3 系の embedding は先頭 d 次元に切り詰めても使える (Matryoshka) ため、
+    クエリの方が長ければ切り詰めてから正規化する。短い場合は比較できないので ValueError。
+    """
+    query_model = getattr(query_embedding, "model", "")
+    if model and query_model and model != query_model:
+        raise ValueError(
+            f"クエリの embedding モデルが格納済み embedding と一致しません (query={query_model}, index={model})。"
+            f"embedding_model を {model} に戻すか、{query_model} で embedding を作り直してください"
+        )
+    query_fingerprint = getattr(query_embedding, "fingerprint", "")
+    if fingerprint and query_fingerprint and fingerprint != query_fingerprint:
+        raise ValueError(
+            f"ローカル embedding モデルが格納済み embedding の作成後に作り直されています "
+            f"(query={query_fingerprint}, index={fingerprint})。"
+            f"uv run python -m pdf.migration --dir database --build-local-model で embedding を作り直してください"
+        )
+    query = np.asarray(query_embedding, dtype=np.float32).reshape(-1)
+    if query.shape[0] > dimensions > 0:
+        query = query[:dimensions]
+    if query.shape[0] != dimensions:
+        if model and model == query_model:
+            hint = (f"embedding_dimensions を変更した場合は "
+                    f"uv run python -m pdf.migration --truncate-dims {query.shape[0]} を実行してください")
+        else:
+            hint = "embedding_model / embedding_dimensions の設定を確認してください"
+        raise ValueError(f"クエリの次元数が一致しません (query={query.shape[0]}, index={dimensions})。{hint}")
+    return normalize_vector(query)
+
+
+def truncate_rows(matrix: np.ndarray, dimensions: int) -> np.ndarray:
+    """各行を先頭 dimensions 次元に切り詰めて再正規化する (Matryoshka 次元削減)。"""
+    mat = np.asarray(matrix, dtype=np.float32)
+    if dimensions <= 0 or dimensions > mat.shape[1]:
+        raise ValueError(f"切り詰め後の次元数が不正です ({dimensions}, 元の次元数={mat.shape[1]})")
+    return normalize_rows(np.ascontiguousarray(mat[:, :dimensions]))
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """行列の各行を単位ベクトルに正規化する（ゼロ行はそのまま）。"""
+    mat = np.asarray(matrix, dtype=np.float32)
+    if mat.ndim != 2:
+        raise ValueError(f"2次元の行列が必要です (ndim={mat.ndim})")
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return mat / norms
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """スコア配列から上位 k 件のインデックスをスコア降順で返す。
+
+    全件ソートせず argpartition で候補を絞ってから k 件だけ並べ替える。
+    """
+    n = scores.shape[0]
+    if k <= 0 or n == 0:
+        return np.empty(0, dtype=np.intp)
+    if k >= n:
+        return np.argsort(-scores, kind="stable")
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+class EmbeddingMatrix:
+    """1 ドキュメント分のページ embedding を正規化済み行列として保持する。"""
+
+    def __init__(
+        self,
+        vectors: np.ndarray,
+        page_numbers: Sequence[int],
+        texts: Optional[Sequence[str]] = None,
+        normalized: bool = False,
+        model: str = "",
+        fingerprint: str = "",
+    ):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim != 2:
+            raise ValueError(f"2次元の行列が必要です (ndim={vectors.ndim})")
+        if vectors.shape[0] != len(page_numbers):
+            raise ValueError(
+                f"ベクトル数とページ数が一致しません ({vectors.shape[0]} != {len(page_numbers)})"
+            )
+        self.vectors = vectors if normalized else normalize_rows(vectors)
+        self.page_numbers = list(page_numbers)
+        self.texts = list(texts) if texts is not None else [""] * len(self.page_numbers)
+        self.model = model
+        self.fingerprint = fingerprint
+
+    @classmethod
+    def from_embeddings_data(cls, embeddings_data: Dict[str, Any]) -> "EmbeddingMatrix":
+        """generate_embeddings() 形式の dict から行列を構築する。"""
+        pages = embeddings_data.get("pages", [])
+        dims = embeddings_data.get("dimensions") or (len(pages[0]["embedding"]) if pages else 0)
+        if pages:
+            vectors = np.array([p["embedding"] for p in pages], dtype=np.float32)
+        else:
+            vectors = np.zeros((0, dims), dtype=np.float32)
+        return cls(
+            vectors,
+            [p["page"] for p in pages],
+            [p.get("text_embedded", "") for p in pages],
+            model=embeddings_data.get("model", ""),
+            fingerprint=embeddings_data.get("fingerprint", ""),
+        )
+
+    def __len__(self) -> int:
+        return len(self.page_numbers)
+
+    @property
+    def dimensions(self) -> int:
+        return int(self.vectors.shape[1])
+
+    def scores(self, query_embedding: Sequence[float]) -> np.ndarray:
+        """全ページのコサイン類似度を 1 回の行列ベクトル積で計算する。"""
+        query = query_vector(query_embedding, self.dimensions, self.model, self.fingerprint)
+        return self.vectors @ query
+
+    def search(self, query_embedding: Sequence[float], top_k: int = 5) -> List[Dict[str, Any]]:
+        """コサイン類似度の上位 top_k ページを返す。
+
+        Returns:
+            スコア降順の [{page, score, text_embedded}, ...]
+        """
+        if len(self) == 0:
+            return []
+        scores = self.scores(query_embedding)
+        return [
+            {
+                "page": self.page_numbers[i],
+                "score": float(scores[i]),
+                "text_embedded": self.texts[i],
+            }
+            for i in top_k_indices(scores, top_k)
+        ]
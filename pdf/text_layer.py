@@ -0,0 +1,237 @@
+"""PDF のテキストレイヤーからページを Markdown に変換する（Vision API を使わない経路）。
+
+文字・表・画像・図形の量でページを分類し、使えるテキストレイヤーのあるページ
+（ワープロ等から出力された文章・表中心のページ）はローカルで Markdown にする。
+スキャンページや図・写真の多いページは Vision モデルに任せる。
+
+    markdown, reason = read_text_layer(page)   # 1 ページ (描画の前に converter から呼ぶ)
+    local = extract_text_layer(pdf_path)       # {ページ番号: Markdown}
+"""
+
+import sys
+import time
+import statistics
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import pdfplumber
+
+# この文字数未満のページはスキャン・図版とみなす
+MIN_TEXT_CHARS = 100
+# 文字化け（CID のまま・置換文字）の割合がこれを超えたらテキストレイヤーを信用しない
+MAX_GARBLED_RATIO = 0.02
+# 画像・ベクター図形がページを覆う割合がこれを超えたら Vision に回す
+MAX_IMAGE_COVERAGE = 0.15
+MAX_FIGURE_COVERAGE = 0.15
+# 被覆率を測るグリッドの分割数（重なったオブジェクトを二重に数えないため）
+_GRID = 40
+# 本文の文字サイズに対する比率で見出しを判定する
+_H1_RATIO = 1.8
+_H2_RATIO = 1.3
+
+
+def _coverage(page, objects: List[Dict[str, Any]]) -> float:
+    """objects の bbox がページを覆う割合（0〜1）を _GRID x _GRID のセル単位で返す。"""
+    width, height = float(page.width), float(page.height)
+    if not objects or width <= 0 or height <= 0:
+        return 0.0
+    cells = set()
+    for obj in objects:
+        x0 = max(0, int(float(obj["x0"]) / width * _GRID))
+        x1 = min(_GRID, int(-(-float(obj["x1"]) / width * _GRID // 1)))
+        y0 = max(0, int(float(obj["top"]) / height * _GRID))
+        y1 = min(_GRID, int(-(-float(obj["bottom"]) / height * _GRID // 1)))
+        cells.update((x, y) for x in range(x0, x1) for y in range(y0, y1))
+    return len(cells) / (_GRID * _GRID)
+
+
+def _is_garbled(text: str) -> bool:
+    return text.startswith("(cid:") or text == "\ufffd"
+
+
+def classify_page(page) -> Tuple[bool, str]:
+    """ページをローカル変換できるか判定し、(使えるか, 理由) を返す。
+
+    理由は "text" / "few-chars" / "garbled" / "images" / "figures" のいずれか。
+    """
+    chars = [c for c in page.chars if c["text"].strip()]
+    if len(chars) < MIN_TEXT_CHARS:
+        return False, "few-chars"
+    garbled = sum(1 for c in chars if _is_garbled(c["text"]))
+    if garbled / len(chars) > MAX_GARBLED_RATIO:
+        return False, "garbled"
+    if _coverage(page, page.images) > MAX_IMAGE_COVERAGE:
+        return False, "images"
+    if _coverage(page, page.curves) > MAX_FIGURE_COVERAGE:
+        return False, "figures"
+    return True, "text"
+
+
+def _is_cjk(ch: str) -> bool:
+    return "　" <= ch <= "鿿" or "豈" <= ch <= "﫿" or "＀" <= ch <= "￯"
+
+
+def _join_lines(lines: List[str]) -> str:
+    """折り返された行を 1 行につなぐ。日本語どうしの境目には空白を入れない。"""
+    text = ""
+    for line in (l.strip() for l in lines):
+        if not line:
+            continue
+        if text and not (_is_cjk(text[-1]) and _is_cjk(line[0])):
+            text += " "
+        text += line
+    return text
+
+
+def _table_to_markdown(rows: List[List[Optional[str]]]) -> str:
+    rows = [[_join_lines((cell or "").splitlines()).replace("|", "\\|") for cell in row] for row in rows]
+    rows = [row for row in rows if any(row)]
+    if not rows:
+        return ""
+    width = max(len(row) for row in rows)
+    rows = [row + [""] * (width - len(row)) for row in rows]
+    lines = ["| " + " | ".join(rows[0]) + " |", "| " + " | ".join(["---"] * width) + " |"]
+    lines.extend("| " + " | ".join(row) + " |" for row in rows[1:])
+    return "\n".join(lines)
+
+
+def _line_size(line: Dict[str, Any]) -> float:
+    sizes = [c["size"] for c in line["chars"] if c["text"].strip()]
+    return statistics.median(sizes) if sizes else 0.0
+
+
+def _text_blocks(page) -> List[Tuple[float, str]]:
+    """表の外の文字を見出し・段落に分け、[(上端の y, Markdown)] を返す。"""
+    lines = [l for l in page.extract_text_lines(return_chars=True) if l["text"].strip()]
+    if not lines:
+        return []
+    body = statistics.median(_line_size(l) for l in lines) or 1.0
+    blocks: List[Tuple[float, str]] = []
+    paragraph: List[str] = []
+    para_top = 0.0
+    prev = None
+
+    def _flush():
+        if paragraph:
+            blocks.append((para_top, _join_lines(paragraph)))
+            paragraph.clear()
+
+    for line in lines:
+        ratio = _line_size(line) / body
+        # 大きな数字だけの行（ページ番号など）は見出しにしない
+        if ratio >= _H2_RATIO and not line["text"].strip().isdigit():
+            _flush()
+            prefix = "#" if ratio >= _H1_RATIO else "##"
+            blocks.append((line["top"], f"{prefix} {line['text'].strip()}"))
+            prev = None
+            continue
+        height = line["bottom"] - line["top"]
+        # 行間が行の高さより広ければ段落の区切りとみなす
+        if prev is not None and line["top"] - prev["bottom"] > height:
+            _flush()
+        if not paragraph:
+            para_top = line["top"]
+        paragraph.append(line["text"])
+        prev = line
+    _flush()
+    return blocks
+
+
+def _column_gutter(page) -> Optional[float]:
+    """2 段組みのページなら段の間（文字のない縦の帯）の x 座標を返す。"""
+    chars = [c for c in page.chars if c["text"].strip()]
+    if len(chars) < MIN_TEXT_CHARS:
+        return None
+    width = float(page.width)
+    used = [0] * (_GRID * 4)
+    for c in chars:
+        for i in range(int(c["x0"] / width * len(used)), min(len(used), int(c["x1"] / width * len(used)) + 1)):
+            used[i] += 1
+    # ページ中央付近（30〜70%）で文字が 1 つもかからない列を段の境目とする
+    lo, hi = int(len(used) * 0.3), int(len(used) * 0.7)
+    empty = [i for i in range(lo, hi) if not used[i]]
+    if not empty:
+        return None
+    gutter = (min(empty, key=lambda i: abs(i - len(used) / 2)) + 0.5) / len(used) * width
+    left = sum(1 for c in chars if c["x1"] <= gutter)
+    # 片側がほとんど空なら段組みではない（余白の偏り）
+    if min(left, len(chars) - left) < len(chars) * 0.2:
+        return None
+    return gutter
+
+
+def page_to_markdown(page) -> str:
+    """テキストレイヤーからページを Markdown にする（表は Markdown の表、大きな文字は見出し）。"""
+    blocks = []
+    bboxes = []
+    for table in page.find_tables():
+        rows = table.extract()
+        # 1 列だけの「表」（罫線で囲んだ目次のページ番号など）は本文として読む
+        if sum(1 for col in zip(*rows) if any(col)) < 2:
+            continue
+        markdown = _table_to_markdown(rows)
+        if markdown:
+            blocks.append((table.bbox[1], markdown))
+            bboxes.append(table.bbox)
+
+    def _outside_tables(obj) -> bool:
+        cx, cy = (obj["x0"] + obj["x1"]) / 2, (obj["top"] + obj["bottom"]) / 2
+        return not any(x0 <= cx <= x1 and top <= cy <= bottom for x0, top, x1, bottom in bboxes)
+
+    text_page = page.filter(_outside_tables) if bboxes else page
+    blocks.sort(key=lambda block: block[0])
+    gutter = _column_gutter(text_page)
+    if gutter is None:
+        blocks.extend(_text_blocks(text_page))
+        blocks.sort(key=lambda block: block[0])
+    else:
+        # 段組みは左の段、右の段の順に読む（表はその前に置く）
+        blocks.extend(_text_blocks(text_page.filter(lambda obj: obj["x1"] <= gutter)))
+        blocks.extend(_text_blocks(text_page.filter(lambda obj: obj["x0"] >= gutter)))
+    return "\n\n".join(markdown for _, markdown in blocks).strip()
+
+
+def read_text_layer(page) -> Tuple[Optional[str], str]:
+    """ページを分類し、テキストレイヤーが使えれば (Markdown, "text")、使えなければ (None, 理由) を返す。
+
+    ページは閉じない（呼び出し側がこの後 Vision 用に描画することがあるため）。
+    """
+    try:
+        usable, reason = classify_page(page)
+        if not usable:
+            return None, reason
+        markdown = page_to_markdown(page)
+    except Exception as e:
+        sys.stderr.write(f"Error reading text layer of page {page.page_number}: {e}\n")
+        return None, "error"
+    return (markdown, reason) if markdown else (None, "few-chars")
+
+
+def extract_text_layer(pdf_path: Path, stats: Optional[Dict[str, Any]] = None) -> Dict[int, str]:
+    """テキストレイヤーの使えるページを Markdown にして {ページ番号: Markdown} を返す。
+
+    stats (任意の dict) には {"pages", "local", "seconds", "reasons": {理由: ページ数}} が入る。
+    PDF を開けなければ空の dict を返す（全ページ Vision に回る）。
+    """
+    if stats is not None:
+        stats.update(pages=0, local=0, seconds=0.0, reasons={})
+    start = time.perf_counter()
+    results: Dict[int, str] = {}
+    try:
+        with pdfplumber.open(pdf_path) as pdf:
+            for number, page in enumerate(pdf.pages, start=1):
+                try:
+                    markdown, reason = read_text_layer(page)
+                finally:
+                    page.close()
+                if markdown:
+                    results[number] = markdown
+                if stats is not None:
+                    stats["pages"] += 1
+                    stats["reasons"][reason] = stats["reasons"].get(reason, 0) + 1
+    except Exception as e:
+        sys.stderr.write(f"Error reading PDF text layer: {e}\n")
+    if stats is not None:
+        stats["local"] = len(results)
+        stats["seconds"] = time.perf_counter() - start
+    return results
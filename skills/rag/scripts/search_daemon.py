@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+search_json.py の常駐検索デーモン。
+
+JSON・embedding・コーパスインデックスを一度だけ読み込んでメモリに保持し、
+localhost の HTTP で search_json.py と同じコマンドを受け付ける。
+ファイルは mtime とサイズで変更を検出し、変わったものだけを再読み込みする。
+search_json.py はデーモンが起動していれば自動でリクエストを転送する。
+
+Usage:
+    # デーモンを起動（フォアグラウンド。終了は Ctrl+C または stop）
+    uv run python skills/rag/scripts/search_daemon.py start [--dir database] [--port 0]
+
+    # 状態表示 / 停止
+    uv run python skills/rag/scripts/search_daemon.py status
+    uv run python skills/rag/scripts/search_daemon.py stop
+
+接続情報 (ポート・トークン) は .ucf_desktop/rag_daemon.json に書き出される。
+環境変数 UCF_RAG_DAEMON=0 または --no-daemon でデーモンを使わずに実行できる。
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import secrets
+import argparse
+import contextlib
+import urllib.request
+import urllib.error
+from pathlib import Path
+
+_PROJECT_ROOT = Path(__file__).resolve().parent.parent.parent.parent
+STATE_FILE = _PROJECT_ROOT / ".ucf_desktop" / "rag_daemon.json"
+
+# 接続先が見つからない場合はすぐにフォールバックし、実行中の検索は長めに待つ
+_CONNECT_TIMEOUT = 0.5
+_REQUEST_TIMEOUT = 300
+
+
+def _read_state() -> dict:
+    try:
+        with open(STATE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+
+def _request(state: dict, path: str, payload: dict = None, timeout: float = _REQUEST_TIMEOUT) -> dict:
+    url = f"http://127.0.0.1:{state['port']}{path}"
+    data = json.dumps(payload or {}, ensure_ascii=False).encode("utf-8")
+    req = urllib.request.Request(url, data=data, method="POST", headers={
+        "Content-Type": "application/json",
+        "X-UCF-Token": state.get("token", ""),
+    })
+    with urllib.request.urlopen(req, timeout=timeout) as resp:
+        return json.loads(resp.read().decode("utf-8"))
+
+
+def _ping(state: dict) -> dict:
+    return _request(state, "/status", timeout=_CONNECT_TIMEOUT)
+
+
+# ─── client ─────────────────────────────────────
+
+def run_remote(argv: list[str]):
+    """デーモンでコマンドを実行し、出力を書き出して終了コードを返す。
+
+    デーモンが起動していない・応答しない場合は None（呼び出し側がプロセス内で実行する）。
+    """
+    if os.environ.get("UCF_RAG_DAEMON", "1").lower() in ("0", "false", "off", "no"):
+        return None
+    state = _read_state()
+    if not state.get("port"):
+        return None
+    try:
+        _ping(state)
+    except Exception:
+        return None
+    try:
+        result = _request(state, "/run", {"argv": argv, "cwd": os.getcwd()})
+    except Exception as e:
+        sys.stderr.write(f"検索デーモンとの通信に失敗したためプロセス内で実行します: {e}\n")
+        return None
+    sys.stdout.write(result.get("stdout", ""))
+    sys.stderr.write(result.get("stderr", ""))
+    sys.stdout.flush()
+    return int(result.get("code", 0))
+
+
+# ─── server ─────────────────────────────────────
+
+def _execute(search_json, argv: list[str], cwd: str) -> dict:
+    """search_json.run() を実行し、標準出力・標準エラー・終了コードを返す。
+
+    リクエストは 1 件ずつ処理する（標準出力の差し替えと chdir はプロセス全体に効くため）。
+    """
+    out, err = io.StringIO(), io.StringIO()
+    code = 0
+    with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+        try:
+            os.chdir(cwd)
+            search_json.run(argv)
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+        except Exception as e:
+            print(f"エラー: {e}", file=sys.stderr)
+            code = 1
+    return {"stdout": out.getvalue(), "stderr": err.getvalue(), "code": code}
+
+
+def _warm_up(search_json, directory: str) -> None:
+    """起動時にページ JSON・embedding・コーパスインデックスを読み込んでおく。"""
+    base = Path(directory)
+    files = search_json.find_files(directory)
+    for f in files:
+        try:
+            if f.suffix == ".json":
+                search_json._read_json(f)
+                search_json._load_embedding_matrix(f)
+            else:
+                search_json._read_text(f)
+        except Exception:
+            continue
+    index = search_json._open_corpus_index(base)
+    if index is not None and index.rows:
+        index.matrix()
+    sys.stderr.write(f"[search-daemon] {len(files)} ファイルを読み込みました ({base})\n")
+
+
+def serve(directory: str, port: int = 0) -> None:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+    import search_json
+
+    state = _read_state()
+    if state.get("port"):
+        try:
+            _ping(state)
+            sys.stderr.write(f"検索デーモンは既に起動しています (pid {state.get('pid')}, port {state['port']})\n")
+            sys.exit(1)
+        except SystemExit:
+            raise
+        except Exception:
+            pass
+
+    _warm_up(search_json, directory)
+
+    token = secrets.token_hex(16)
+    started = time.time()
+    stats = {"requests": 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, body: dict, status: int = 200):
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            if self.headers.get("X-UCF-Token") != token:
+                self._reply({"error": "invalid token"}, 403)
+                return
+            length = int(self.headers.get("Content-Length", 0))
+            try:
+                payload = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError:
+                self._reply({"error": "invalid json"}, 400)
+                return
+
+            if self.path == "/status":
+                result_cache = search_json._get_result_cache()
+                self._reply({
+                    "pid": os.getpid(),
+                    "uptime": time.time() - started,
+                    "requests": stats["requests"],
+                    "cached_files": len(search_json._FILE_CACHE),
+                    "cached_embeddings": len(search_json._EMBEDDING_CACHE),
+                    "result_cache": result_cache.stats() if result_cache else None,
+                })
+            elif self.path == "/run":
+                stats["requests"] += 1
+                self._reply(_execute(search_json, list(payload.get("argv", [])),
+                                     payload.get("cwd") or str(_PROJECT_ROOT)))
+            elif self.path == "/stop":
+                self._reply({"stopping": True})
+                self.server.stopping = True
+            else:
+                self._reply({"error": "not found"}, 404)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", port), Handler)
+    server.stopping = False
+    STATE_FILE.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = STATE_FILE.with_name(STATE_FILE.name + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"pid": os.getpid(), "port": server.server_address[1], "token": token}, f)
+    os.replace(tmp_path, STATE_FILE)
+    sys.stderr.write(f"[search-daemon] http://127.0.0.1:{server.server_address[1]} で待機中 (pid {os.getpid()})\n")
+
+    try:
+        while not server.stopping:
+            server.handle_request()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        # 自分が書いた接続情報だけを消す
+        if _read_state().get("token") == token:
+            STATE_FILE.unlink(missing_ok=True)
+        sys.stderr.write("[search-daemon] 停止しました\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RAG 検索デーモン")
+    parser.add_argument("command", choices=["start", "stop", "status"], help="実行するコマンド")
+    parser.add_argument("--dir", default="database", help="起動時に読み込むディレクトリ (default: database)")
+    parser.add_argument("--port", type=int, default=0, help="待ち受けポート (default: 0 = 自動)")
+    args = parser.parse_args()
+
+    if args.command == "start":
+        serve(args.dir, args.port)
+        return
+
+    state = _read_state()
+    try:
+        status = _ping(state) if state.get("port") else None
+    except Exception:
+        status = None
+    if status is None:
+        print("検索デーモンは起動していません。")
+        return
+
+    if args.command == "stop":
+        _request(state, "/stop", timeout=_CONNECT_TIMEOUT)
+        print(f"検索デーモンを停止しました (pid {status['pid']})")
+    else:
+        print(f"検索デーモン: pid {status['pid']}, port {state['port']}, "
+              f"起動 {status['uptime']:.0f} 秒, リクエスト {status['requests']} 件, "
+              f"キャッシュ {status['cached_files']} ファイル / embedding {status['cached_embeddings']} 件")
+        rc = status.get("result_cache")
+        if rc:
+            print(f"検索結果キャッシュ: {rc['entries']} / {rc['max_entries']} 件, "
+                  f"ヒット {rc['hits']} / ミス {rc['misses']} (ヒット率 {rc['hit_rate']:.1%}), "
+                  f"追い出し {rc['evicted']} 件")
+
+
+if __name__ == "__main__":
+    main()
@@ -20,21 +20,42 @@ Usage:
     uv run python skills/rag/scripts/search_json.py read_file "path/to/file.md" [--dir database]
 
     # 全ファイルのサマリーからキーワードを抽出して一覧表示
-    uv run python skills/rag/scripts/search_json.py keywords [--dir database]
+    uv run python skills/rag/scripts/search_json.py keywords [--dir database] [--top 100] [--doc <file>]
 
     # セマンティック検索（embedding類似度による検索）
     uv run python skills/rag/scripts/search_json.py semantic "質問文" [--dir database] [--top-k 5]
 
     # ハイブリッド検索（セマンティック + キーワード検索の統合）
     uv run python skills/rag/scripts/search_json.py hybrid "質問文" [--dir database] [--top-k 5]
+
+    # パッセージ検索（質問に答える段落だけをページ番号・ファイルと一緒に返す。ページ全文より短い）
+    uv run python skills/rag/scripts/search_json.py passages "質問文" [--dir database] [--top-k 5] [--per-page 1]
+
+    # メタデータで候補を絞り込んでから検索（search / semantic / hybrid / passages 共通）
+    uv run python skills/rag/scripts/search_json.py hybrid "質問文" --page-type troubleshooting --doc r_h54xg_b
+
+    # 複数フォルダを 1 回で横断検索（フォルダごとに並列に検索し、スコアを揃えて上位 top-k に統合）
+    uv run python skills/rag/scripts/search_json.py hybrid "質問文" --dir database --dir path/to/other
+
+    # 近似最近傍 (IVF) インデックスを使う（大規模コーパス向け）
+    uv run python skills/rag/scripts/search_json.py semantic "質問文" --index ann [--nprobe 8] [--report-recall]
+
+    # int8 / PQ 量子化インデックスを使う（上位候補は float32 で再スコアリング）
+    uv run python skills/rag/scripts/search_json.py semantic "質問文" --index quantized [--rerank 50]
+
+常駐デーモン (search_daemon.py) が起動していれば、コマンドはデーモンに転送され
+読み込み済みのコーパスで実行される。起動していなければこのプロセス内で実行する。
 """
 
 import json
 import math
+import hashlib
 import os
-import re
+import time
 import sys
+import sqlite3
 import argparse
+import concurrent.futures
 from pathlib import Path
 
 # プロジェクトルートをパスに追加（pdf モジュールの参照用）
@@ -42,21 +63,92 @@ _PROJECT_ROOT = str(Path(__file__).resolve().parent.parent.parent.parent)
 if _PROJECT_ROOT not in sys.path:
     sys.path.insert(0, _PROJECT_ROOT)
 
-from dotenv import load_dotenv
-load_dotenv(Path(_PROJECT_ROOT) / ".env")
+from pdf.file_manager import is_derived_file, is_hidden_path
 
 SUPPORTED_EXTENSIONS = {".json", ".md", ".csv", ".txt"}
 
+# 読み込み済みファイルのキャッシュ {絶対パス: (mtime_ns, size, 内容)}。
+# 常駐デーモン (search_daemon.py) では変更されたファイルだけが再読み込みされる。
+_FILE_CACHE: dict = {}
+_EMBEDDING_CACHE: dict = {}
+_PASSAGE_CACHE: dict = {}
+_FACET_CACHE: dict = {}
+_FACET_INDEX_CACHE: dict = {}
+_INDEX_CACHE: dict = {}
+_openai_client = None
 
-def _load_embedding_model() -> str:
-    """config.json から embedding_model を読み取る。"""
+# 複数ルートの横断検索で同時に検索するルート数の上限
+_MAX_ROOT_WORKERS = 8
+
+# 検索結果の LRU キャッシュ（キーにコーパスの世代番号を含む。pdf.result_cache を参照）
+_result_cache = None
+# ルートごとのディレクトリ mtime の stamp {ルート: (計算した時刻, stamp)}。
+# キャッシュヒットを速く返すため、_TREE_STAMP_TTL 秒の間は計算し直さない
+_TREE_STAMPS: dict = {}
+_TREE_STAMP_TTL = 2.0
+
+# _partial_match_score 用のテキスト bigram 集合のキャッシュ
+_BIGRAM_CACHE: dict = {}
+_BIGRAM_CACHE_SIZE = 4096
+
+
+def _load_config() -> dict:
     config_path = Path(_PROJECT_ROOT) / ".ucf_desktop" / "config.json"
     try:
         with open(config_path, "r", encoding="utf-8") as f:
-            cfg = json.load(f)
-        return cfg.get("embedding_model", "text-embedding-3-small")
+            return json.load(f)
     except Exception:
-        return "text-embedding-3-small"
+        return {}
+
+
+def _load_embedding_model() -> str:
+    """config.json から embedding_model を読み取る。"""
+    return _load_config().get("embedding_model", "text-embedding-3-small")
+
+
+def _load_embedding_dimensions():
+    """config.json から embedding_dimensions を読み取る（未指定なら None = モデルの既定次元数）。"""
+    value = _load_config().get("embedding_dimensions")
+    return int(value) if value else None
+
+
+def _cached(cache: dict, path: Path, loader):
+    """mtime とサイズが変わっていなければキャッシュ済みの内容を返す。"""
+    key = str(path.resolve())
+    st = path.stat()
+    stamp = (st.st_mtime_ns, st.st_size)
+    hit = cache.get(key)
+    if hit is not None and hit[0] == stamp:
+        return hit[1]
+    value = loader(path)
+    cache[key] = (stamp, value)
+    return value
+
+
+def _read_text(f: Path) -> str:
+    def load(path):
+        with open(path, "r", encoding="utf-8") as fh:
+            return fh.read()
+    return _cached(_FILE_CACHE, f, load)
+
+
+def _read_json(f: Path):
+    """JSON ファイルを読み込む（キャッシュ付き、呼び出し側で内容を変更しないこと）。"""
+    def load(path):
+        with open(path, "r", encoding="utf-8") as fh:
+            return json.load(fh)
+    return _cached(_FILE_CACHE, f, load)
+
+
+def _get_openai_client():
+    """OpenAI クライアントを生成する（プロセス内で使い回す）。"""
+    global _openai_client
+    if _openai_client is None:
+        from dotenv import load_dotenv
+        from openai import OpenAI
+        load_dotenv(Path(_PROJECT_ROOT) / ".env")
+        _openai_client = OpenAI()
+    return _openai_client
 
 
 def find_files(directory: str, extensions: set = None) -> list[Path]:
@@ -68,9 +160,9 @@ def find_files(directory: str, extensions: set = None) -> list[Path]:
         return []
     files = []
     for f in sorted(base.rglob("*")):
-        if f.is_file() and f.suffix.lower() in extensions and not f.name.startswith("."):
-            # _embeddings.json は通常のJSON検索から除外
-            if f.name.endswith("_embeddings.json"):
+        if f.is_file() and f.suffix.lower() in extensions and not is_hidden_path(f, base):
+            # _embeddings.json などの派生ファイルは通常のJSON検索から除外
+            if is_derived_file(f):
                 continue
             files.append(f)
     return files
@@ -80,108 +172,226 @@ def find_json_files(directory: str) -> list[Path]:
     return find_files(directory, {".json"})
 
 
-# ─── keywords extraction ────────────────────────
+def _roots(directory) -> list[str]:
+    """検索対象ディレクトリ（文字列または複数指定のリスト）を重複のないルートのリストにする。"""
+    if isinstance(directory, (str, Path)):
+        directory = [directory]
+    roots, seen = [], set()
+    for d in directory:
+        key = str(Path(d).resolve())
+        if key not in seen:
+            seen.add(key)
+            roots.append(str(d))
+    return roots
 
-def _extract_keywords(text: str) -> list[str]:
-    """テキストから検索用キーワードを抽出する。
 
-    形態素解析器なしで動作するため、以下のパターンで抽出する:
-    1. 漢字熟語（2〜8文字の漢字連続）
-    2. カタカナ語（2文字以上）
-    3. 「お〜」で始まる和語（例: お手入れ）
-    4. 句読点区切りの短いフレーズ
+def _get_result_cache():
+    """検索結果キャッシュを返す（UCF_RESULT_CACHE=0 なら None）。"""
+    global _result_cache
+    from pdf.result_cache import ResultCache, result_cache_enabled
+
+    if not result_cache_enabled():
+        return None
+    if _result_cache is None:
+        _result_cache = ResultCache()
+    return _result_cache
+
+
+def _tree_stamp(directory: str) -> str:
+    """ルート配下のディレクトリ（隠しディレクトリを除く）の mtime のダイジェスト。
+
+    ツールを通さずにファイルが追加・削除・置き換え保存された場合（世代番号が進まない）も
+    キャッシュキーを変えるため。ファイルは stat せず、_TREE_STAMP_TTL 秒に 1 回だけ計算する。
     """
-    if not text:
+    now = time.monotonic()
+    hit = _TREE_STAMPS.get(directory)
+    if hit is not None and now - hit[0] < _TREE_STAMP_TTL:
+        return hit[1]
+    digest = hashlib.blake2b(digest_size=16)
+    for dirpath, dirnames, _ in os.walk(directory):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+        try:
+            mtime = os.stat(dirpath).st_mtime_ns
+        except OSError:
+            continue
+        digest.update(f"{dirpath}\0{mtime}\n".encode("utf-8", "surrogateescape"))
+    stamp = digest.hexdigest()
+    _TREE_STAMPS[directory] = (now, stamp)
+    return stamp
+
+
+def _cached_results(kind: str, query: str, roots: list[str], options: dict, compute) -> list[dict]:
+    """(コマンド, 正規化したクエリ, オプション, 各ルートの世代番号とディレクトリの stamp) で検索結果をキャッシュする。"""
+    from pdf.result_cache import corpus_generation
+
+    cache = _get_result_cache()
+    if cache is None:
+        return compute()
+    key = (
+        kind,
+        " ".join(query.split()),
+        tuple(str(Path(r).resolve()) for r in roots),
+        tuple(sorted(options.items())),
+        tuple(corpus_generation(Path(r)) for r in roots),
+        tuple(_tree_stamp(r) for r in roots),
+    )
+    hit = cache.get(key)
+    if hit is not None:
+        return [dict(r) for r in hit]
+    results = compute()
+    cache.put(key, [dict(r) for r in results])
+    return results
+
+
+def _sync_keyword_index(index, base: Path, json_files: list[Path]) -> None:
+    """キーワードインデックスを同期し、変更があればコーパスの世代番号を進める。"""
+    from pdf.result_cache import bump_corpus_generation
+
+    stats = index.sync(json_files)
+    if stats["updated"] or stats["removed"]:
+        bump_corpus_generation(base)
+
+
+def _scatter(fn, roots: list[str], *args, **kwargs) -> list:
+    """ルートごとの fn(root, *args, **kwargs) をワーカープールで並列に実行し、ルート順の結果を返す。"""
+    if len(roots) == 1:
+        return [fn(roots[0], *args, **kwargs)]
+    workers = min(len(roots), _MAX_ROOT_WORKERS)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(lambda root: fn(root, *args, **kwargs), roots))
+
+
+def _load_facet_index(directory: str, json_files: list[Path]):
+    """ルートのファセット索引を返す（ページ JSON が変わっていなければ構築済みのものを使い回す）。"""
+    from pdf.facets import FacetIndex, page_facets
+
+    def load(path):
+        data = _read_json(path)
+        return page_facets(data if isinstance(data, list) else [])
+
+    base = Path(directory)
+    stamp = []
+    for f in json_files:
+        st = f.stat()
+        stamp.append((str(f), st.st_mtime_ns, st.st_size))
+    key = str(base.resolve())
+    hit = _FACET_INDEX_CACHE.get(key)
+    if hit is not None and hit[0] == stamp:
+        return hit[1]
+    index = FacetIndex()
+    for f in json_files:
+        try:
+            facets = _cached(_FACET_CACHE, f, load)
+        except Exception:
+            continue
+        index.add_document(f.relative_to(base).as_posix(), facets)
+    _FACET_INDEX_CACHE[key] = (stamp, index)
+    return index
+
+
+def _facet_include(directory: str, json_files: list[Path], filters: dict):
+    """フィルタ式に一致するページを {相対パス: {ページ番号, ...}} で返す（フィルタがなければ None）。"""
+    if not filters:
+        return None
+    index = _load_facet_index(directory, json_files)
+    return index.allowed(index.select(filters))
+
+
+def _filter_text_files(directory: str, files: list[Path], filters: dict) -> list[Path]:
+    """md/csv/txt をフィルタ式で絞る（メタデータを持たないため page_type / section 指定時は対象外）。"""
+    if not filters:
+        return files
+    if "page_type" in filters or "section" in filters:
         return []
+    from pdf.facets import match_document
+
+    base = Path(directory)
+    return [f for f in files if match_document(f.relative_to(base).as_posix(), filters["doc"])]
 
-    keywords = set()
-
-    # 1. 漢字の連続（2〜8文字）— 日本語の技術用語の大半をカバー
-    for m in re.finditer(r'[\u4e00-\u9fff]{2,8}', text):
-        keywords.add(m.group())
-
-    # 2. カタカナの連続（2文字以上、長音記号を含む）
-    for m in re.finditer(r'[\u30a0-\u30ffー]{2,}', text):
-        keywords.add(m.group())
-
-    # 3. 「お」+ひらがな/漢字 パターン（例: お手入れ、おそうじ）
-    for m in re.finditer(r'お[\u3040-\u309f\u4e00-\u9fff]{2,6}', text):
-        kw = re.sub(r'[のがはをにでともやへ]+$', '', m.group())
-        if len(kw) >= 3:
-            keywords.add(kw)
-
-    # 4. 句読点・括弧で区切った短いフレーズ（漢字+かな混在の複合語を拾う）
-    for phrase in re.split(r'[。、．，「」（）【】\n・]', text):
-        phrase = phrase.strip()
-        # 短すぎる・長すぎるフレーズは除外
-        if 3 <= len(phrase) <= 12:
-            # ひらがなだけのフレーズは除外
-            if not re.search(r'[\u4e00-\u9fff\u30a0-\u30ff]', phrase):
-                continue
-            # 「この〜」「その〜」で始まるフレーズは除外
-            if re.match(r'^(この|その|あの|それ|これ|あれ)', phrase):
-                continue
-            keywords.add(phrase)
-
-    # 汎用すぎる語・文末表現を除外
-    stopwords = {
-        'されて', 'しています', 'ています', 'について', 'において',
-        'における', 'として', 'ために', 'それぞれ', 'これら',
-        'そのため', 'できます', 'ありません', 'ください', 'おります',
-        'このページ', 'されています', 'また', 'および', 'さらに',
-        'ただし', 'なお', 'ほか', 'ことが', 'ものが',
-        '説明', '記載', '案内', 'ページ',
-    }
-    keywords -= stopwords
 
-    return sorted(kw for kw in keywords if 2 <= len(kw) <= 12)
+def _included(include, rel: str, page) -> bool:
+    return include is None or page in include.get(rel, ())
 
 
-def cmd_keywords(directory: str):
-    """全ファイルのサマリーからキーワードを抽出し、ページごとに一覧表示する。
-    エージェントがこの一覧からクエリに最適なキーワードを選定して search に渡す。"""
+# ─── keywords ───────────────────────────────────
+
+def _keyword_documents(directory: str, files: list[Path]):
+    """キーワードカタログ (<dir>/.index/catalog/) と同期し、{相対パス: (種別, [(page, キーワード)])} を返す。
+
+    カタログを使えない場合はファイルから直接抽出する。
+    """
+    from pdf.keyword_catalog import KeywordCatalog, file_keywords
+
+    base = Path(directory)
+    catalog = KeywordCatalog(base)
+    try:
+        catalog.sync(files)
+        kinds = catalog.documents()
+        return {
+            rel: (kinds[rel], catalog.page_keywords(rel))
+            for rel in (f.relative_to(base).as_posix() for f in files) if kinds.get(rel)
+        }, catalog
+    except (sqlite3.Error, OSError):
+        catalog.close()
+        documents = {}
+        for f in files:
+            kind, rows = file_keywords(f)
+            if kind:
+                documents[f.relative_to(base).as_posix()] = (kind, rows)
+        return documents, None
+
+
+def cmd_keywords(directory: str, top: int = None, docs: list[str] = None):
+    """全ファイルのサマリーから抽出したキーワードを、ページごとに一覧表示する。
+    エージェントがこの一覧からクエリに最適なキーワードを選定して search に渡す。
+
+    top を指定すると出現ページ数の多い順に上位 top 件だけを表示する。
+    docs（ファイル名・相対パス・フォルダ）で対象ファイルを絞り込める。
+    """
+    from pdf.facets import match_document
+    from pdf.keyword_catalog import rank_terms
+
     files = find_files(directory)
     if not files:
         print("対応ファイルが見つかりません。")
         return
 
-    base = Path(directory)
-    total_keywords = set()
-
-    for f in files:
-        if f.suffix == ".json":
-            try:
-                with open(f, "r", encoding="utf-8") as fh:
-                    data = json.load(fh)
-            except Exception:
-                continue
-            if not isinstance(data, list):
-                continue
+    documents, catalog = _keyword_documents(directory, files)
+    try:
+        if docs:
+            documents = {rel: doc for rel, doc in documents.items() if match_document(rel, docs)}
+            if not documents:
+                print(f"一致するファイルがありません: {', '.join(docs)}")
+                return
+
+        if top:
+            if catalog is not None and not docs:
+                terms = catalog.top_terms(top)
+                total = catalog.term_count()
+            else:
+                ranked = rank_terms([kws for _, kws in rows] for _, rows in documents.values())
+                terms, total = ranked[:top], len(ranked)
+            print(f"=== 上位 {len(terms)} キーワード（出現ページ数順） ===")
+            for kw, pages, nfiles in terms:
+                print(f"  {kw} ({pages} ページ / {nfiles} ファイル)")
+            print()
+            print(f"--- 全キーワード数: {total} ---")
+            return
+    finally:
+        if catalog is not None:
+            catalog.close()
 
-            rel = f.relative_to(base)
+    total_keywords = set()
+    for rel, (kind, rows) in documents.items():
+        if kind == "pages":
             print(f"=== {rel} ===")
-            for entry in data:
-                summary = entry.get("summary", "")
-                page = entry.get("page", "?")
-
-                # metadataのkeywordsがあればそれも含める
-                metadata = entry.get("metadata", {})
-                meta_kws = metadata.get("keywords", [])
-
-                kws = _extract_keywords(summary)
-                all_kws = sorted(set(kws) | set(meta_kws))
-                total_keywords.update(all_kws)
-                if all_kws:
-                    print(f"  Page {page}: {', '.join(all_kws)}")
+            for page, kws in rows:
+                total_keywords.update(kws)
+                if kws:
+                    print(f"  Page {page}: {', '.join(kws)}")
             print()
         else:
-            try:
-                with open(f, "r", encoding="utf-8") as fh:
-                    content = fh.read(1000)
-            except Exception:
-                continue
-            rel = f.relative_to(base)
-            kws = _extract_keywords(content)
+            kws = rows[0][1] if rows else []
             total_keywords.update(kws)
             if kws:
                 print(f"=== {rel} ===")
@@ -208,16 +418,15 @@ def cmd_list(directory: str):
     base = Path(directory)
 
     if json_files:
+        from pdf.embedding_store import has_embeddings
         print(f"=== JSON ファイル ({len(json_files)} 件) ===\n")
         for f in json_files:
             try:
-                with open(f, "r", encoding="utf-8") as fh:
-                    data = json.load(fh)
+                data = _read_json(f)
                 page_count = len(data) if isinstance(data, list) else 0
                 rel = f.relative_to(base)
-                # embeddingの有無を確認
-                emb_path = f.parent / f"{f.stem}_embeddings.json"
-                emb_marker = " [embedding有]" if emb_path.exists() else ""
+                # embeddingの有無を確認（バイナリストア / 旧 JSON 形式）
+                emb_marker = " [embedding有]" if has_embeddings(f) else ""
                 print(f"  {rel}  ({page_count} ページ){emb_marker}")
             except Exception as e:
                 print(f"  {f.name}  (読み込みエラー: {e})")
@@ -280,22 +489,46 @@ def _score_keyword_match(text: str, terms: list[str]) -> float:
     return min(total_score / max_possible, 1.0)
 
 
+def _text_bigrams(text: str) -> set:
+    """テキストの文字 bigram 集合（同じテキストはプロセス内で使い回す）。"""
+    grams = _BIGRAM_CACHE.get(text)
+    if grams is None:
+        if len(_BIGRAM_CACHE) >= _BIGRAM_CACHE_SIZE:
+            _BIGRAM_CACHE.clear()
+        grams = {text[i:i + 2] for i in range(len(text) - 1)}
+        _BIGRAM_CACHE[text] = grams
+    return grams
+
+
 def _partial_match_score(text: str, term: str) -> float:
-    """部分一致スコアを計算する（サブストリング検索）。"""
-    if len(term) < 2:
+    """部分一致スコアを計算する（term の部分文字列のうち text に含まれる最長のものの長さ比）。
+
+    長さ n の部分文字列が含まれるなら n-1 も含まれるため、長さを二分探索する。
+    text の bigram 集合に含まれない bigram を持つ部分文字列は検索せずに除外する。
+    """
+    length = len(term)
+    if length < 2:
         return 0.0
 
-    best = 0.0
-    for n in range(len(term), 1, -1):
-        for start in range(len(term) - n + 1):
-            sub = term[start:start + n]
-            if sub in text:
-                ratio = n / len(term)
-                best = max(best, ratio)
-                break
-        if best > 0:
-            break
-    return best
+    grams = _text_bigrams(text)
+    present = [term[i:i + 2] in grams for i in range(length - 1)]
+
+    def found(n: int) -> bool:
+        for start in range(length - n + 1):
+            if all(present[start:start + n - 1]) and term[start:start + n] in text:
+                return True
+        return False
+
+    if not any(present):
+        return 0.0
+    lo, hi = 2, length
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if found(mid):
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo / length
 
 
 # ─── search ─────────────────────────────────────
@@ -304,8 +537,7 @@ def _search_json_file(f: Path, terms: list[str]) -> list[dict]:
     """JSON ファイル内を検索する。"""
     results = []
     try:
-        with open(f, "r", encoding="utf-8") as fh:
-            data = json.load(fh)
+        data = _read_json(f)
     except Exception:
         return results
 
@@ -318,34 +550,80 @@ def _search_json_file(f: Path, terms: list[str]) -> list[dict]:
         text = summary + " " + content
 
         if all(term in text for term in terms):
-            # スコアを計算
-            summary_score = _score_keyword_match(entry.get("summary", ""), terms)
-            content_score = _score_keyword_match(entry.get("content", ""), terms)
-
             metadata = entry.get("metadata", {})
             meta_text = " ".join(metadata.get("keywords", []) + metadata.get("topics", []))
-            meta_score = _score_keyword_match(meta_text, terms) if meta_text else 0.0
+            results.append(_json_page_result(
+                f, entry.get("page", "?"), entry.get("summary", ""),
+                entry.get("content", ""), meta_text, terms,
+            ))
+    return results
 
-            combined_score = summary_score * 0.4 + content_score * 0.3 + meta_score * 0.3
 
-            hit_in_summary = all(term in summary for term in terms)
-            results.append({
-                "file": str(f),
-                "type": "json",
-                "page": entry.get("page", "?"),
-                "summary": entry.get("summary", ""),
-                "hit_in_summary": hit_in_summary,
-                "score": round(combined_score, 4),
-            })
-    return results
+def _json_page_result(f: Path, page, summary: str, content: str, meta_text: str,
+                      terms: list[str], score: float = None) -> dict:
+    """キーワードにヒットした JSON ページの結果を作る。
+
+    score を渡さない場合（インデックスを使わない走査時）は _score_keyword_match で計算する。
+    """
+    if score is None:
+        summary_score = _score_keyword_match(summary, terms)
+        content_score = _score_keyword_match(content, terms)
+        meta_score = _score_keyword_match(meta_text, terms) if meta_text else 0.0
+        score = summary_score * 0.4 + content_score * 0.3 + meta_score * 0.3
+
+    summary_lower = summary.lower()
+    return {
+        "file": str(f),
+        "type": "json",
+        "page": page,
+        "summary": summary,
+        "hit_in_summary": all(term in summary_lower for term in terms),
+        "score": round(score, 4),
+    }
+
+
+def _search_json_files(directory: str, json_files: list[Path], terms: list[str],
+                       corpus: dict = None, include: dict = None) -> list[dict]:
+    """JSON ファイル群をキーワード検索する。
+
+    <dir>/.index/keywords/ の転置インデックスを変更分だけ更新してから候補ページを引き、
+    スコアはインデックスの統計（横断検索では corpus に渡した全ルートの統計）による BM25F で付ける。
+    インデックスが使えない場合は全ファイルを走査する。結果はファイル順・ページ順。
+    include（ファセットの絞り込み結果）を渡すと、そのページだけを検証・スコアリングする。
+    """
+    from pdf.keyword_index import KeywordIndex
+
+    base = Path(directory)
+    index = KeywordIndex(base)
+    try:
+        _sync_keyword_index(index, base, json_files)
+        hits = index.search(terms, corpus=corpus, include=include)
+    except Exception as e:
+        sys.stderr.write(f"キーワードインデックスを使用できません: {e}\n")
+        results = []
+        for f in json_files:
+            rel = f.relative_to(base).as_posix()
+            if include is None or rel in include:
+                results.extend(r for r in _search_json_file(f, terms) if _included(include, rel, r["page"]))
+        return results
+    finally:
+        index.close()
+
+    order = {f.relative_to(base).as_posix(): i for i, f in enumerate(json_files)}
+    hits = [h for h in hits if h["path"] in order]
+    hits.sort(key=lambda h: (order[h["path"]], h["ord"]))
+    return [
+        _json_page_result(json_files[order[h["path"]]], h["page"], h["summary"],
+                          h["content"], h["meta"], terms, score=h["score"])
+        for h in hits
+    ]
 
 
 def _search_text_file(f: Path, terms: list[str]) -> list[dict]:
     """テキストファイル（md/csv/txt）内を検索する。"""
     results = []
     try:
-        with open(f, "r", encoding="utf-8") as fh:
-            content = fh.read()
+        content = _read_text(f)
     except Exception:
         return results
 
@@ -373,29 +651,82 @@ def _search_text_file(f: Path, terms: list[str]) -> list[dict]:
     return results
 
 
-def cmd_search(keywords: str, directory: str):
-    """全ファイルからキーワード検索する。"""
+def _keyword_query_stats(directory: str, terms: list[str], index_cls=None):
+    """ルートのキーワードインデックスを同期し、検索語の統計 (query_stats) を返す。使えなければ None。
+
+    index_cls に KeywordIndex のサブクラス（PassageIndex など）を渡すとそのインデックスを使う。
+    """
+    from pdf.keyword_index import KeywordIndex
+
+    index = (index_cls or KeywordIndex)(Path(directory))
+    try:
+        _sync_keyword_index(index, Path(directory), find_files(directory, {".json"}))
+        return index.query_stats(terms)
+    except Exception:
+        return None
+    finally:
+        index.close()
+
+
+def _global_keyword_stats(roots: list[str], terms: list[str], index_cls=None):
+    """全ルートの BM25F 統計を合算する（1 ルートなら None = そのインデックスの統計を使う）。"""
+    if len(roots) < 2:
+        return None
+    from pdf.keyword_index import merge_query_stats
+
+    stats = [s for s in _scatter(_keyword_query_stats, roots, terms, index_cls) if s is not None]
+    return merge_query_stats(stats) if stats else None
+
+
+def _keyword_search_root(directory: str, terms: list[str], corpus: dict = None,
+                         filters: dict = None) -> list[dict]:
     files = find_files(directory)
-    if not files:
-        print("対応ファイルが見つかりません。")
-        return
+    json_files = [f for f in files if f.suffix == ".json"]
+    include = _facet_include(directory, json_files, filters)
+    results = _search_json_files(directory, json_files, terms, corpus, include)
+    for f in _filter_text_files(directory, [f for f in files if f.suffix != ".json"], filters):
+        results.extend(_search_text_file(f, terms))
+
+    # スコア降順でソート（同点はファイル順）
+    file_order = {str(f): i for i, f in enumerate(files)}
+    results.sort(key=lambda r: (-r.get("score", 0), file_order[r["file"]]))
+    return results
+
+
+def keyword_search(keywords: str, directory, filters: dict = None) -> list[dict]:
+    """全ファイルからキーワード検索し、スコア降順の結果を返す。
+
+    directory にリストを渡すと各ルートを並列に検索し、全ルート共通の統計でスコアを付けて統合する。
+    filters（pdf.facets.parse_filters の結果）を渡すと、一致するページだけを検索する。
+    """
+    from pdf.facets import filters_key
 
     terms = keywords.lower().split()
-    results = []
+    roots = _roots(directory)
+
+    def compute():
+        corpus = _global_keyword_stats(roots, terms)
+        results = [r for found in _scatter(_keyword_search_root, roots, terms, corpus, filters)
+                   for r in found]
+        # 同点はルート順・ファイル順（安定ソート）
+        results.sort(key=lambda r: -r.get("score", 0))
+        return results
+
+    options = {"filters": filters_key(filters)} if filters else {}
+    return _cached_results("search", keywords.lower(), roots, options, compute)
 
-    for f in files:
-        if f.suffix == ".json":
-            results.extend(_search_json_file(f, terms))
-        else:
-            results.extend(_search_text_file(f, terms))
 
+def cmd_search(keywords: str, directory, filters: dict = None):
+    """全ファイルからキーワード検索する。"""
+    if not any(find_files(d) for d in _roots(directory)):
+        print("対応ファイルが見つかりません。")
+        return
+
+    results = keyword_search(keywords, directory, filters)
     if not results:
         print(f"「{keywords}」に一致するファイルが見つかりませんでした。")
         return
 
-    # スコア降順でソート
-    results.sort(key=lambda r: -r.get("score", 0))
-
     print(f"「{keywords}」の検索結果: {len(results)} 件\n")
     for r in results:
         loc = "summary" if r.get("hit_in_summary") else "content"
@@ -410,50 +741,249 @@ def cmd_search(keywords: str, directory: str):
 
 # ─── semantic search ─────────────────────────────
 
-def cmd_semantic_search(query: str, directory: str, top_k: int = 5):
-    """セマンティック検索（embedding類似度による検索）。"""
-    from openai import OpenAI
-    from pdf.embeddings import embed_query, semantic_search
+def _load_embedding_matrix(f: Path):
+    """JSON ファイルに対応する embedding を正規化済み行列として読み込む。
 
-    client = OpenAI()
-    emb_model = _load_embedding_model()
-    query_embedding = embed_query(client, query, model=emb_model)
+    バイナリストア (.npy, メモリマップ) を優先し、なければ *_embeddings.json を読む。
+    """
+    from pdf.embedding_store import load_embedding_matrix, embeddings_mtime
+
+    stamp = embeddings_mtime(f)
+    if stamp is None:
+        return None
+    key = str(f.resolve())
+    hit = _EMBEDDING_CACHE.get(key)
+    if hit is not None and hit[0] == stamp:
+        return hit[1]
+    matrix = load_embedding_matrix(f)
+    _EMBEDDING_CACHE[key] = (stamp, matrix)
+    return matrix
+
+
+def _load_summary_map(f: Path) -> dict:
+    """JSON ファイルの {page: summary} マップを構築する。"""
+    try:
+        main_data = _read_json(f)
+        return {p["page"]: p.get("summary", "") for p in main_data}
+    except Exception:
+        return {}
 
-    base = Path(directory)
-    json_files = find_files(directory, {".json"})
-    all_results = []
 
-    for f in json_files:
-        emb_path = f.parent / f"{f.stem}_embeddings.json"
-        if not emb_path.exists():
+def _fill_summaries(results: list[dict]) -> None:
+    """結果に summary を補完する（上位の結果のファイルだけを読む）。"""
+    cache = {}
+    for r in results:
+        if r.get("summary") is not None:
             continue
-
+        if r["file"] not in cache:
+            cache[r["file"]] = _load_summary_map(Path(r["file"]))
+        r["summary"] = cache[r["file"]].get(r["page"], "")
+
+
+def _semantic_page_scores(query_embedding, directory: str, json_files: list[Path],
+                          top_k: int = None, index_mode: str = "exact",
+                          nprobe: int = None, ann_stats: dict = None,
+                          rerank: int = None, include: dict = None) -> list[tuple]:
+    """ページごとのセマンティックスコア [(file, page, score), ...] を返す。
+
+    <dir>/.index/vectors/ のコーパスインデックスが最新のドキュメントは 1 回の行列スキャンで、
+    インデックス未登録・更新済みのドキュメントだけ個別の embedding ファイルから計算する。
+    top_k を指定するとソースごとに上位 top_k 件だけを返す。
+
+    index_mode="ann" の場合は <dir>/.index/ann/ の IVF インデックスで探索クラスタを絞る。
+    ann_stats を渡すと、探索行数や厳密検索に対する recall をそこに記録する。
+    index_mode="quantized" の場合は <dir>/.index/quantized/ の int8/PQ コードで近似スコアを
+    計算し、上位 rerank 件を float32 で再スコアリングする。
+    include（ファセットの絞り込み結果 {相対パス: {ページ番号, ...}}）を渡すと、
+    そのページの行だけをスコアリングする。
+    """
+    base = Path(directory)
+    scored = []
+    if include is not None:
+        json_files = [f for f in json_files if f.relative_to(base).as_posix() in include]
+    stale_files = json_files
+    index = _open_corpus_index(base)
+    if index is not None:
         try:
-            with open(emb_path, "r", encoding="utf-8") as fh:
-                emb_data = json.load(fh)
-        except Exception:
+            fresh, stale_files = index.partition(json_files)
+            if include is not None:
+                fresh = {rel: include[rel] for rel in fresh}
+            if fresh:
+                searcher = index
+                kwargs = {}
+                if index_mode == "ann":
+                    searcher = _open_ann(index, nprobe, kwargs, ann_stats)
+                elif index_mode == "quantized":
+                    searcher = _open_quantized(index, rerank, kwargs)
+                if top_k is None:
+                    hits = searcher.all_scores(query_embedding, include=fresh, **kwargs)
+                else:
+                    found = searcher.search(query_embedding, top_k, include=fresh, **kwargs)
+                    hits = [(r["path"], r["page"], r["score"]) for r in found]
+                    if ann_stats is not None and searcher is not index:
+                        from pdf.ann_index import recall_at_k
+                        exact = index.search(query_embedding, top_k, include=fresh)
+                        ann_stats["recall"] = recall_at_k(found, exact)
+                scored.extend((str(base / rel), page, score) for rel, page, score in hits)
+        except Exception as e:
+            sys.stderr.write(f"コーパスインデックスを使用できません: {e}\n")
+            scored, stale_files = [], json_files
+    elif index_mode != "exact":
+        sys.stderr.write("コーパスインデックスがないため厳密検索で実行します。"
+                         "(uv run python -m pdf.migration --dir <dir> --build-index で作成)\n")
+
+    for f in stale_files:
+        matrix = _load_embedding_matrix(f)
+        if matrix is None or len(matrix) == 0:
             continue
+        if include is not None:
+            pages = include[f.relative_to(base).as_posix()]
+            scores = matrix.scores(query_embedding)
+            hits = [(str(f), page, score) for page, score in zip(matrix.page_numbers, scores.tolist())
+                    if page in pages]
+            hits.sort(key=lambda h: -h[2])
+            scored.extend(hits if top_k is None else hits[:top_k])
+        elif top_k is None:
+            scores = matrix.scores(query_embedding)
+            scored.extend((str(f), page, score)
+                          for page, score in zip(matrix.page_numbers, scores.tolist()))
+        else:
+            scored.extend((str(f), r["page"], r["score"])
+                          for r in matrix.search(query_embedding, top_k=top_k))
+    return scored
 
-        # サマリーマップを構築
-        try:
-            with open(f, "r", encoding="utf-8") as fh:
-                main_data = json.load(fh)
-            summary_map = {p["page"]: p.get("summary", "") for p in main_data}
-        except Exception:
-            summary_map = {}
-
-        results = semantic_search(query_embedding, emb_data, top_k=top_k)
-        for r in results:
-            all_results.append({
-                "file": str(f),
-                "type": "json",
-                "page": r["page"],
-                "summary": summary_map.get(r["page"], ""),
-                "score": round(r["score"], 4),
-            })
 
-    all_results.sort(key=lambda x: -x["score"])
-    all_results = all_results[:top_k]
+def _open_corpus_index(base: Path):
+    """コーパスインデックスを開く（manifest が変わっていなければ開いたものを使い回す）。"""
+    from pdf.corpus_index import CorpusIndex
+
+    index = CorpusIndex(base)
+    try:
+        st = index.manifest_path.stat()
+    except OSError:
+        return None
+    key = str(base.resolve())
+    stamp = (st.st_mtime_ns, st.st_size)
+    hit = _INDEX_CACHE.get(key)
+    if hit is not None and hit[0] == stamp:
+        return hit[1]
+    _INDEX_CACHE[key] = (stamp, index)
+    return index
+
+
+def _open_ann(index, nprobe: int, kwargs: dict, ann_stats: dict = None):
+    """ANN インデックスを開き、使えなければコーパスインデックス（厳密検索）を返す。"""
+    from pdf.ann_index import IVFIndex, DEFAULT_NPROBE
+
+    ann = IVFIndex(index)
+    if not ann.is_compatible():
+        sys.stderr.write("ANN インデックスがない（または古い）ため厳密検索で実行します。"
+                         "(uv run python -m pdf.migration --dir <dir> --build-ann で作成)\n")
+        return index
+    kwargs["nprobe"] = nprobe or DEFAULT_NPROBE
+    if ann_stats is not None:
+        ann_stats["nlist"] = ann.nlist
+        ann_stats["nprobe"] = kwargs["nprobe"]
+        ann_stats["total_rows"] = index.rows
+    return ann
+
+
+def _open_quantized(index, rerank: int, kwargs: dict):
+    """量子化インデックスを開き、使えなければコーパスインデックス（厳密検索）を返す。"""
+    from pdf.quantization import QuantizedIndex, DEFAULT_RERANK
+
+    quantized = QuantizedIndex(index)
+    if not quantized.is_compatible():
+        sys.stderr.write("量子化インデックスがない（または古い）ため厳密検索で実行します。"
+                         "(uv run python -m pdf.migration --dir <dir> --quantize int8 で作成)\n")
+        return index
+    kwargs["rerank"] = DEFAULT_RERANK if rerank is None else rerank
+    return quantized
+
+
+def _print_ann_stats(ann_stats: dict, top_k: int) -> None:
+    """ANN 検索の探索量と recall を表示する。"""
+    if not ann_stats.get("nlist"):
+        return
+    line = f"[ANN] nlist={ann_stats['nlist']} nprobe={ann_stats['nprobe']} 全{ann_stats['total_rows']}行"
+    if "recall" in ann_stats:
+        line += f" | recall@{top_k} (厳密検索比) = {ann_stats['recall']:.2f}"
+    print(line)
+
+
+def _embed_query(query: str):
+    from pdf.embeddings import embed_query
+    from pdf.local_embeddings import is_local_model
+    model = _load_embedding_model()
+    client = None if is_local_model(model) else _get_openai_client()
+    return embed_query(client, query, model=model, dimensions=_load_embedding_dimensions())
+
+
+def _semantic_search_root(directory: str, query_embedding, top_k: int, filters: dict = None,
+                          **options) -> list[dict]:
+    json_files = find_files(directory, {".json"})
+    include = _facet_include(directory, json_files, filters)
+    results = [
+        {
+            "file": file,
+            "type": "json",
+            "page": page,
+            "summary": None,
+            "score": round(score, 4),
+        }
+        for file, page, score in _semantic_page_scores(
+            query_embedding, directory, json_files, top_k, include=include, **options,
+        )
+    ]
+    results.sort(key=lambda x: -x["score"])
+    return results[:top_k]
+
+
+def semantic_search(query: str, directory, top_k: int = 5,
+                    index_mode: str = "exact", nprobe: int = None,
+                    rerank: int = None, ann_stats: dict = None,
+                    filters: dict = None) -> list[dict]:
+    """セマンティック検索を行い、スコア降順の上位 top_k 件を返す。
+
+    directory にリストを渡すと各ルートの上位 top_k 件を並列に求め、コサイン類似度で統合する。
+    filters を渡すと、一致するページだけをスコアリングする。
+    """
+    from pdf.facets import filters_key
+
+    roots = _roots(directory)
+
+    def compute():
+        query_embedding = _embed_query(query)
+        all_results = [
+            r for found in _scatter(
+                _semantic_search_root, roots, query_embedding, top_k, filters,
+                index_mode=index_mode, nprobe=nprobe, rerank=rerank,
+                # recall の計測はルートごとの値になるため 1 ルートのときだけ行う
+                ann_stats=ann_stats if len(roots) == 1 else None,
+            )
+            for r in found
+        ]
+        all_results.sort(key=lambda x: -x["score"])
+        all_results = all_results[:top_k]
+        _fill_summaries(all_results)
+        return all_results
+
+    if ann_stats is not None:
+        # recall の計測は毎回実行する
+        return compute()
+    options = {"top_k": top_k, "index": index_mode, "nprobe": nprobe, "rerank": rerank,
+               "model": _load_embedding_model(), "dimensions": _load_embedding_dimensions(),
+               "filters": filters_key(filters)}
+    return _cached_results("semantic", query, roots, options, compute)
+
+
+def cmd_semantic_search(query: str, directory, top_k: int = 5,
+                        index_mode: str = "exact", nprobe: int = None,
+                        report_recall: bool = False, rerank: int = None, filters: dict = None):
+    """セマンティック検索（embedding類似度による検索）。"""
+    ann_stats = {} if report_recall else None
+    all_results = semantic_search(query, directory, top_k, index_mode=index_mode,
+                                  nprobe=nprobe, rerank=rerank, ann_stats=ann_stats, filters=filters)
 
     if not all_results:
         print(f"「{query}」に一致するページが見つかりませんでした。")
@@ -465,67 +995,41 @@ def cmd_semantic_search(query: str, directory: str, top_k: int = 5):
         print(f"  [score: {r['score']:.4f}] {r['file']} - Page {r['page']}")
         print(f"    抜粋: {r['summary'][:200]}")
         print()
+    if ann_stats:
+        _print_ann_stats(ann_stats, top_k)
 
 
 # ─── hybrid search ───────────────────────────────
 
-def cmd_hybrid_search(query: str, directory: str, top_k: int = 5,
-                      semantic_weight: float = 0.6, keyword_weight: float = 0.4):
-    """ハイブリッド検索（セマンティック + キーワード検索の統合）。"""
-    from openai import OpenAI
-    from pdf.embeddings import embed_query, cosine_similarity
-
-    client = OpenAI()
-    emb_model = _load_embedding_model()
-
-    terms = query.lower().split()
+def _hybrid_search_root(directory: str, terms: list[str], query_embedding, top_k: int,
+                        semantic_weight: float, keyword_weight: float, corpus: dict = None,
+                        index_mode: str = "exact", nprobe: int = None, rerank: int = None,
+                        filters: dict = None) -> list[dict]:
     json_files = find_files(directory, {".json"})
+    include = _facet_include(directory, json_files, filters)
 
     # 全ページのスコアを集約
     page_scores = {}  # key: (file, page) -> {summary, semantic, keyword}
 
     # 1. キーワード検索
-    for f in json_files:
-        keyword_results = _search_json_file(f, terms)
-        for r in keyword_results:
-            key = (r["file"], r["page"])
-            if key not in page_scores:
-                page_scores[key] = {"summary": r["summary"], "semantic": 0.0, "keyword": 0.0}
-            page_scores[key]["keyword"] = r.get("score", 0.0)
+    for r in _search_json_files(directory, json_files, terms, corpus, include):
+        key = (r["file"], r["page"])
+        if key not in page_scores:
+            page_scores[key] = {"summary": r["summary"], "semantic": 0.0, "keyword": 0.0}
+        page_scores[key]["keyword"] = r.get("score", 0.0)
 
     # 2. セマンティック検索
-    query_embedding = embed_query(client, query, model=emb_model)
-    for f in json_files:
-        emb_path = f.parent / f"{f.stem}_embeddings.json"
-        if not emb_path.exists():
-            continue
-
-        try:
-            with open(emb_path, "r", encoding="utf-8") as fh:
-                emb_data = json.load(fh)
-        except Exception:
-            continue
-
-        try:
-            with open(f, "r", encoding="utf-8") as fh:
-                main_data = json.load(fh)
-            summary_map = {p["page"]: p.get("summary", "") for p in main_data}
-        except Exception:
-            summary_map = {}
-
-        for page_entry in emb_data.get("pages", []):
-            score = cosine_similarity(query_embedding, page_entry["embedding"])
-            key = (str(f), page_entry["page"])
-            if key not in page_scores:
-                page_scores[key] = {
-                    "summary": summary_map.get(page_entry["page"], ""),
-                    "semantic": 0.0,
-                    "keyword": 0.0,
-                }
-            page_scores[key]["semantic"] = score
+    for file, page, score in _semantic_page_scores(query_embedding, directory, json_files,
+                                                   index_mode=index_mode, nprobe=nprobe,
+                                                   rerank=rerank, include=include):
+        key = (file, page)
+        if key not in page_scores:
+            page_scores[key] = {"summary": None, "semantic": 0.0, "keyword": 0.0}
+        page_scores[key]["semantic"] = score
 
     # 3. テキストファイルのキーワード検索も統合
-    text_files = [f for f in find_files(directory) if f.suffix != ".json"]
+    text_files = _filter_text_files(directory, [f for f in find_files(directory) if f.suffix != ".json"],
+                                    filters)
     for f in text_files:
         text_results = _search_text_file(f, terms)
         for r in text_results:
@@ -549,7 +1053,55 @@ def cmd_hybrid_search(query: str, directory: str, top_k: int = 5,
             })
 
     results.sort(key=lambda x: -x["score"])
-    results = results[:top_k]
+    return results[:top_k]
+
+
+def hybrid_search(query: str, directory, top_k: int = 5,
+                  semantic_weight: float = 0.6, keyword_weight: float = 0.4,
+                  index_mode: str = "exact", nprobe: int = None, rerank: int = None,
+                  filters: dict = None) -> list[dict]:
+    """ハイブリッド検索を行い、統合スコア降順の上位 top_k 件を返す。
+
+    directory にリストを渡すと各ルートを並列に検索して統合する。キーワードスコアは
+    全ルート共通の統計による BM25F、セマンティックスコアはコサイン類似度のため、
+    ルートごとの上位 top_k 件を統合スコアで並べ直せば全体の上位 top_k 件になる。
+    filters を渡すと、一致するページだけをスコアリングする。
+    """
+    from pdf.facets import filters_key
+
+    terms = query.lower().split()
+    roots = _roots(directory)
+
+    def compute():
+        corpus = _global_keyword_stats(roots, terms)
+        query_embedding = _embed_query(query)
+        results = [
+            r for found in _scatter(
+                _hybrid_search_root, roots, terms, query_embedding, top_k,
+                semantic_weight, keyword_weight, corpus,
+                index_mode=index_mode, nprobe=nprobe, rerank=rerank, filters=filters,
+            )
+            for r in found
+        ]
+        results.sort(key=lambda x: -x["score"])
+        results = results[:top_k]
+        _fill_summaries(results)
+        return results
+
+    options = {"top_k": top_k, "semantic_weight": semantic_weight, "keyword_weight": keyword_weight,
+               "index": index_mode, "nprobe": nprobe, "rerank": rerank,
+               "model": _load_embedding_model(), "dimensions": _load_embedding_dimensions(),
+               "filters": filters_key(filters)}
+    return _cached_results("hybrid", query, roots, options, compute)
+
+
+def cmd_hybrid_search(query: str, directory, top_k: int = 5,
+                      semantic_weight: float = 0.6, keyword_weight: float = 0.4,
+                      index_mode: str = "exact", nprobe: int = None, rerank: int = None,
+                      filters: dict = None):
+    """ハイブリッド検索（セマンティック + キーワード検索の統合）。"""
+    results = hybrid_search(query, directory, top_k, semantic_weight, keyword_weight,
+                            index_mode=index_mode, nprobe=nprobe, rerank=rerank, filters=filters)
 
     if not results:
         print(f"「{query}」に一致するページが見つかりませんでした。")
@@ -562,105 +1114,366 @@ def cmd_hybrid_search(query: str, directory: str, top_k: int = 5,
         print()
 
 
+# ─── passage search ──────────────────────────────
+
+def _load_passages(f: Path) -> list:
+    """ページ JSON のパッセージ分割 [(page, ページ内の番号, 本文), ...]（キャッシュ付き）。"""
+    from pdf.passages import page_passages
+
+    def load(path):
+        data = _read_json(path)
+        return page_passages(data if isinstance(data, list) else [])
+    try:
+        return _cached(_PASSAGE_CACHE, f, load)
+    except Exception:
+        return []
+
+
+def _load_passage_matrix(f: Path):
+    """JSON ファイルに対応するパッセージ embedding を読み込む（なければ None）。"""
+    from pdf.passages import load_passage_embeddings, passage_embeddings_mtime
+
+    stamp = passage_embeddings_mtime(f)
+    if stamp is None:
+        return None
+    key = str(f.resolve()) + "#passages"
+    hit = _EMBEDDING_CACHE.get(key)
+    if hit is not None and hit[0] == stamp:
+        return hit[1]
+    matrix = load_passage_embeddings(f)
+    _EMBEDDING_CACHE[key] = (stamp, matrix)
+    return matrix
+
+
+def _has_passage_embeddings(directory: str) -> bool:
+    from pdf.passages import passage_embeddings_mtime
+    return any(passage_embeddings_mtime(f) is not None for f in find_files(directory, {".json"}))
+
+
+def _roll_up_passages(results: list[dict], top_k: int, per_page: int) -> list[dict]:
+    """スコア降順のパッセージを、同じページからは per_page 件までにして上位 top_k 件を返す。"""
+    counts = {}
+    rolled = []
+    for r in results:
+        key = (r["file"], r["page"])
+        if counts.get(key, 0) >= per_page:
+            continue
+        counts[key] = counts.get(key, 0) + 1
+        rolled.append(r)
+        if len(rolled) >= top_k:
+            break
+    return rolled
+
+
+def _passage_search_root(directory: str, terms: list[str], query_embedding, top_k: int, per_page: int,
+                         semantic_weight: float, keyword_weight: float, corpus: dict = None,
+                         filters: dict = None) -> list[dict]:
+    import numpy as np
+    from pdf.passages import PassageIndex
+
+    base = Path(directory)
+    json_files = find_files(directory, {".json"})
+    include = _facet_include(directory, json_files, filters)
+    scores = {}  # key: (file, ドキュメント内のパッセージ番号) -> [semantic, keyword]
+
+    # 1. キーワード検索（パッセージの転置インデックスによる BM25F）
+    if terms:
+        index = PassageIndex(base)
+        try:
+            _sync_keyword_index(index, base, json_files)
+            hits = index.search(terms, corpus, include)
+        except Exception as e:
+            sys.stderr.write(f"パッセージインデックスを使用できません: {e}\n")
+            hits = []
+        finally:
+            index.close()
+        for h in hits:
+            scores.setdefault((str(base / h["path"]), h["ord"]), [0.0, 0.0])[1] = h["score"]
+
+    # 2. セマンティック検索（ファイルごとの上位候補。本文の変更で古くなった行は使わない）
+    if query_embedding is not None:
+        candidates = top_k * per_page
+        for f in json_files:
+            rel = f.relative_to(base).as_posix()
+            if include is not None and rel not in include:
+                continue
+            matrix = _load_passage_matrix(f)
+            if matrix is None or len(matrix) == 0:
+                continue
+            passages = _load_passages(f)
+            sims = matrix.scores(query_embedding)
+            if include is not None:
+                pages = include[rel]
+                sims = np.where([page in pages for page in matrix.page_numbers], sims, -np.inf)
+            top = np.argsort(-sims)[:candidates]
+            for ord_ in top.tolist():
+                if np.isfinite(sims[ord_]) and ord_ < len(passages) and passages[ord_][2] == matrix.texts[ord_]:
+                    scores.setdefault((str(f), ord_), [0.0, 0.0])[0] = float(sims[ord_])
+
+    # 3. スコア統合（パッセージ embedding がなければキーワードスコアのみ）
+    results = []
+    for (file, ord_), (semantic, keyword) in scores.items():
+        passages = _load_passages(Path(file))
+        if ord_ >= len(passages):
+            continue
+        page, number, text = passages[ord_]
+        if query_embedding is None:
+            combined = keyword
+        else:
+            combined = semantic * semantic_weight + keyword * keyword_weight
+        if combined > 0.01:
+            results.append({
+                "file": file,
+                "page": page,
+                "passage": number + 1,
+                "text": text,
+                "score": round(combined, 4),
+                "semantic_score": round(semantic, 4),
+                "keyword_score": round(keyword, 4),
+            })
+
+    results.sort(key=lambda x: -x["score"])
+    return _roll_up_passages(results, top_k, per_page)
+
+
+def passage_search(query: str, directory, top_k: int = 5, per_page: int = 1,
+                   semantic_weight: float = 0.6, keyword_weight: float = 0.4,
+                   filters: dict = None) -> list[dict]:
+    """パッセージ単位でハイブリッド検索し、統合スコア降順の上位 top_k 件のパッセージを返す。
+
+    同じページのパッセージは per_page 件までにまとめる（ページへのロールアップ）。
+    パッセージ embedding（pdf.migration で生成）がどのルートにもなければキーワードスコアだけで並べ、
+    クエリの embedding も生成しない。filters を渡すと、一致するページのパッセージだけを検索する。
+    """
+    from pdf.facets import filters_key
+    from pdf.passages import PassageIndex
+
+    terms = query.lower().split()
+    roots = _roots(directory)
+    per_page = max(1, per_page)
+
+    def compute():
+        corpus = _global_keyword_stats(roots, terms, PassageIndex)
+        query_embedding = None
+        if any(_has_passage_embeddings(r) for r in roots):
+            query_embedding = _embed_query(query)
+        results = [
+            r for found in _scatter(
+                _passage_search_root, roots, terms, query_embedding, top_k, per_page,
+                semantic_weight, keyword_weight, corpus, filters,
+            )
+            for r in found
+        ]
+        results.sort(key=lambda x: -x["score"])
+        return _roll_up_passages(results, top_k, per_page)
+
+    options = {"top_k": top_k, "per_page": per_page,
+               "semantic_weight": semantic_weight, "keyword_weight": keyword_weight,
+               "model": _load_embedding_model(), "dimensions": _load_embedding_dimensions(),
+               "filters": filters_key(filters)}
+    return _cached_results("passages", query, roots, options, compute)
+
+
+def cmd_passages(query: str, directory, top_k: int = 5, per_page: int = 1,
+                 semantic_weight: float = 0.6, keyword_weight: float = 0.4, filters: dict = None):
+    """パッセージ検索（質問に答える段落をページ番号・ファイルと一緒に表示する）。"""
+    results = passage_search(query, directory, top_k, per_page, semantic_weight, keyword_weight,
+                             filters=filters)
+
+    if not results:
+        print(f"「{query}」に一致するパッセージが見つかりませんでした。")
+        return
+
+    print(f"「{query}」のパッセージ検索結果: {len(results)} 件\n")
+    for r in results:
+        print(f"  [score: {r['score']:.4f} (sem:{r['semantic_score']:.3f} kw:{r['keyword_score']:.3f})] "
+              f"{r['file']} - Page {r['page']} (passage {r['passage']})")
+        for line in r["text"].splitlines():
+            print(f"    {line}")
+        print()
+
+
 # ─── get_page ───────────────────────────────────
 
-def cmd_get_page(json_file: str, page_num: int, directory: str):
-    """指定した JSON ファイルの指定ページの全文 (content) を出力する。"""
-    target = Path(json_file)
-    if not target.is_absolute():
-        candidates = list(Path(directory).rglob(json_file))
-        candidates = [c for c in candidates if not c.name.endswith("_embeddings.json")]
+def _resolve_file(name: str, directory: str, exclude_derived: bool = False):
+    """<dir>/.index/pages/ のファイル名対応表からファイルを探す。
+
+    索引にない（または索引を使えない）場合だけツリーを走査し、見つけたファイルを登録する。
+    """
+    from pdf.page_index import PageIndex, INDEXED_EXTENSIONS
+
+    base = Path(directory)
+    index = PageIndex(base)
+    try:
+        try:
+            found = index.resolve(name)
+        except Exception:
+            found = None
+        if found is not None:
+            return found
+        candidates = [c for c in base.rglob(name) if c.is_file()]
+        if exclude_derived:
+            candidates = [c for c in candidates if not is_derived_file(c)]
         if not candidates:
-            print(f"ファイル '{json_file}' が見つかりません。")
-            return
+            return None
         target = candidates[0]
+        # 次回から走査せずに引けるよう登録しておく
+        if target.suffix.lower() in INDEXED_EXTENSIONS and not is_derived_file(target) \
+                and not is_hidden_path(target, base):
+            try:
+                index.update_file(target)
+            except Exception:
+                pass
+        return target
+    finally:
+        index.close()
+
+
+def resolve_json_file(json_file: str, directory: str):
+    """ファイル名（または相対パス）から対象の JSON ファイルを探す。見つからなければ None。"""
+    target = Path(json_file)
+    if target.is_absolute():
+        return target
+    return _resolve_file(json_file, directory, exclude_derived=True)
+
+
+def _locate_json_file(json_file: str, directory):
+    """各ルートを順に探し、(JSON ファイル, そのルート) を返す。見つからなければ (None, None)。"""
+    for root in _roots(directory):
+        target = resolve_json_file(json_file, root)
+        if target is not None:
+            return target, root
+    return None, None
+
+
+def load_page(target: Path, page_num: int, directory: str):
+    """JSON ファイルの指定ページを読む。(エントリ, 利用可能なページ番号) を返す。
+
+    ページ索引のオフセットから 1 ページ分だけ読み、索引を使えなければ全体を読み込む。
+    ページがなければエントリは None、ページ配列でなければ None を返す。
+    """
+    from pdf.page_index import PageIndex
+
+    index = PageIndex(Path(directory))
+    try:
+        return index.read_page(target, page_num)
+    except Exception:
+        pass
+    finally:
+        index.close()
+
+    data = _read_json(target)
+    if not isinstance(data, list):
+        return None
+    pages = [e.get("page") for e in data]
+    for entry in data:
+        if entry.get("page") == page_num:
+            return entry, pages
+    return None, pages
+
+
+def load_summaries(target: Path, directory: str):
+    """JSON ファイルの [(page, summary)] を返す（ページ配列でなければ None）。"""
+    from pdf.page_index import PageIndex
+
+    index = PageIndex(Path(directory))
+    try:
+        return index.read_summaries(target)
+    except Exception:
+        pass
+    finally:
+        index.close()
+
+    data = _read_json(target)
+    if not isinstance(data, list):
+        return None
+    return [(entry.get("page", "?"), entry.get("summary")) for entry in data]
+
+
+def cmd_get_page(json_file: str, page_num: int, directory):
+    """指定した JSON ファイルの指定ページの全文 (content) を出力する。"""
+    target, root = _locate_json_file(json_file, directory)
+    if target is None:
+        print(f"ファイル '{json_file}' が見つかりません。")
+        return
 
     try:
-        with open(target, "r", encoding="utf-8") as fh:
-            data = json.load(fh)
+        loaded = load_page(target, page_num, root)
     except Exception as e:
         print(f"ファイル読み込みエラー: {e}")
         return
 
-    if not isinstance(data, list):
+    if loaded is None:
         print("不正な JSON 形式です。")
         return
 
-    for entry in data:
-        if entry.get("page") == page_num:
-            print(f"=== {target.name} - Page {page_num} ===\n")
-            print(f"Summary: {entry.get('summary', '')}\n")
-
-            # メタデータがあれば表示
-            metadata = entry.get("metadata", {})
-            if metadata:
-                topics = metadata.get("topics", [])
-                keywords = metadata.get("keywords", [])
-                if topics:
-                    print(f"Topics: {', '.join(topics)}")
-                if keywords:
-                    print(f"Keywords: {', '.join(keywords)}")
-                print()
+    entry, pages = loaded
+    if entry is None:
+        print(f"Page {page_num} が '{target.name}' に見つかりません。")
+        print(f"利用可能なページ: {pages}")
+        return
 
-            print(f"--- Content ---\n")
-            print(entry.get("content", "(空)"))
-            return
+    print(f"=== {target.name} - Page {page_num} ===\n")
+    print(f"Summary: {entry.get('summary', '')}\n")
+
+    # メタデータがあれば表示
+    metadata = entry.get("metadata", {})
+    if metadata:
+        topics = metadata.get("topics", [])
+        keywords = metadata.get("keywords", [])
+        if topics:
+            print(f"Topics: {', '.join(topics)}")
+        if keywords:
+            print(f"Keywords: {', '.join(keywords)}")
+        print()
 
-    print(f"Page {page_num} が '{target.name}' に見つかりません。")
-    print(f"利用可能なページ: {[e.get('page') for e in data]}")
+    print(f"--- Content ---\n")
+    print(entry.get("content", "(空)"))
 
 
 # ─── summaries ──────────────────────────────────
 
-def cmd_summaries(json_file: str, directory: str):
+def cmd_summaries(json_file: str, directory):
     """指定した JSON ファイルの全ページのサマリー一覧を表示する。"""
-    target = Path(json_file)
-    if not target.is_absolute():
-        candidates = list(Path(directory).rglob(json_file))
-        candidates = [c for c in candidates if not c.name.endswith("_embeddings.json")]
-        if not candidates:
-            print(f"ファイル '{json_file}' が見つかりません。")
-            return
-        target = candidates[0]
+    target, root = _locate_json_file(json_file, directory)
+    if target is None:
+        print(f"ファイル '{json_file}' が見つかりません。")
+        return
 
     try:
-        with open(target, "r", encoding="utf-8") as fh:
-            data = json.load(fh)
+        summaries = load_summaries(target, root)
     except Exception as e:
         print(f"ファイル読み込みエラー: {e}")
         return
 
-    if not isinstance(data, list):
+    if summaries is None:
         print("不正な JSON 形式です。")
         return
 
-    print(f"=== {target.name} 全ページサマリー ({len(data)} ページ) ===\n")
-    for entry in data:
-        page = entry.get("page", "?")
-        summary = entry.get("summary", "(要約なし)")
-        print(f"  Page {page}: {summary}")
+    print(f"=== {target.name} 全ページサマリー ({len(summaries)} ページ) ===\n")
+    for page, summary in summaries:
+        print(f"  Page {page}: {summary if summary is not None else '(要約なし)'}")
     print()
 
 
 # ─── read_file ──────────────────────────────────
 
-def cmd_read_file(file_path: str, directory: str):
+def cmd_read_file(file_path: str, directory):
     """テキストファイル（md/csv/txt）の内容を表示する。"""
     target = Path(file_path)
     if not target.is_absolute():
-        candidates = list(Path(directory).rglob(file_path))
-        if not candidates:
+        roots = _roots(directory)
+        target = next((t for t in (_resolve_file(file_path, r) for r in roots) if t is not None), None)
+        if target is None:
             # ファイル名だけでも検索
             name_only = Path(file_path).name
-            candidates = list(Path(directory).rglob(name_only))
-        if not candidates:
+            target = next((t for t in (_resolve_file(name_only, r) for r in roots) if t is not None), None)
+        if target is None:
             print(f"ファイル '{file_path}' が見つかりません。")
             return
-        target = candidates[0]
 
     try:
-        with open(target, "r", encoding="utf-8") as fh:
-            content = fh.read()
+        content = _read_text(target)
     except Exception as e:
         print(f"ファイル読み込みエラー: {e}")
         return
@@ -671,32 +1484,59 @@ def cmd_read_file(file_path: str, directory: str):
 
 # ─── main ───────────────────────────────────────
 
-def main():
-    parser = argparse.ArgumentParser(description="database/ 横断検索ツール")
+def run(argv: list[str] = None):
+    """コマンドラインを解釈してコマンドを実行する（常駐デーモンからも呼ばれる）。"""
+    parser = argparse.ArgumentParser(prog="search_json.py", description="database/ 横断検索ツール")
     parser.add_argument("command",
                         choices=["list", "search", "get_page", "summaries",
-                                 "read_file", "keywords", "semantic", "hybrid"],
+                                 "read_file", "keywords", "semantic", "hybrid", "passages"],
                         help="実行するコマンド")
     parser.add_argument("args", nargs="*", help="コマンド引数")
-    parser.add_argument("--dir", default="database",
-                        help="検索対象ディレクトリ (default: database)")
+    parser.add_argument("--dir", action="append", default=None,
+                        help="検索対象ディレクトリ。複数回指定すると並列に横断検索する (default: database)")
     parser.add_argument("--top-k", type=int, default=5,
                         help="返す結果の最大数 (default: 5)")
     parser.add_argument("--semantic-weight", type=float, default=0.6,
-                        help="ハイブリッド検索のセマンティック重み (default: 0.6)")
+                        help="hybrid / passages のセマンティック重み (default: 0.6)")
     parser.add_argument("--keyword-weight", type=float, default=0.4,
-                        help="ハイブリッド検索のキーワード重み (default: 0.4)")
-
-    args = parser.parse_args()
-    directory = args.dir
+                        help="hybrid / passages のキーワード重み (default: 0.4)")
+    parser.add_argument("--page-type", action="append", default=None,
+                        help="search/semantic/hybrid/passages をページ種別で絞り込む "
+                             "(troubleshooting など。カンマ区切り・複数指定は OR)")
+    parser.add_argument("--section", action="append", default=None,
+                        help="セクション見出しに部分一致するページに絞り込む")
+    parser.add_argument("--doc", action="append", default=None,
+                        help="ドキュメント（ファイル名・相対パス・フォルダ）で絞り込む")
+    parser.add_argument("--top", type=int, default=None,
+                        help="keywords で出現ページ数の多い順に上位 N 件だけを表示する")
+    parser.add_argument("--per-page", type=int, default=1,
+                        help="passages で同じページから返すパッセージの最大数 (default: 1)")
+    parser.add_argument("--index", choices=["exact", "ann", "quantized"], default="exact",
+                        help="semantic/hybrid のベクトル検索方式 (default: exact)")
+    parser.add_argument("--nprobe", type=int, default=None,
+                        help="--index ann で探索するクラスタ数 (default: 8)")
+    parser.add_argument("--report-recall", action="store_true",
+                        help="--index ann の semantic で厳密検索に対する recall を表示する")
+    parser.add_argument("--rerank", type=int, default=None,
+                        help="--index quantized で float32 再スコアリングする上位候補数 (default: 50, 0 で無効)")
+    parser.add_argument("--no-daemon", action="store_true",
+                        help="常駐デーモンを使わずにこのプロセス内で実行する")
+
+    args = parser.parse_args(argv)
+    directory = _roots(args.dir or ["database"])
+    from pdf.facets import parse_filters
+    filters = parse_filters(args.page_type, args.section, args.doc)
 
     if args.command == "list":
-        cmd_list(directory)
+        for root in directory:
+            if len(directory) > 1:
+                print(f"##### {root} #####\n")
+            cmd_list(root)
     elif args.command == "search":
         if not args.args:
             print("検索キーワードを指定してください。")
             sys.exit(1)
-        cmd_search(" ".join(args.args), directory)
+        cmd_search(" ".join(args.args), directory, filters)
     elif args.command == "get_page":
         if len(args.args) < 2:
             print("Usage: get_page <json_file> <page_number>")
@@ -713,12 +1553,23 @@ def main():
             sys.exit(1)
         cmd_read_file(args.args[0], directory)
     elif args.command == "keywords":
-        cmd_keywords(directory)
+        for root in directory:
+            if len(directory) > 1:
+                print(f"##### {root} #####\n")
+            cmd_keywords(root, top=args.top, docs=filters.get("doc"))
     elif args.command == "semantic":
         if not args.args:
             print("検索クエリを指定してください。")
             sys.exit(1)
-        cmd_semantic_search(" ".join(args.args), directory, top_k=args.top_k)
+        cmd_semantic_search(
+            " ".join(args.args), directory,
+            top_k=args.top_k,
+            index_mode=args.index,
+            nprobe=args.nprobe,
+            report_recall=args.report_recall,
+            rerank=args.rerank,
+            filters=filters,
+        )
     elif args.command == "hybrid":
         if not args.args:
             print("検索クエリを指定してください。")
@@ -728,8 +1579,36 @@ def main():
             top_k=args.top_k,
             semantic_weight=args.semantic_weight,
             keyword_weight=args.keyword_weight,
+            index_mode=args.index,
+            nprobe=args.nprobe,
+            rerank=args.rerank,
+            filters=filters,
+        )
+    elif args.command == "passages":
+        if not args.args:
+            print("検索クエリを指定してください。")
+            sys.exit(1)
+        cmd_passages(
+            " ".join(args.args), directory,
+            top_k=args.top_k,
+            per_page=args.per_page,
+            semantic_weight=args.semantic_weight,
+            keyword_weight=args.keyword_weight,
+            filters=filters,
         )
 
 
+def main():
+    argv = sys.argv[1:]
+    # 常駐デーモンが起動していればそちらで実行する（起動していなければプロセス内で実行）
+    if "--no-daemon" not in argv:
+        sys.path.insert(0, str(Path(__file__).resolve().parent))
+        from search_daemon import run_remote
+        code = run_remote(argv)
+        if code is not None:
+            sys.exit(code)
+    run(argv)
+
+
 if __name__ == "__main__":
     main()